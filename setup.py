@@ -138,6 +138,7 @@ setup(
     entry_points={
         'console_scripts': [
             'manhole-cli = manhole.cli:main',
+            'manhole-snapshot = manhole.snapshot:main',
         ]
     },
     keywords=['debugging', 'manhole', 'thread', 'socket', 'unix domain socket'],
@@ -1,6 +1,7 @@
 import atexit
 import code
 import errno
+import importlib
 import os
 import signal
 import socket
@@ -8,11 +9,14 @@ import struct
 import sys
 import traceback
 from contextlib import closing
+from contextlib import nullcontext
 
 __version__ = '1.8.1'
 
 from io import TextIOWrapper
 
+from . import channel
+
 try:
     import signalfd
 except ImportError:
@@ -64,6 +68,10 @@ _ORIGINAL_THREAD = _get_original('threading', 'Thread')
 _ORIGINAL_EVENT = _get_original('threading', 'Event')
 _ORIGINAL__ACTIVE = _get_original('threading', '_active')
 _ORIGINAL_SLEEP = _get_original('time', 'sleep')
+_ORIGINAL_MONOTONIC = _get_original('time', 'monotonic')
+_ORIGINAL_SELECT = _get_original('select', 'select')
+_ORIGINAL_GET_IDENT = _get_original('_thread', 'get_ident')
+_ORIGINAL_GET_NATIVE_ID = _get_original('threading', 'get_native_id')
 
 try:
     import ctypes
@@ -88,6 +96,34 @@ except ImportError:
         pass
 
 
+def set_thread_scheduling(priority=None, affinity=None):
+    """
+    Changes the scheduling of the calling thread: *priority* is ``"idle"`` (``SCHED_IDLE``, only runs when a CPU would
+    otherwise be idle) or a nice value and *affinity* is the set of CPUs the thread may run on. Threads started
+    afterwards by this thread inherit these.
+
+    Only Linux can do this per-thread. Failures are logged, not raised.
+    """
+    if priority is None and affinity is None:
+        return
+    if not sys.platform.startswith('linux'):
+        _LOG('WARNING: thread_priority and thread_affinity are only supported on Linux.')
+        return
+    native_id = _ORIGINAL_GET_NATIVE_ID()
+    try:
+        if priority == 'idle':
+            os.sched_setscheduler(native_id, os.SCHED_IDLE, os.sched_param(0))
+        elif priority is not None:
+            os.setpriority(os.PRIO_PROCESS, native_id, priority)
+    except OSError as exc:
+        _LOG(f'WARNING: Failed to set the priority of the thread to {priority!r}: {exc!r}')
+    try:
+        if affinity is not None:
+            os.sched_setaffinity(native_id, affinity)
+    except OSError as exc:
+        _LOG(f'WARNING: Failed to set the CPU affinity of the thread to {affinity!r}: {exc!r}')
+
+
 if sys.platform == 'darwin' or sys.platform.startswith('freebsd'):
     _PEERCRED_LEVEL = getattr(socket, 'SOL_LOCAL', 0)
     _PEERCRED_OPTION = getattr(socket, 'LOCAL_PEERCRED', 1)
@@ -148,9 +184,14 @@ class ManholeThread(_ORIGINAL_THREAD):
             when calling ``start()``.
         bind_delay (float): Seconds to delay socket binding. Default: `no delay`.
         daemon_connection (bool): The connection thread is daemonic (dies on app exit). Default: ``False``.
+        priority (str or int): ``"idle"`` or a nice value for this thread and the connection threads. Default: leave it
+            alone.
+        affinity (set of ints): CPUs this thread and the connection threads may run on. Default: leave it alone.
     """
 
-    def __init__(self, get_socket, sigmask, start_timeout, connection_handler, bind_delay=None, daemon_connection=False):
+    def __init__(
+        self, get_socket, sigmask, start_timeout, connection_handler, bind_delay=None, daemon_connection=False, priority=None, affinity=None
+    ):
         super().__init__()
         self.daemon = True
         self.daemon_connection = daemon_connection
@@ -164,10 +205,43 @@ class ManholeThread(_ORIGINAL_THREAD):
         self.bind_delay = bind_delay
         self.connection_handler = connection_handler
         self.get_socket = get_socket
+        self.priority = priority
+        self.affinity = affinity
         self.should_run = False
+        # self-pipe used to wake up the thread when it's waiting for connections
+        self.wakeup_fds = None
+        self.wakeup_lock = _ORIGINAL_ALLOCATE_LOCK()
 
-    def stop(self):
+    def stop(self, timeout=None):
+        """
+        Makes the thread exit as soon as it's done with the current connection (if any). If *timeout* is given then wait
+        at most that many seconds for the thread to exit.
+        """
         self.should_run = False
+        with self.wakeup_lock:  # the thread might be closing the pipe, don't write in a reused fd
+            if self.wakeup_fds:
+                try:
+                    os.write(self.wakeup_fds[1], b'x')
+                except OSError:
+                    pass
+        if timeout is not None and self.is_alive() and self.ident != _ORIGINAL_GET_IDENT():
+            self.join(timeout)
+            if self.is_alive():
+                _LOG(f'WARNING: Waited {timeout} seconds but Manhole thread is still running (busy with a connection).')
+
+    def close(self):
+        """
+        Releases the wakeup pipe. The thread does this when it exits, otherwise only call this when the thread is not
+        running (e.g. after a fork).
+        """
+        with self.wakeup_lock:
+            if self.wakeup_fds:
+                for fd in self.wakeup_fds:
+                    try:
+                        os.close(fd)
+                    except OSError:
+                        pass
+                self.wakeup_fds = None
 
     def clone(self, **kwargs):
         """
@@ -179,11 +253,14 @@ class ManholeThread(_ORIGINAL_THREAD):
             self.start_timeout,
             connection_handler=self.connection_handler,
             daemon_connection=self.daemon_connection,
+            priority=self.priority,
+            affinity=self.affinity,
             **kwargs,
         )
 
     def start(self):
         self.should_run = True
+        self.wakeup_fds = os.pipe()
         super().start()
         if not self.serious.wait(self.start_timeout):
             _LOG(f"WARNING: Waited {self.start_timeout} seconds but Manhole thread didn't start yet :(")
@@ -199,26 +276,35 @@ class ManholeThread(_ORIGINAL_THREAD):
         if signalfd and self.sigmask:
             signalfd.sigprocmask(signalfd.SIG_BLOCK, self.sigmask)
         pthread_setname_np(self.ident, self.psname)
+        set_thread_scheduling(self.priority, self.affinity)  # inherited by the connection threads
 
         if self.bind_delay:
             _LOG(f'Delaying UDS binding {self.bind_delay} seconds ...')
             _ORIGINAL_SLEEP(self.bind_delay)
 
         sock = self.get_socket()
-        while self.should_run:
-            _LOG(f'Waiting for new connection (in pid:{os.getpid()}) ...')
-            try:
-                client = ManholeConnectionThread(sock.accept()[0], self.connection_handler, self.daemon_connection)
-                client.start()
-                client.join()
-            except socket.timeout:
-                continue
-            except (OSError, InterruptedError) as e:
-                if e.errno != errno.EINTR:
-                    raise
-                continue
-            finally:
-                client = None
+        wakeup_fd = self.wakeup_fds[0]
+        try:
+            while self.should_run:
+                _LOG(f'Waiting for new connection (in pid:{os.getpid()}) ...')
+                try:
+                    if wakeup_fd in _ORIGINAL_SELECT([sock, wakeup_fd], [], [])[0]:
+                        break
+                    client = ManholeConnectionThread(sock.accept()[0], self.connection_handler, self.daemon_connection)
+                    client.start()
+                    client.join()
+                except socket.timeout:
+                    continue
+                except (OSError, InterruptedError) as e:
+                    if e.errno != errno.EINTR:
+                        raise
+                    continue
+                finally:
+                    client = None
+        finally:
+            sock.close()
+            self.close()  # release() doesn't close the pipe if it gave up waiting for this thread
+            _LOG('Manhole thread stopped.')
 
 
 class ManholeConnectionThread(_ORIGINAL_THREAD):
@@ -241,7 +327,7 @@ class ManholeConnectionThread(_ORIGINAL_THREAD):
         pid, _, _ = check_credentials(self.client)
         pthread_setname_np(self.ident, b'Manhole < PID:%d' % pid)
         try:
-            self.connection_handler(self.client)
+            handle_connection(self.client, self.connection_handler)
         except BaseException as exc:
             _LOG(f'ManholeConnectionThread failure: {exc!r}')
 
@@ -261,6 +347,76 @@ def check_credentials(client):
     return pid, uid, gid
 
 
+def read_request(client, timeout):
+    """
+    Reads the request line a structured client (like ``manhole-cli --top``) sends right after connecting. Returns a
+    ``(name, kwargs)`` tuple or ``None`` if the client didn't send a request within *timeout* seconds.
+    """
+    deadline = _ORIGINAL_MONOTONIC() + timeout
+    if not _ORIGINAL_SELECT([client], [], [], timeout)[0]:
+        return None
+    while True:
+        peeked = client.recv(len(channel.PREFIX), socket.MSG_PEEK)
+        if peeked == channel.PREFIX:
+            break
+        if not peeked or not channel.PREFIX.startswith(peeked) or _ORIGINAL_MONOTONIC() > deadline:
+            return None
+        _ORIGINAL_SLEEP(0.001)  # only part of the prefix arrived, wait for the rest
+    line = b''
+    while not line.endswith(b'\n'):
+        if len(line) > channel.MAX_REQUEST_SIZE:
+            raise channel.ProtocolError('Request line is too long.')
+        chunk = client.recv(1)
+        if not chunk:
+            break
+        line += chunk
+    return channel.parse_request(line)
+
+
+def handle_connection(client, connection_handler):
+    """
+    Runs the request the client asked for or falls back to *connection_handler*.
+
+    Structured requests are only served with the default REPL handler: a custom handler decides what the clients can do.
+    ``manhole-cli`` sends a ``repl`` request for the interactive prompt so it doesn't wait for the *request_timeout*.
+    """
+    client.settimeout(None)
+    request = read_request(client, _MANHOLE.request_timeout)
+    if request is None or request[0] == 'repl':
+        connection_handler(client)
+    elif connection_handler is not handle_connection_repl:
+        with closing(client):
+            _LOG(f'Refusing {request[0]!r} request, the connection handler is {connection_handler!r}.')
+            channel.send_message(client, {'error': 'Structured requests are only served by the default REPL connection handler.'})
+    else:
+        handle_connection_request(client, *request)
+
+
+def handle_connection_request(client, name, kwargs):
+    """
+    Alternate connection handler for structured requests. See :mod:`manhole.channel`.
+    """
+    with closing(client):
+        try:
+            module_name, _, function_name = _REQUEST_HANDLERS[name].partition(':')
+        except KeyError:
+            _LOG(f'Unknown request {name!r}.')
+            channel.send_message(client, {'error': f'Unknown request {name!r}.'})
+            return
+        _LOG(f'Handling {name!r} request.')
+        try:
+            getattr(importlib.import_module(module_name), function_name)(client, **kwargs)
+        except (BrokenPipeError, ConnectionResetError):
+            _LOG(f'Request {name!r} client disconnected')
+        except Exception as exc:
+            _LOG(f'Request {name!r} failed with {exc!r}.')
+            try:
+                channel.send_message(client, {'error': repr(exc)})
+            except OSError:
+                pass
+        _LOG('DONE.')
+
+
 def handle_connection_exec(client):
     """
     Alternate connection handler. No output redirection.
@@ -272,8 +428,12 @@ def handle_connection_exec(client):
     def exit():
         raise ExitExecLoop
 
+    from .guard import CommandLimitExceeded
+    from .guard import make_guard
+
     client.settimeout(None)
     fh = client.makefile()
+    guard = make_guard()
 
     with closing(client):
         with closing(fh):
@@ -281,10 +441,18 @@ def handle_connection_exec(client):
                 payload = fh.readline()
                 while payload:
                     _LOG(f'Running: {payload!r}.')
-                    eval(compile(payload, '<manhole>', 'exec'), {'exit': exit}, _MANHOLE.locals)
+                    try:
+                        with guard or nullcontext():
+                            eval(compile(payload, '<manhole>', 'exec'), {'exit': exit}, _MANHOLE.locals)
+                    except CommandLimitExceeded:
+                        _LOG(guard.reason)
+                        client.sendall(f'{guard.reason}\n'.encode())
                     payload = fh.readline()
             except ExitExecLoop:
                 _LOG('Exiting exec loop.')
+            finally:
+                if guard is not None:
+                    guard.close()
 
 
 def handle_connection_repl(client: socket.socket):
@@ -337,27 +505,104 @@ def handle_connection_repl(client: socket.socket):
 
 
 _CONNECTION_HANDLER_ALIASES = {'repl': handle_connection_repl, 'exec': handle_connection_exec}
+# These are imported on demand, no need to have them loaded in every process that installs the manhole.
+_REQUEST_HANDLERS = {
+    'top': 'manhole.top:handle_request',
+    'query': 'manhole.query:handle_request',
+    'stalls': 'manhole.stalls:handle_request',
+    'perf': 'manhole.perf:handle_request',
+    'download': 'manhole.download:handle_request',
+    'run': 'manhole.upload:handle_request',
+    'tail': 'manhole.tail:handle_request',
+}
 
 
 class ManholeConsole(code.InteractiveConsole):
-    def __init__(self, *args, **kw):
+    def __init__(self, *args, guard=None, **kw):
         code.InteractiveConsole.__init__(self, *args, **kw)
         if _MANHOLE.redirect_stderr:
             self.file = sys.stderr
         else:
             self.file = sys.stdout
+        self.guard = guard
 
     def write(self, data):
         self.file.write(data)
 
+    def runcode(self, code):
+        """
+        Like ``InteractiveConsole.runcode`` but with the limits of the *guard* (see :mod:`manhole.guard`).
+        """
+        if self.guard is None:
+            return super().runcode(code)
+        from .guard import CommandLimitExceeded
 
-def handle_repl(locals):
+        try:
+            with self.guard:
+                exec(code, self.locals)  # noqa: S102
+        except SystemExit:
+            raise
+        except CommandLimitExceeded:
+            _LOG(self.guard.reason)
+            self.showtraceback()
+            self.write(f'{self.guard.reason}\n')
+        except BaseException:
+            self.showtraceback()
+
+    def raw_input(self, prompt=''):
+        from .completion import REQUEST
+        from .completion import handle_request
+
+        line = input(prompt)
+        while line.startswith(REQUEST):  # manhole-cli asking for completions, see manhole.completion
+            handle_request(line, self.locals, sys.stdout)
+            line = input()
+        return line
+
+
+def get_namespace(locals):
     """
-    Dumps stacktraces and runs an interactive prompt (REPL).
+    Returns the names available in the REPL (and to queries): the helpers plus the user's *locals*.
     """
-    dump_stacktraces()
+    from .download import download
+    from .gcpauses import gc_monitor
+    from .gcpauses import gc_pauses
+    from .gil import gil_probe
+    from .greenlets import dump_greenlets
+    from .greenlets import hub_blocks
+    from .locks import lock_monitor
+    from .locks import lock_report
+    from .memory import malloc_stats
+    from .perf import perf_status
+    from .perf import perf_trampoline
+    from .perf import perf_window
+    from .profiler import profile_all
+    from .refpath import ref_paths
+    from .snapshot import snapshot
+    from .stalls import stalls
+    from .tasks import asyncio_tasks
+    from .tracer import trace_latency
+
     namespace = {
+        'asyncio_tasks': asyncio_tasks,
+        'download': download,
+        'dump_greenlets': dump_greenlets,
         'dump_stacktraces': dump_stacktraces,
+        'gc_monitor': gc_monitor,
+        'gc_pauses': gc_pauses,
+        'gil_probe': gil_probe,
+        'hub_blocks': hub_blocks,
+        'lock_monitor': lock_monitor,
+        'lock_report': lock_report,
+        'malloc_stats': malloc_stats,
+        'perf_status': perf_status,
+        'perf_trampoline': perf_trampoline,
+        'perf_window': perf_window,
+        'profile_all': profile_all,
+        'ref_paths': ref_paths,
+        'snapshot': snapshot,
+        'stalls': stalls,
+        'trace_latency': trace_latency,
         'sys': sys,
         'os': os,
         'socket': socket,
@@ -365,11 +610,25 @@ def handle_repl(locals):
     }
     if locals:
         namespace.update(locals)
+    return namespace
+
+
+def handle_repl(locals):
+    """
+    Dumps stacktraces and runs an interactive prompt (REPL).
+    """
+    from .guard import make_guard
+
+    dump_stacktraces()
+    namespace = get_namespace(locals)
+    guard = make_guard()
     try:
-        ManholeConsole(namespace).interact()
+        ManholeConsole(namespace, guard=guard).interact()
     except SystemExit:
         pass
     finally:
+        if guard is not None:
+            guard.close()
         for attribute in ['last_type', 'last_value', 'last_traceback']:
             try:
                 delattr(sys, attribute)
@@ -421,16 +680,27 @@ _LOG = Logger()
 class Manhole:
     # Manhole core configuration
     # These are initialized when manhole is installed.
+    command_max_rss_growth = None
+    command_timeout = None
     daemon_connection = False
+    hub_watchdog = None
+    instrument_locks = False
     locals = None
     original_os_fork = None
     original_os_forkpty = None
     redirect_stderr = True
     reinstall_delay = 0.5
+    request_timeout = 0.05
     should_restart = None
     sigmask = _ALL_SIGNALS
     socket_path = None
+    stack_dump_fd = None
+    stack_dump_on = None
+    stall_watchdog = None
     start_timeout = 0.5
+    stop_timeout = 1.0
+    thread_affinity = None
+    thread_priority = None
     connection_handler = None
     previous_signal_handlers = None
     _thread = None
@@ -449,6 +719,14 @@ class Manhole:
         daemon_connection=False,
         redirect_stderr=True,
         connection_handler=handle_connection_repl,
+        hub_watchdog=None,
+        instrument_locks=False,
+        stack_dump_on=None,
+        stall_watchdog=None,
+        command_timeout=None,
+        command_max_rss_growth=None,
+        thread_priority=None,
+        thread_affinity=None,
     ):
         self.socket_path = socket_path
         self.reinstall_delay = reinstall_delay
@@ -457,6 +735,12 @@ class Manhole:
         self.sigmask = sigmask
         self.daemon_connection = daemon_connection
         self.start_timeout = start_timeout
+        self.command_timeout = command_timeout
+        self.command_max_rss_growth = command_max_rss_growth
+        if thread_priority not in (None, 'idle') and not isinstance(thread_priority, int):
+            raise ValueError(f'thread_priority must be "idle" or a nice value, not {thread_priority!r}.')
+        self.thread_priority = thread_priority
+        self.thread_affinity = None if thread_affinity is None else set(thread_affinity)
         self.previous_signal_handlers = {}
         self.connection_handler = _CONNECTION_HANDLER_ALIASES.get(connection_handler, connection_handler)
 
@@ -476,6 +760,30 @@ class Manhole:
                 )
             self.previous_signal_handlers.setdefault(activate_on, signal.signal(activate_on, self.activate_on_signal))
 
+        if stack_dump_on is not None:
+            stack_dump_on = getattr(signal, 'SIG' + stack_dump_on) if isinstance(stack_dump_on, string) else stack_dump_on
+            if stack_dump_on in (activate_on, oneshot_on):
+                raise ConfigurationConflict('You cannot dump the stacks on the same signal that activates the Manhole !')
+            self.stack_dump_on = stack_dump_on
+            self.register_stack_dump()
+            atexit.register(self.remove_stack_dump)
+
+        if hub_watchdog is not None:
+            from .greenlets import HubWatchdog
+
+            self.hub_watchdog = HubWatchdog(hub_watchdog).start()
+
+        if instrument_locks:
+            from .locks import instrument
+
+            instrument()
+            self.instrument_locks = True
+
+        if stall_watchdog is not None:
+            from .stalls import StallWatchdog
+
+            self.stall_watchdog = StallWatchdog(stall_watchdog).start()
+
         atexit.register(self.remove_manhole_uds)
         if patch_fork:
             if activate_on is None and oneshot_on is None and socket_path is None:
@@ -490,8 +798,23 @@ class Manhole:
 
     def release(self):
         if self._thread:
-            self._thread.stop()
+            self._thread.stop(self.stop_timeout)
+            if not self._thread.is_alive():
+                self._thread.close()
             self._thread = None
+        if self.hub_watchdog is not None:
+            self.hub_watchdog.stop()
+            self.hub_watchdog = None
+        if self.instrument_locks:
+            from .locks import uninstrument
+
+            uninstrument()
+            self.instrument_locks = False
+        if self.stall_watchdog is not None:
+            self.stall_watchdog.stop()
+            self.stall_watchdog = None
+        self.remove_stack_dump()
+        self.stack_dump_on = None  # otherwise reinstall() would register it again in forked children
         self.remove_manhole_uds()
         self.restore_os_fork_functions()
         for sig, handler in self.previous_signal_handlers.items():
@@ -502,7 +825,13 @@ class Manhole:
     def thread(self):
         if self._thread is None:
             self._thread = ManholeThread(
-                self.get_socket, self.sigmask, self.start_timeout, self.connection_handler, daemon_connection=self.daemon_connection
+                self.get_socket,
+                self.sigmask,
+                self.start_timeout,
+                self.connection_handler,
+                daemon_connection=self.daemon_connection,
+                priority=self.thread_priority,
+                affinity=self.thread_affinity,
             )
         return self._thread
 
@@ -524,9 +853,19 @@ class Manhole:
         """
         with _LOCK:
             if not (self.thread.is_alive() and self.thread in _ORIGINAL__ACTIVE):
+                # the pipe was inherited from the parent process, the thread that used it doesn't exist here
+                self.thread.wakeup_lock = _ORIGINAL_ALLOCATE_LOCK()  # might have been held by a thread of the parent
+                self.thread.close()
                 self.thread = self.thread.clone(bind_delay=self.reinstall_delay)
                 if self.should_restart:
                     self.thread.start()
+        if self.stack_dump_on is not None:
+            # the inherited handler still writes in the parent's file
+            self.register_stack_dump()
+        if self.hub_watchdog is not None and not self.hub_watchdog.thread.is_alive():
+            self.hub_watchdog.restart()
+        if self.stall_watchdog is not None and not self.stall_watchdog.thread.is_alive():
+            self.stall_watchdog.restart()
 
     def handle_oneshot(self, _signum=None, _frame=None):
         try:
@@ -535,7 +874,7 @@ class Manhole:
                 _LOG(f'Waiting for new connection (in pid:{os.getpid()}) ...')
                 client = force_original_socket(sock.accept()[0])
                 check_credentials(client)
-                self.connection_handler(client)
+                handle_connection(client, self.connection_handler)
             finally:
                 self.remove_manhole_uds()
         except BaseException as exc:  # pylint: disable=W0702
@@ -548,6 +887,32 @@ class Manhole:
             os.unlink(name)
         return name
 
+    def register_stack_dump(self):
+        import faulthandler
+
+        fd = os.open(self.stack_dump_name, os.O_WRONLY | os.O_CREAT | os.O_APPEND | os.O_CLOEXEC, 0o600)
+        faulthandler.register(self.stack_dump_on, file=fd, all_threads=True)
+        if self.stack_dump_fd is not None:
+            os.close(self.stack_dump_fd)
+        self.stack_dump_fd = fd
+        _LOG(f'Stacks will be dumped in {self.stack_dump_name} on signal {self.stack_dump_on}.')
+
+    def remove_stack_dump(self):
+        if self.stack_dump_fd is None:
+            return
+        import faulthandler
+
+        faulthandler.unregister(self.stack_dump_on)
+        os.close(self.stack_dump_fd)
+        self.stack_dump_fd = None
+        name = self.stack_dump_name
+        if os.path.exists(name):
+            os.unlink(name)
+
+    @property
+    def stack_dump_name(self):
+        return f'/tmp/manhole-{os.getpid()}-stacks'
+
     @property
     def uds_name(self):
         if self.socket_path is None:
@@ -620,6 +985,26 @@ def install(
         redirect_stderr (bool): Redirect output from stderr to manhole console. Default: ``True``.
         connection_handler (function): Connection handler to use. Use ``"exec"`` for simple implementation without
             output redirection or your own function. (warning: this is for advanced users). Default: ``"repl"``.
+        hub_watchdog (float): Record the greenlets (gevent or eventlet) that block the hub for longer than this many
+            seconds. Must be installed from the thread that runs the hub. See ``hub_blocks()``. Default: ``None``.
+        instrument_locks (bool): Replace ``threading.Lock`` and ``threading.RLock`` with instrumented wrappers right
+            away, so the locks created from now on can be monitored with ``lock_monitor()``. Default: ``False``.
+        stack_dump_on (int or signal name): Set to ``"USR2"`` or some other signal name, or a number if you want
+            ``faulthandler`` to dump the stacks of all threads in ``/tmp/manhole-<pid>-stacks`` when this signal is
+            sent. This works even if the GIL is held by some C code (see the ``--stack-dump-on`` option of
+            ``manhole-cli``). Default: ``None``.
+        stall_watchdog (float): Record the stacks of all threads when the main thread or the event loop doesn't
+            respond for longer than this many seconds. See ``stalls()`` and ``manhole.stalls.heartbeat()``. Default:
+            ``None``.
+        command_timeout (float): Interrupt the commands that run in the manhole (REPL lines, ``exec`` handler payloads
+            and ``manhole-cli -e`` expressions) after this many seconds. Default: ``None``.
+        command_max_rss_growth (int): Interrupt the commands that grow the RSS of the process by more than this many
+            bytes. Default: ``None``.
+        thread_priority (str or int): Run the Manhole thread and the connection threads (and so the commands and
+            helpers run in the manhole) with ``SCHED_IDLE`` (``"idle"``) or with this nice value (eg: ``19``). Linux
+            only. Default: ``None``.
+        thread_affinity (list of ints): Pin the Manhole thread and the connection threads to these CPUs. Linux only.
+            Default: ``None``.
     """
     # pylint: disable=W0603
     global _MANHOLE
@@ -639,17 +1024,40 @@ def install(
     return _MANHOLE
 
 
-def dump_stacktraces():
+def dump_stacktraces(show_locals=False, match=None, max_repr=100, max_total=64 * 1024, repr_types=()):
     """
     Dumps thread ids and tracebacks to stdout.
+
+    Args:
+        show_locals (bool): Also dump the locals of the frames. Values are shown with a cheap and bounded ``repr``
+            that only calls the ``__repr__`` of builtin types (see :mod:`manhole.saferepr`).
+        match (str or list of str): Only dump the locals of the frames where ``module.function`` matches one of these
+            globs (eg: ``"myapp.*"`` or ``"*.handle_request"``).
+        max_repr (int): Maximum size of the ``repr`` of each value.
+        max_total (int): Stop dumping locals after this many characters.
+        repr_types (tuple of types): Other types that can use their own ``__repr__``.
     """
+    if show_locals:
+        from .saferepr import SafeRepr
+        from .saferepr import format_locals
+        from .saferepr import frame_matches
+
+        safe_repr = SafeRepr(max_repr, types=repr_types)
+        patterns = [match] if isinstance(match, str) else match
+        budget = max_total
     lines = []
     for thread_id, stack in sys._current_frames().items():  # pylint: disable=W0212
         lines.append(f'\n######### ProcessID={os.getpid()}, ThreadID={thread_id} #########')
-        for filename, lineno, name, line in traceback.extract_stack(stack):
+        frames = list(traceback.walk_stack(stack))
+        frames.reverse()
+        for (frame, _), (filename, lineno, name, line) in zip(frames, traceback.StackSummary.extract(frames)):
             lines.append('File: "%s", line %d, in %s' % (filename, lineno, name))
             if line:
                 lines.append(f'  {line.strip()}')
+            if show_locals and (not patterns or frame_matches(frame, patterns)):
+                local_lines, budget = format_locals(frame, safe_repr, budget)
+                lines.extend(f'    {local_line}' for local_line in local_lines)
+        del frames
     lines.append('#############################################\n\n')
 
     print('\n'.join(lines), file=sys.stderr if _MANHOLE.redirect_stderr else sys.stdout)
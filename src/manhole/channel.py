@@ -0,0 +1,110 @@
+"""
+Framing used between the manhole and ``manhole-cli`` for anything that isn't the plain text REPL.
+
+A client that wants a structured request (instead of the interactive console) sends a single request line right after
+connecting::
+
+    \\x00manhole:<name> <json object with arguments>\\n
+
+The server then answers with frames. A frame is a 5 byte header (one byte kind, four bytes big-endian payload length)
+followed by the payload. Plain socket clients (``socat``, ``netcat``) never send the ``\\x00`` prefix so they keep
+getting the REPL.
+"""
+
+import json
+import struct
+
+PREFIX = b'\x00manhole:'
+HEADER = struct.Struct('!cI')
+MAX_REQUEST_SIZE = 64 * 1024
+
+#: Frame payload is a JSON encoded object.
+MESSAGE = b'j'
+#: Frame payload is raw bytes.
+DATA = b'd'
+#: Frame payload is utf8 text (usually output).
+TEXT = b't'
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def format_request(name, **kwargs):
+    """
+    Builds a request line.
+    """
+    return PREFIX + name.encode('ascii') + b' ' + json.dumps(kwargs, separators=(',', ':')).encode('utf8') + b'\n'
+
+
+def parse_request(line):
+    """
+    Parses a request line (as built by :func:`format_request`) into a ``(name, kwargs)`` tuple.
+    """
+    if not line.startswith(PREFIX) or not line.endswith(b'\n'):
+        raise ProtocolError(f'Malformed request: {line[:100]!r}')
+    name, _, arguments = line[len(PREFIX) : -1].partition(b' ')
+    kwargs = json.loads(arguments) if arguments.strip() else {}
+    if not isinstance(kwargs, dict):
+        raise ProtocolError(f'Request arguments must be an object, got: {arguments[:100]!r}')
+    return name.decode('ascii'), kwargs
+
+
+def send_frame(sock, kind, payload):
+    header = HEADER.pack(kind, len(payload))
+    if len(payload) < 65536:
+        # small frames go out in a single syscall
+        sock.sendall(header + payload)
+    else:
+        sock.sendall(header)
+        sock.sendall(payload)
+
+
+def send_message(sock, message):
+    send_frame(sock, MESSAGE, json.dumps(message, separators=(',', ':'), default=repr).encode('utf8'))
+
+
+def recv_exactly(sock, size):
+    """
+    Reads exactly *size* bytes. Returns ``None`` if the connection was closed before anything was read.
+    """
+    chunks = []
+    remaining = size
+    while remaining:
+        chunk = sock.recv(min(remaining, 1024**2))
+        if not chunk:
+            if remaining == size:
+                return None
+            raise ProtocolError(f'Connection closed after reading {size - remaining} of {size} bytes.')
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_frame(sock):
+    """
+    Reads a frame. Returns a ``(kind, payload)`` tuple, or ``(None, None)`` if the connection was closed.
+
+    ``MESSAGE`` payloads are decoded from JSON.
+    """
+    header = recv_exactly(sock, HEADER.size)
+    if header is None:
+        return None, None
+    kind, size = HEADER.unpack(header)
+    payload = recv_exactly(sock, size) if size else b''
+    if payload is None:
+        raise ProtocolError('Connection closed before reading frame payload.')
+    if kind == MESSAGE:
+        payload = json.loads(payload)
+    return kind, payload
+
+
+def iter_frames(sock):
+    """
+    Yields ``(kind, payload)`` tuples until the connection is closed.
+    """
+    while True:
+        kind, payload = recv_frame(sock)
+        if kind is None:
+            return
+        yield kind, payload
@@ -2,9 +2,13 @@
 
 import argparse
 import errno
+import json
 import os
+import queue
 import re
 import readline
+import select
+import shutil
 import signal
 import socket
 import sys
@@ -80,21 +84,183 @@ group.add_argument(
 group.add_argument(
     '-s', '--signal', dest='signal', type=parse_signal, metavar='SIGNAL', help='Send the given SIGNAL to the process before connecting.'
 )
+parser.add_argument(
+    '--stack-dump-on',
+    dest='stack_dump_on',
+    type=parse_signal,
+    metavar='SIGNAL',
+    help="If the prompt doesn't arrive within the timeout send the given SIGNAL to the process and show the stacks "
+    'that faulthandler dumps (the manhole must be installed with the same stack_dump_on signal).',
+)
+mode = parser.add_mutually_exclusive_group()
+mode.add_argument(
+    '--top',
+    dest='top',
+    action='store_true',
+    help='Show a live view of threads (sorted by CPU usage), GC activity and RSS instead of the interactive prompt.',
+)
+mode.add_argument(
+    '-e',
+    '--eval',
+    dest='expressions',
+    action='append',
+    metavar='EXPR',
+    help='Evaluate EXPR in the process and print the result as a JSON line (repeat to evaluate more, in the same '
+    'namespace) instead of the interactive prompt.',
+)
+
+mode.add_argument(
+    '--stalls',
+    dest='stalls',
+    action='store_true',
+    help='Show the stalls recorded by the stall watchdog (see the stall_watchdog option) instead of the interactive prompt.',
+)
+mode.add_argument(
+    '--perf-window',
+    dest='perf_window',
+    type=float,
+    metavar='SECONDS',
+    help='Turn on the perf trampoline (Python 3.12+) in the process for SECONDS so "perf record" can see the Python '
+    'functions, instead of the interactive prompt.',
+)
+mode.add_argument(
+    '--download',
+    dest='download',
+    metavar='NAME',
+    help='Download the data staged with download(obj, NAME) in the process, instead of the interactive prompt.',
+)
+mode.add_argument(
+    '--run',
+    dest='run',
+    metavar='SCRIPT',
+    help='Run SCRIPT in the process (as __main__, with the REPL helpers) and show what it prints, instead of the '
+    'interactive prompt. The compiled code is cached in the process, unchanged scripts are not sent again.',
+)
+mode.add_argument(
+    '--inject',
+    dest='inject',
+    metavar='MODULE',
+    help='Load the MODULE file in the process as a module (named after the file, replacing the one in sys.modules), '
+    'instead of the interactive prompt.',
+)
+mode.add_argument(
+    '--tail',
+    dest='tail',
+    action='store_true',
+    help='Show the logging records and the output of the process as they come, instead of the interactive prompt. '
+    'Records are dropped if they come faster than they can be shown.',
+)
+parser.add_argument(
+    '--top-interval',
+    dest='top_interval',
+    default=1.0,
+    type=float,
+    metavar='SECONDS',
+    help='How often --top refreshes. Default: %(default)s seconds.',
+)
+parser.add_argument(
+    '--tail-level',
+    dest='tail_level',
+    default='INFO',
+    metavar='LEVEL',
+    help='Only show the records at LEVEL or above with --tail. Default: %(default)s.',
+)
+parser.add_argument(
+    '--tail-sample',
+    dest='tail_sample',
+    default=1.0,
+    type=float,
+    metavar='RATE',
+    help='Only show this fraction of the records with --tail. Default: %(default)s.',
+)
+parser.add_argument(
+    '-o',
+    '--output',
+    dest='output',
+    metavar='PATH',
+    help='Where to write what --download gets. Default: NAME in the current directory.',
+)
+
+
+class Completer:
+    """
+    Readline completer that gets the names from the process (see :mod:`manhole.completion`).
+
+    Attribute listings are cached for the whole session. The top level names are fetched again after each line that
+    is sent.
+    """
+
+    banner = '(ManholeConsole)'
+
+    def __init__(self, sock, timeout):
+        self.sock = sock
+        self.timeout = timeout
+        self.enabled = False  # only the REPL console understands the requests
+        self.cache = {}
+        self.replies = queue.Queue()
+        self.request_id = 0
+        self.matches = []
+
+    def invalidate(self):
+        self.cache.pop('', None)
+
+    def fetch(self, expression):
+        names = self.cache.get(expression)
+        if names is not None:
+            return names
+        from manhole.completion import format_request
+
+        self.request_id += 1
+        self.sock.sendall(format_request(self.request_id, expression).encode('utf8'))
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                reply = self.replies.get(timeout=max(deadline - time.time(), 0.001))
+            except queue.Empty:
+                return []
+            if reply.get('id') == self.request_id:  # older replies arrived too late
+                break
+        names = self.cache[expression] = reply.get('names', [])
+        return names
+
+    def complete(self, text, state):
+        if state == 0:
+            self.matches = []
+            if self.enabled:
+                expression, dot, attribute = text.rpartition('.')
+                self.matches = [
+                    f'{expression}{dot}{name}'
+                    for name in self.fetch(expression)
+                    if name.startswith(attribute) and (attribute or not name.startswith('_'))
+                ]
+        try:
+            return self.matches[state]
+        except IndexError:
+            return None
 
 
 class ConnectionHandler(threading.Thread):
-    def __init__(self, sock, is_closing):
+    def __init__(self, sock, is_closing, completer):
         super().__init__()
         self.sock = sock
         self.is_closing = is_closing
+        self.completer = completer
 
     def run(self):
+        from manhole.completion import split_replies
+
+        pending = ''
         while True:
             try:
                 data = self.sock.recv(1024**2)
                 if not data:
                     break
-                sys.stdout.write(data.decode('utf8'))
+                output, replies, pending = split_replies(pending + data.decode('utf8'))
+                for reply in replies:
+                    self.completer.replies.put(reply)
+                if not self.completer.enabled and self.completer.banner in output:
+                    self.completer.enabled = True
+                sys.stdout.write(output)
                 sys.stdout.flush()
                 readline.redisplay()
             except socket.timeout:
@@ -105,40 +271,361 @@ class ConnectionHandler(threading.Thread):
             os.kill(os.getpid(), signal.SIGINT)
 
 
-def main():
-    args = parser.parse_args()
+def format_size(size):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if abs(size) < 1024 or unit == 'GiB':
+            break
+        size /= 1024.0
+    return f'{size:.1f} {unit}'
 
-    histfile = os.path.join(os.path.expanduser('~'), '.manhole_history')
+
+def render_top(state, width, height):
+    """
+    Renders the state maintained from ``--top`` diffs as a list of lines.
+    """
+    threads = sorted(state.get('threads', {}).items(), key=lambda item: item[1].get('cpu') or 0, reverse=True)
+    process_cpu = state.get('cpu')
+    gc_state = state.get('gc', {})
+    gc_delta = gc_state.get('delta') or {}
+    lines = [
+        'PID: {} | RSS: {} | CPU: {} | threads: {}'.format(
+            state.get('pid'),
+            format_size(state['rss']) if state.get('rss') is not None else '-',
+            '-' if process_cpu is None else f'{process_cpu:.1f}%',
+            len(threads),
+        ),
+        'GC: counts {} | collections {} | collected {} | uncollectable {}'.format(
+            '/'.join(str(i) for i in gc_state.get('count', ())),
+            '/'.join(f'+{i}' for i in gc_delta.get('collections', ())) or '-',
+            f"+{gc_delta['collected']}" if 'collected' in gc_delta else '-',
+            f"+{gc_delta['uncollectable']}" if 'uncollectable' in gc_delta else '-',
+        ),
+        '',
+        f'{"CPU%":>6}  {"TID":>8}  {"THREAD":<24}  WHERE',
+    ]
+    for _, thread in threads[: max(height - len(lines) - 1, 1)]:
+        cpu = thread.get('cpu')
+        lines.append(
+            '{:>6}  {:>8}  {:<24.24}  {}'.format(
+                '-' if cpu is None else f'{cpu:.1f}',
+                thread.get('native_id') or '-',
+                thread.get('name', '?'),
+                thread.get('where', '?'),
+            )
+        )
+    return [line[:width] for line in lines]
+
+
+def run_top(sock, interval):
+    from manhole.channel import format_request
+    from manhole.channel import iter_frames
+    from manhole.top import apply_diff
+
+    sock.settimeout(None)
+    sock.sendall(format_request('top', interval=interval))
+    state = {}
     try:
-        readline.read_history_file(histfile)
-    except OSError:
+        for _, changes in iter_frames(sock):
+            if 'error' in changes:
+                print(f"Request failed: {changes['error']}", file=sys.stderr)
+                sys.exit(1)
+            apply_diff(state, changes)
+            width, height = shutil.get_terminal_size()
+            sys.stdout.write('\x1b[H\x1b[J' + '\n'.join(render_top(state, width, height)) + '\n')
+            sys.stdout.flush()
+    except KeyboardInterrupt:
         pass
-    import atexit
+    finally:
+        sock.close()
 
-    atexit.register(readline.write_history_file, histfile)
-    del histfile
 
-    if args.signal:
-        os.kill(args.pid, args.signal)
+def run_query(sock, expressions):
+    from manhole.channel import format_request
+    from manhole.channel import iter_frames
+
+    sock.settimeout(None)
+    sock.sendall(format_request('query', expressions=expressions))
+    failed = False
+    with sock:
+        for _, result in iter_frames(sock):
+            print(json.dumps(result))
+            failed = failed or 'error' in result
+    if failed:
+        sys.exit(1)
+
+
+def render_stalls(result):
+    """
+    Renders the result of a ``stalls`` request as a list of lines.
+    """
+    stalls = result['stalls']
+    source = {'heartbeat': 'heartbeat()', 'event loop': 'the event loop'}.get(result['source'], 'nothing yet')
+    lines = [f"Threshold: {result['threshold']}s | heartbeat from: {source} | stalls: {len(stalls)}"]
+    for stall in stalls:
+        started = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stall['started']))
+        duration = 'still stalled' if stall['duration'] is None else f"stalled for {stall['duration']:.3f}s"
+        lines.append(f'\n######### {started} {duration} #########')
+        for name, stack in stall['stacks'].items():
+            lines.append(f'--- {name} ---')
+            lines.extend(f'  {entry}' for entry in stack)
+    return lines
+
+
+def run_stalls(sock):
+    from manhole.channel import format_request
+    from manhole.channel import recv_frame
+
+    sock.settimeout(None)
+    sock.sendall(format_request('stalls'))
+    with sock:
+        _, result = recv_frame(sock)
+    if result is None or 'error' in result:
+        print(f"Request failed: {result and result['error']}", file=sys.stderr)
+        sys.exit(1)
+    print('\n'.join(render_stalls(result)))
+
 
+def run_perf_window(sock, duration):
+    from manhole.channel import format_request
+    from manhole.channel import iter_frames
+
+    sock.settimeout(None)
+    sock.sendall(format_request('perf', duration=duration))
+    try:
+        for _, result in iter_frames(sock):
+            if 'error' in result:
+                print(f"Request failed: {result['error']}", file=sys.stderr)
+                sys.exit(1)
+            if 'duration' not in result:
+                print(
+                    f"Perf trampoline is on for {duration} seconds, run eg: perf record -F 99 -g -p {result['pid']} -- sleep {duration:g}"
+                )
+                continue
+            perf_map = result['map']
+            state = 'still on (it was on before)' if result['active'] else 'off'
+            print(
+                f"Perf trampoline {state} after {result['duration']:.1f} seconds. {perf_map['path']}: {perf_map['size']} bytes, "
+                f"{perf_map['entries']} entries ({result['entries_added']} new)."
+            )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+
+
+def run_download(sock, name, output):
+    import zlib
+
+    from manhole.channel import DATA
+    from manhole.channel import format_request
+    from manhole.channel import iter_frames
+
+    sock.settimeout(None)
+    sock.sendall(format_request('download', key=name))
+    path = output or os.path.basename(name)
+    partial = f'{path}.part'
     start = time.time()
-    uds_path = f'/tmp/manhole-{args.pid}'
+    received = crc = 0
+    result = None
+    try:
+        with sock, open(partial, 'wb') as fh:
+            for kind, payload in iter_frames(sock):
+                if kind == DATA:
+                    fh.write(payload)
+                    received += len(payload)
+                    crc = zlib.crc32(payload, crc)
+                elif 'error' in payload:
+                    print(f"Request failed: {payload['error']}", file=sys.stderr)
+                    sys.exit(1)
+                elif 'crc32' in payload:
+                    result = payload
+        if result is None:
+            print(f'Download failed: connection closed after {received} bytes.', file=sys.stderr)
+            sys.exit(1)
+        if (received, crc) != (result['size'], result['crc32']):
+            print(
+                f"Download failed: got {received} bytes with CRC-32 {crc:08x}, expected {result['size']} bytes with CRC-32 "
+                f"{result['crc32']:08x}.",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+        os.replace(partial, path)
+    finally:
+        if os.path.exists(partial):
+            os.unlink(partial)
+    elapsed = time.time() - start
+    print(f'Downloaded {name!r} to {path!r}: {format_size(received)} in {elapsed:.2f}s ({format_size(received / (elapsed or 1))}/s).')
+
+
+def run_file(sock, path, module=None):
+    import hashlib
+
+    from manhole.channel import DATA
+    from manhole.channel import TEXT
+    from manhole.channel import format_request
+    from manhole.channel import iter_frames
+    from manhole.channel import send_frame
+
+    with open(path, 'rb') as fh:
+        source = fh.read()
+    sock.settimeout(None)
+    sock.sendall(format_request('run', digest=hashlib.sha256(source).hexdigest(), filename=os.path.basename(path), module=module))
+    result = None
+    with sock:
+        for kind, payload in iter_frames(sock):
+            if kind == TEXT:
+                sys.stdout.write(payload.decode('utf8'))
+                sys.stdout.flush()
+            elif 'elapsed' in payload:
+                result = payload
+            elif 'error' in payload:
+                print(f"Request failed: {payload['error']}", file=sys.stderr)
+                sys.exit(1)
+            elif not payload['cached']:
+                send_frame(sock, DATA, source)
+    if result is None:
+        print('Request failed: connection closed.', file=sys.stderr)
+        sys.exit(1)
+    what = f'Injected {module!r}' if module else f'Ran {path!r}'
+    cached = ' (cached)' if result['cached'] else ''
+    if 'error' in result:
+        print(f"{what} failed after {result['elapsed']:.3f}s{cached}: {result['error']}", file=sys.stderr)
+        sys.exit(1)
+    print(f"{what} in {result['elapsed']:.3f}s{cached}.", file=sys.stderr)
+
+
+def format_tail_record(record):
+    if record['source'] != 'log':
+        return record['message']
+    created = record['time']
+    timestamp = f"{time.strftime('%H:%M:%S', time.localtime(created))}.{int(created % 1 * 1000):03}"
+    line = f"{timestamp} {record['level']:<8} {record['logger']}: {record['message']}\n"
+    if 'exception' in record:
+        line += f"{record['exception']}\n"
+    return line
+
+
+def run_tail(sock, level, sample):
+    from manhole.channel import format_request
+    from manhole.channel import iter_frames
+
+    sock.settimeout(None)
+    sock.sendall(format_request('tail', level=level, sample=sample))
+    dropped = 0
+    try:
+        for _, message in iter_frames(sock):
+            if 'error' in message:
+                print(f"Request failed: {message['error']}", file=sys.stderr)
+                sys.exit(1)
+            if 'records' not in message:
+                print(f"Tailing the output and the {message['logger']!r} logger records at {message['level']} or above.", file=sys.stderr)
+                continue
+            for record in message['records']:
+                (sys.stderr if record['source'] == 'stderr' else sys.stdout).write(format_tail_record(record))
+            sys.stdout.flush()
+            sys.stderr.flush()
+            if message['dropped'] != dropped:
+                print(f"[{message['dropped'] - dropped} records dropped]", file=sys.stderr)
+                dropped = message['dropped']
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+
+
+def dump_stacks(pid, signum, timeout):
+    """
+    Makes faulthandler dump the stacks (see the ``stack_dump_on`` option) and prints what it wrote.
+    """
+    path = f'/tmp/manhole-{pid}-stacks'
+    try:
+        fh = open(path, 'rb')
+    except OSError:
+        print(f'There is no {path!r}, the manhole must be installed with stack_dump_on.', file=sys.stderr)
+        return
+    with fh:
+        fh.seek(0, os.SEEK_END)
+        os.kill(pid, signum)
+        stacks = b''
+        start = time.time()
+        while time.time() - start < timeout:
+            time.sleep(0.1)
+            data = fh.read()
+            if data:
+                stacks += data
+            elif stacks:  # done writing
+                break
+    if stacks:
+        print(f"The prompt didn't arrive in {timeout} seconds, stacks dumped by faulthandler:", file=sys.stderr)
+        print(stacks.decode('utf8', 'replace'), file=sys.stderr)
+    else:
+        print(f'No stacks were dumped in {path!r}.', file=sys.stderr)
+
+
+def connect(pid, timeout):
+    start = time.time()
+    uds_path = f'/tmp/manhole-{pid}'
     sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-    sock.settimeout(args.timeout)
-    while time.time() - start < args.timeout:
+    sock.settimeout(timeout)
+    while time.time() - start < timeout:
         try:
             sock.connect(uds_path)
         except Exception as exc:
             if exc.errno not in (errno.ENOENT, errno.ECONNREFUSED):
                 print(f'Failed to connect to {uds_path!r}: {exc!r}', file=sys.stderr)
         else:
-            break
+            return sock
     else:
         print(f'Failed to connect to {uds_path!r}: Timeout', file=sys.stderr)
         sys.exit(5)
 
+
+def main():
+    args = parser.parse_args()
+
+    if args.signal:
+        os.kill(args.pid, args.signal)
+
+    sock = connect(args.pid, args.timeout)
+    if args.top:
+        return run_top(sock, args.top_interval)
+    if args.expressions:
+        return run_query(sock, args.expressions)
+    if args.stalls:
+        return run_stalls(sock)
+    if args.perf_window is not None:
+        return run_perf_window(sock, args.perf_window)
+    if args.download is not None:
+        return run_download(sock, args.download, args.output)
+    if args.run is not None:
+        return run_file(sock, args.run)
+    if args.inject is not None:
+        return run_file(sock, args.inject, module=os.path.splitext(os.path.basename(args.inject))[0])
+    if args.tail:
+        return run_tail(sock, args.tail_level, args.tail_sample)
+
+    from manhole.channel import format_request
+
+    sock.sendall(format_request('repl'))  # so the manhole doesn't wait to see if a request comes
+    if args.stack_dump_on and not select.select([sock], [], [], args.timeout)[0]:
+        dump_stacks(args.pid, args.stack_dump_on, args.timeout)
+
+    histfile = os.path.join(os.path.expanduser('~'), '.manhole_history')
+    try:
+        readline.read_history_file(histfile)
+    except OSError:
+        pass
+    import atexit
+
+    atexit.register(readline.write_history_file, histfile)
+    del histfile
+
+    completer = Completer(sock, args.timeout)
+    readline.set_completer(completer.complete)
+    readline.parse_and_bind('bind ^I rl_complete' if 'libedit' in (readline.__doc__ or '') else 'tab: complete')
+
     is_closing = threading.Event()
-    thread = ConnectionHandler(sock, is_closing)
+    thread = ConnectionHandler(sock, is_closing, completer)
     thread.start()
 
     try:
@@ -146,6 +633,7 @@ def main():
             data = input()
             data += '\n'
             sock.sendall(data.encode('utf8'))
+            completer.invalidate()
     except (EOFError, KeyboardInterrupt):
         pass
     finally:
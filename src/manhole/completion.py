@@ -0,0 +1,92 @@
+"""
+Tab completion for ``manhole-cli``, done in the process.
+
+The completions travel in-band, on the REPL connection. ``manhole-cli`` sends a request line instead of a line of
+input::
+
+    \\x00manhole:complete {"id": 1, "expression": "app"}\\n
+
+and the console answers (instead of running it) with all the attributes of that object (or all the names available
+if the expression is empty)::
+
+    \\x00manhole:completions {"id": 1, "expression": "app", "names": ["config", "connections", ...]}\\n
+
+The client filters the names itself and caches them for the rest of the session (except the top level names, they
+change with every line that runs). Plain socket clients never send the ``\\x00`` prefix so nothing changes for them.
+
+Like ``rlcompleter``, only attribute lookups are evaluated (no calls or subscripts) but properties still run.
+``rlcompleter`` itself isn't used: importing it replaces the completer of ``readline``.
+"""
+
+import builtins
+import json
+import keyword
+import re
+
+REQUEST = '\x00manhole:complete '
+REPLY = '\x00manhole:completions '
+# only plain attribute chains are evaluated
+ATTRIBUTES = re.compile(r'^[A-Za-z_]\w*(\.[A-Za-z_]\w*)*$')
+
+
+def format_request(request_id, expression):
+    return f'{REQUEST}{json.dumps({"id": request_id, "expression": expression})}\n'
+
+
+def list_names(expression, namespace):
+    """
+    Returns the names available in *namespace* (if *expression* is empty) or the attributes of what *expression*
+    evaluates to.
+    """
+    if not expression:
+        return sorted(set(namespace) | set(dir(builtins)) | set(keyword.kwlist))
+    if not ATTRIBUTES.match(expression):
+        return []
+    try:
+        obj = eval(expression, namespace)
+    except Exception:
+        return []
+    names = set(dir(obj))
+    if hasattr(obj, '__class__'):
+        names.add('__class__')
+        for cls in getattr(obj.__class__, '__mro__', ()):
+            names.update(dir(cls))
+    return sorted(names)
+
+
+def split_replies(text):
+    """
+    Splits the replies out of the console output. Returns the output, the decoded replies and the start of an
+    unfinished reply (to be prepended to the next chunk of output).
+    """
+    output = []
+    replies = []
+    while True:
+        start = text.find('\x00')
+        if start == -1:
+            output.append(text)
+            return ''.join(output), replies, ''
+        output.append(text[:start])
+        end = text.find('\n', start)
+        if end == -1:
+            return ''.join(output), replies, text[start:]
+        line = text[start:end]
+        if line.startswith(REPLY):
+            replies.append(json.loads(line[len(REPLY) :]))
+        else:
+            output.append(line + '\n')
+        text = text[end + 1 :]
+
+
+def handle_request(line, namespace, file):
+    """
+    Writes the reply for a request *line* (as sent by :func:`format_request`, without the newline).
+    """
+    try:
+        request = json.loads(line[len(REQUEST) :])
+        expression = request['expression']
+        reply = {'id': request['id'], 'expression': expression, 'names': list_names(expression, namespace)}
+    except (ValueError, KeyError, TypeError) as exc:
+        reply = {'id': None, 'error': repr(exc)}
+    file.write(f'{REPLY}{json.dumps(reply)}\n')
+    file.flush()
@@ -0,0 +1,163 @@
+"""
+Bulk data export: ``download()`` in the REPL and ``manhole-cli --download``.
+
+``download(obj, name)`` only stages the data under *name*: buffers (``bytes``, ``bytearray``, ``array``, ``mmap``,
+numpy arrays, anything that supports the buffer protocol) are kept as a ``memoryview`` and files (a path or an open
+file) as a file descriptor. ``manhole-cli PID --download NAME`` then sends a ``download`` request and gets the data in
+``DATA`` frames, sent straight from the memoryview or read from the file in chunks (``os.pread``) so it's never copied
+as a whole or turned into a repr. The last message has the size and the CRC-32 of what was sent.
+
+Staged data (and the file descriptors) are kept until downloaded or replaced by staging something else under the same
+name.
+"""
+
+import os
+import stat
+import zlib
+
+from . import _ORIGINAL_ALLOCATE_LOCK
+
+CHUNK_SIZE = 4 * 1024**2
+
+_STAGED = {}
+_LOCK = _ORIGINAL_ALLOCATE_LOCK()
+
+
+class Staged:
+    """
+    Something staged for download: either a ``memoryview`` of bytes (*view*) or a file descriptor (*fd*).
+    """
+
+    def __init__(self, name, source, view=None, fd=None):
+        self.name = name
+        self.source = source
+        self.view = view
+        self.fd = fd
+
+    @property
+    def size(self):
+        if self.view is None:
+            return os.fstat(self.fd).st_size
+        return self.view.nbytes
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+        if self.view is not None:
+            self.view.release()
+
+
+def _stage(obj, name):
+    if isinstance(obj, (str, os.PathLike)):
+        fd = os.open(obj, os.O_RDONLY)
+        source = os.fspath(obj)
+    elif hasattr(obj, 'fileno'):
+        if hasattr(obj, 'flush'):
+            obj.flush()
+        fd = os.dup(obj.fileno())  # the file might get closed before the download
+        source = repr(obj)
+    else:
+        try:
+            view = memoryview(obj)
+        except TypeError:
+            raise TypeError(
+                f'Cannot download {type(obj).__name__!r} objects, expected a path, a file or an object supporting the buffer protocol.'
+            ) from None
+        if not view.c_contiguous:
+            view = memoryview(view.tobytes())  # this one has to be copied
+        return Staged(name, f'{type(obj).__name__} {view.format!r} {list(view.shape)}', view=view.cast('B'))
+    if not stat.S_ISREG(os.fstat(fd).st_mode):
+        os.close(fd)
+        raise ValueError(f'{source} is not a regular file.')
+    return Staged(name, source, fd=fd)
+
+
+def download(obj, name=None):
+    """
+    Stages *obj* (a path, an open file or a buffer) for ``manhole-cli PID --download NAME``.
+
+    Args:
+        obj: What to download.
+        name (str): The name to download it by (also the default output file name). Default: the file name for files,
+            the type name for buffers.
+
+    Returns the name, the size and the command that downloads it.
+    """
+    if name is None:
+        name = os.path.basename(os.fspath(obj)) if isinstance(obj, (str, os.PathLike)) else f'{type(obj).__name__}.bin'
+    staged = _stage(obj, name)
+    with _LOCK:
+        previous = _STAGED.get(name)
+        _STAGED[name] = staged
+    if previous is not None:
+        previous.close()
+    return {
+        'name': name,
+        'size': staged.size,
+        'source': staged.source,
+        'command': f'manhole-cli {os.getpid()} --download {name}',
+    }
+
+
+def _read_chunk(fd, offset, length):
+    # check the size first: the file might have been truncated since it was staged
+    size = os.fstat(fd).st_size
+    if size < offset + length:
+        raise RuntimeError(f'File got truncated while sending it ({size} bytes left, expected {offset + length}).')
+    chunk = os.pread(fd, length, offset)
+    if len(chunk) != length:
+        raise RuntimeError(f'File got truncated while sending it ({offset + len(chunk)} bytes left, expected {offset + length}).')
+    return chunk
+
+
+def send_staged(sock, staged, chunk_size=None):
+    """
+    Sends the data in ``DATA`` frames of up to *chunk_size* bytes (default: ``CHUNK_SIZE``). Returns the size and the
+    CRC-32 of the data.
+
+    Files are read with ``os.pread`` and a chunk is only sent once it was read completely, so a file that gets truncated
+    meanwhile raises ``RuntimeError`` between two frames (and the client gets an error message).
+    """
+    from .channel import DATA
+    from .channel import HEADER
+
+    chunk_size = chunk_size or CHUNK_SIZE
+    size = staged.size
+    crc = 0
+    for offset in range(0, size, chunk_size):
+        length = min(chunk_size, size - offset)
+        if staged.view is None:
+            chunk = _read_chunk(staged.fd, offset, length)
+        else:
+            chunk = staged.view[offset : offset + length]
+        try:
+            crc = zlib.crc32(chunk, crc)
+            sock.sendall(HEADER.pack(DATA, length))
+            sock.sendall(chunk)
+        finally:
+            if staged.view is not None:
+                chunk.release()
+    return size, crc
+
+
+def handle_request(client, key):
+    """
+    Sends what was staged under the *key* name (``manhole-cli --download``): a message with the name, size and source,
+    the ``DATA`` frames and a message with the size and the CRC-32. The staged data is dropped once sent.
+    """
+    from .channel import send_message
+
+    with _LOCK:
+        staged = _STAGED.get(key)
+    if staged is None:
+        raise LookupError(f'Nothing was staged as {key!r}, use download(obj, {key!r}) in the manhole first.')
+    send_message(client, {'name': key, 'size': staged.size, 'source': staged.source})
+    size, crc = send_staged(client, staged)
+    send_message(client, {'size': size, 'crc32': crc})
+    with _LOCK:
+        if _STAGED.get(key) is staged:
+            del _STAGED[key]
+        else:
+            staged = None  # replaced meanwhile, already closed
+    if staged is not None:
+        staged.close()
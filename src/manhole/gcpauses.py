@@ -0,0 +1,157 @@
+"""
+GC pause recorder.
+
+A ``gc.callbacks`` hook times every collection (from the ``start`` to the ``stop`` callback) and stores the generation,
+duration, collected and uncollectable counts and a timestamp in a fixed size ring (one ``array`` per field, so recording
+doesn't create objects tracked by the GC, which would count towards the next collection). All the collections go in
+the per-generation histograms and the worst pauses are kept separately, so they survive the ring wrapping around.
+
+It can be turned on and off at any time, eg: to measure the effect of ``gc.set_threshold()`` or ``gc.freeze()``.
+"""
+
+import gc
+from array import array
+from heapq import heappush
+from heapq import heapreplace
+
+from . import _get_original
+from .histogram import Histogram
+
+_perf_counter = _get_original('time', 'perf_counter')
+_time = _get_original('time', 'time')
+
+_RECORDER = None
+
+
+class GCRecorder:
+    """
+    Records the last *size* collections and the *worst* longest ones.
+    """
+
+    def __init__(self, size=4096, worst=10):
+        self.size = size
+        self.started = array('d', [0.0]) * size
+        self.durations = array('d', [0.0]) * size
+        self.generations = array('b', [0]) * size
+        self.collected = array('q', [0]) * size
+        self.uncollectable = array('q', [0]) * size
+        self.count = 0
+        self.histograms = {}
+        self.totals = {}
+        self.worst = []
+        self.worst_count = worst
+        self.collection_started = None
+        self.installed_at = None
+        self.removed_at = None
+
+    def callback(self, phase, info):
+        if phase == 'start':
+            self.collection_started = _perf_counter()
+            return
+        if self.collection_started is None:  # installed during a collection
+            return
+        duration = _perf_counter() - self.collection_started
+        self.collection_started = None
+        generation = info['generation']
+        index = self.count % self.size
+        self.started[index] = _time() - duration
+        self.durations[index] = duration
+        self.generations[index] = generation
+        self.collected[index] = info['collected']
+        self.uncollectable[index] = info['uncollectable']
+        self.count += 1
+        if self.worst_count and (len(self.worst) < self.worst_count or duration > self.worst[0][0]):
+            # copied, the ring entry will be overwritten eventually
+            entry = (duration, self.count, self.record(index))
+            if len(self.worst) < self.worst_count:
+                heappush(self.worst, entry)
+            else:
+                heapreplace(self.worst, entry)
+        histogram = self.histograms.get(generation)
+        if histogram is None:
+            histogram = self.histograms[generation] = Histogram()
+            self.totals[generation] = [0, 0]
+        histogram.add(duration)
+        totals = self.totals[generation]
+        totals[0] += info['collected']
+        totals[1] += info['uncollectable']
+
+    def install(self):
+        self.installed_at = _perf_counter()
+        gc.callbacks.append(self.callback)
+        return self
+
+    def remove(self):
+        if self.callback in gc.callbacks:
+            gc.callbacks.remove(self.callback)
+            self.removed_at = _perf_counter()
+
+    def record(self, index):
+        return {
+            'generation': self.generations[index],
+            'started': self.started[index],
+            'duration': self.durations[index],
+            'collected': self.collected[index],
+            'uncollectable': self.uncollectable[index],
+        }
+
+    def recent(self, count):
+        """
+        Returns the last *count* collections, oldest first.
+        """
+        count = min(count, self.count, self.size)
+        return [self.record(position % self.size) for position in range(self.count - count, self.count)]
+
+    def report(self, recent=20):
+        end = self.removed_at if self.removed_at is not None else _perf_counter()
+        generations = {}
+        for generation, histogram in sorted(self.histograms.items()):
+            collected, uncollectable = self.totals[generation]
+            generations[generation] = summary = histogram.summary()
+            summary['total'] = histogram.total
+            summary['collected'] = collected
+            summary['uncollectable'] = uncollectable
+            summary['histogram'] = histogram.buckets()
+        return {
+            'enabled': self.removed_at is None,
+            'duration': end - self.installed_at,
+            'collections': self.count,
+            'dropped': max(0, self.count - self.size),
+            'gc': {'enabled': gc.isenabled(), 'threshold': gc.get_threshold(), 'frozen': gc.get_freeze_count()},
+            'generations': generations,
+            'worst': [record for _, _, record in sorted(self.worst, reverse=True)],
+            'recent': self.recent(recent),
+        }
+
+
+def gc_monitor(enabled=True, size=4096, worst=10):
+    """
+    Starts recording GC pauses (discarding what was recorded before) or stops recording (keeping the data for
+    :func:`gc_pauses`).
+
+    Args:
+        enabled (bool): Start or stop.
+        size (int): How many collections to keep in the ring.
+        worst (int): How many of the longest pauses to keep.
+
+    Returns what :func:`gc_pauses` returns (``None`` if it was never started).
+    """
+    global _RECORDER  # pylint: disable=W0603
+
+    if _RECORDER is not None:
+        _RECORDER.remove()
+    if enabled:
+        _RECORDER = GCRecorder(size, worst).install()
+    elif _RECORDER is None:
+        return None
+    return gc_pauses()
+
+
+def gc_pauses(recent=20):
+    """
+    Returns what the GC pause recorder found so far: the pause percentiles, histogram and collected/uncollectable totals
+    for each generation, the worst pauses and the *recent* collections.
+    """
+    if _RECORDER is None:
+        raise RuntimeError('The GC pause recorder was not started. Use gc_monitor().')
+    return _RECORDER.report(recent)
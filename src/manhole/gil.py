@@ -0,0 +1,88 @@
+"""
+GIL contention probe.
+
+A tiny thread sleeps for a short interval over and over and records how late it gets to run again. Waking up from the
+sleep needs the GIL, so in a CPU-heavy process the lateness is mostly time spent waiting for the GIL (the remainder is
+OS scheduling and timer slack, usually tens of microseconds).
+"""
+
+import os
+import sys
+
+from . import _ORIGINAL_EVENT
+from . import _ORIGINAL_SLEEP
+from . import _ORIGINAL_THREAD
+from . import _get_original
+from . import getinterval
+from . import setinterval
+from .histogram import Histogram
+
+_perf_counter = _get_original('time', 'perf_counter')
+_get_native_id = _get_original('threading', 'get_native_id')
+
+
+def _raise_priority():
+    """
+    Best effort attempt to make the calling thread more important than the rest (needs ``CAP_SYS_NICE``). Only done on
+    Linux, where the priority can be set per-thread. A ``SCHED_IDLE`` policy inherited from the manhole thread (see the
+    ``thread_priority`` option) is dropped first, otherwise the probe would measure the CPU contention instead.
+    """
+    if not sys.platform.startswith('linux'):
+        return False
+    native_id = _get_native_id()
+    try:
+        if os.sched_getscheduler(native_id) == os.SCHED_IDLE:
+            os.sched_setscheduler(native_id, os.SCHED_OTHER, os.sched_param(0))
+        os.setpriority(os.PRIO_PROCESS, native_id, -5)
+    except OSError:
+        return False
+    else:
+        return True
+
+
+def gil_probe(duration=5.0, interval=0.005, switch_interval=None):
+    """
+    Measures for *duration* seconds how late a thread sleeping *interval* seconds gets the GIL back.
+
+    Args:
+        duration (float): Seconds to measure.
+        interval (float): Seconds the probe thread sleeps between measurements.
+        switch_interval (float): Use this switch interval (see ``sys.setswitchinterval``) while measuring and restore
+            the old one afterwards. Default: leave it alone.
+
+    Returns a dict with the wait percentiles (in seconds), the switch interval that was in effect and the histogram.
+    """
+    histogram = Histogram()
+    stop = _ORIGINAL_EVENT()
+    state = {}
+
+    def tick():
+        state['raised_priority'] = _raise_priority()
+        while not stop.is_set():
+            expected = _perf_counter() + interval
+            _ORIGINAL_SLEEP(interval)
+            histogram.add(max(_perf_counter() - expected, 0.0))
+
+    old_switch_interval = getinterval()
+    if switch_interval is not None:
+        setinterval(switch_interval)
+    thread = _ORIGINAL_THREAD(target=tick, name='ManholeGILProbe')
+    thread.daemon = True
+    try:
+        thread.start()
+        _ORIGINAL_SLEEP(duration)
+    finally:
+        stop.set()
+        thread.join()
+        effective_switch_interval = getinterval()
+        setinterval(old_switch_interval)
+
+    result = {
+        'duration': duration,
+        'interval': interval,
+        'switch_interval': effective_switch_interval,
+        'raised_priority': state.get('raised_priority', False),
+    }
+    result.update(histogram.summary())
+    result['histogram'] = histogram.buckets()
+    return result
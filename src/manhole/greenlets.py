@@ -0,0 +1,229 @@
+"""
+Greenlet stacks and hub blocking detection (gevent, eventlet or plain greenlet).
+
+``dump_stacktraces()`` only shows the threads, and with gevent or eventlet the thread running the hub shows whatever
+greenlet happens to run at that moment. ``dump_greenlets()`` finds all the greenlets (with a GC scan, like
+``gevent.util.format_run_info`` does) and prints their stacks grouped by identical stacks.
+
+``HubWatchdog`` finds greenlets that don't yield to the hub: a ``greenlet.settrace`` callback in the hub's thread
+records every switch and a real OS thread checks if the same greenlet (other than the hub) has been running for longer
+than the threshold. If so its stack is recorded.
+"""
+
+import gc
+import sys
+import traceback
+from collections import deque
+
+from . import _ORIGINAL_EVENT
+from . import _ORIGINAL_THREAD
+from . import _get_original
+
+_monotonic = _get_original('time', 'monotonic')
+_time = _get_original('time', 'time')
+_get_ident = _get_original('_thread', 'get_ident')
+
+
+def _describe(greenlet):
+    name = getattr(greenlet, 'name', None)  # gevent.Greenlet
+    if isinstance(name, str):
+        return name
+    return f'{type(greenlet).__name__}-{id(greenlet):x}'
+
+
+def _state(greenlet):
+    if greenlet.dead:
+        return 'dead'
+    elif not greenlet:
+        return 'not started'
+    elif greenlet.gr_frame is None:
+        return 'running'
+    else:
+        return 'suspended'
+
+
+def greenlet_groups(max_stack=30, max_names=5):
+    """
+    Returns the live greenlets grouped by identical stacks (largest group first). Each group has the count, the stack
+    (``traceback.FrameSummary`` objects, outermost first), the states and a few greenlet names.
+    """
+    greenlet = sys.modules.get('greenlet')
+    if greenlet is None:
+        return []
+    greenlet_type = greenlet.greenlet
+    groups = {}
+    for obj in gc.get_objects():
+        if not isinstance(obj, greenlet_type):
+            continue
+        state = _state(obj)
+        if state == 'dead':
+            continue
+        frame = obj.gr_frame
+        stack = traceback.extract_stack(frame, max_stack) if frame is not None else []
+        key = tuple((entry.filename, entry.lineno, entry.name) for entry in stack)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {'count': 0, 'stack': stack, 'states': {}, 'greenlets': []}
+        group['count'] += 1
+        group['states'][state] = group['states'].get(state, 0) + 1
+        if len(group['greenlets']) < max_names:
+            group['greenlets'].append(_describe(obj))
+    return sorted(groups.values(), key=lambda group: group['count'], reverse=True)
+
+
+def dump_greenlets(max_stack=30, max_names=5, file=None):
+    """
+    Prints the stacks of all the greenlets, grouped by identical stacks, with counts.
+
+    Running greenlets have no saved stack (see ``dump_stacktraces()`` for what the threads are doing).
+    """
+    if file is None:
+        from . import _MANHOLE
+
+        file = sys.stderr if _MANHOLE is not None and _MANHOLE.redirect_stderr else sys.stdout
+    groups = greenlet_groups(max_stack, max_names)
+    lines = []
+    for group in groups:
+        states = ', '.join(f'{state}: {count}' for state, count in sorted(group['states'].items()))
+        lines.append(f'\n######### {group["count"]} greenlet(s) ({states}), eg: {", ".join(group["greenlets"])} #########')
+        for entry in group['stack']:
+            lines.append('File: "%s", line %d, in %s' % (entry.filename, entry.lineno, entry.name))
+            if entry.line:
+                lines.append(f'  {entry.line.strip()}')
+    lines.append(f'######### {sum(group["count"] for group in groups)} greenlet(s) in {len(groups)} group(s) #########\n\n')
+    print('\n'.join(lines), file=file)
+
+
+def _find_hub():
+    """
+    Returns the hub greenlet of the calling thread, if gevent or eventlet is used.
+    """
+    if 'gevent' in sys.modules:
+        from gevent import get_hub
+
+        return get_hub()
+    elif 'eventlet' in sys.modules:
+        from eventlet.hubs import get_hub
+
+        return get_hub().greenlet
+
+
+class HubWatchdog:
+    """
+    Records the greenlets that keep the hub from running for longer than *threshold* seconds.
+
+    Must be started from the thread that runs the hub (``greenlet.settrace`` is per-thread). Only the last *history*
+    blocks are kept.
+    """
+
+    def __init__(self, threshold=0.1, history=100, hub=None):
+        self.threshold = threshold
+        self.history = deque(maxlen=history)
+        self.hub = hub
+        self.thread_ident = None
+        self.current = None
+        self.switched_at = None
+        self.switches = 0
+        self.pending = None
+        self.previous_tracer = None
+        self.running = False
+        self.stopped = _ORIGINAL_EVENT()
+        self.thread = None
+
+    def start(self):
+        import greenlet
+
+        if self.hub is None:
+            self.hub = _find_hub()
+        self.thread_ident = _get_ident()
+        self.current = greenlet.getcurrent()
+        self.switched_at = _monotonic()
+        self.running = True
+        self.previous_tracer = greenlet.settrace(self.trace)
+        return self.start_monitor()
+
+    def start_monitor(self):
+        self.thread = _ORIGINAL_THREAD(target=self.monitor, name='ManholeHubWatchdog')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def restart(self):
+        """
+        Drops the recorded blocks and starts a new monitoring thread. Used after a fork: the child only has the thread
+        that forked (the trace function stays installed in it) and the blocks are the parent's.
+        """
+        self.history.clear()
+        self.pending = None
+        self.switched_at = _monotonic()
+        self.stopped = _ORIGINAL_EVENT()
+        return self.start_monitor()
+
+    def stop(self):
+        """
+        Stops the monitoring thread. The trace function is removed on the next switch in the hub's thread.
+        """
+        self.running = False
+        self.stopped.set()
+        if self.thread_ident == _get_ident():
+            self.uninstall()
+
+    def uninstall(self):
+        import greenlet
+
+        if greenlet.gettrace() == self.trace:
+            greenlet.settrace(self.previous_tracer)
+
+    def trace(self, event, args):
+        if event in ('switch', 'throw'):
+            now = _monotonic()
+            if self.pending is not None:
+                self.pending['duration'] = now - self.switched_at
+                self.pending = None
+            self.current = args[1]
+            self.switched_at = now
+            self.switches += 1
+        if not self.running:
+            self.uninstall()
+        if self.previous_tracer is not None:
+            self.previous_tracer(event, args)
+
+    def monitor(self):
+        interval = max(self.threshold / 2, 0.005)
+        while not self.stopped.wait(interval):
+            current = self.current
+            switches = self.switches
+            blocked_for = _monotonic() - self.switched_at
+            if self.pending is not None or current is self.hub or blocked_for < self.threshold:
+                continue
+            frame = sys._current_frames().get(self.thread_ident)
+            if switches != self.switches or frame is None:
+                continue
+            self.pending = record = {
+                'greenlet': _describe(current),
+                'started': _time() - blocked_for,
+                'duration': None,  # set when it switches away
+                'stack': traceback.format_stack(frame),
+            }
+            self.history.append(record)
+            if switches != self.switches and record['duration'] is None:  # switched away meanwhile
+                record['duration'] = blocked_for
+                self.pending = None
+
+    def blocks(self):
+        """
+        Returns the recorded blocks, oldest first. The last one has a ``None`` duration if it's still blocking.
+        """
+        return list(self.history)
+
+
+def hub_blocks():
+    """
+    Returns the blocks recorded by the hub watchdog (see the ``hub_watchdog`` option of ``manhole.install()``).
+    """
+    from . import _MANHOLE
+
+    watchdog = _MANHOLE and _MANHOLE.hub_watchdog
+    if watchdog is None:
+        raise RuntimeError('The hub watchdog is not enabled. Use manhole.install(hub_watchdog=<seconds>).')
+    return {'threshold': watchdog.threshold, 'switches': watchdog.switches, 'blocks': watchdog.blocks()}
@@ -0,0 +1,122 @@
+"""
+Time and memory limits for the commands that run in the manhole (see the ``command_timeout`` and
+``command_max_rss_growth`` options of ``manhole.install()``).
+
+While a command runs a watcher thread checks how long it has been running and how much the RSS grew since it started.
+If a limit is exceeded an exception is raised in the thread running the command (``PyThreadState_SetAsyncExc``). The
+exceptions derive from ``BaseException``, like ``KeyboardInterrupt``, so an ``except Exception`` in the command doesn't
+swallow them.
+
+The exception is only raised when the thread runs Python code again: a command stuck in a single C call (eg:
+``sum(range(10**12))`` or a blocking ``recv()``) can't be stopped this way.
+"""
+
+import ctypes
+
+from . import _ORIGINAL_ALLOCATE_LOCK
+from . import _ORIGINAL_EVENT
+from . import _ORIGINAL_GET_IDENT
+from . import _ORIGINAL_SLEEP
+from . import _ORIGINAL_THREAD
+from . import _get_original
+from .process import get_rss
+
+_monotonic = _get_original('time', 'monotonic')
+
+
+class CommandLimitExceeded(BaseException):
+    pass
+
+
+class CommandTimeout(CommandLimitExceeded):
+    pass
+
+
+class CommandMemoryLimit(CommandLimitExceeded):
+    pass
+
+
+def _set_async_exc(ident, exception):
+    # passing None clears the pending exception
+    return ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(ident), None if exception is None else ctypes.py_object(exception))
+
+
+class CommandGuard:
+    """
+    Context manager that interrupts the code it wraps if it runs for more than *timeout* seconds or grows the RSS by
+    more than *max_rss_growth* bytes. Checks every *interval* seconds. Use :meth:`close` to stop the watcher thread.
+    """
+
+    def __init__(self, timeout=None, max_rss_growth=None, interval=0.05):
+        self.timeout = timeout
+        self.max_rss_growth = max_rss_growth
+        self.interval = interval
+        self.lock = _ORIGINAL_ALLOCATE_LOCK()
+        self.running = _ORIGINAL_EVENT()
+        self.closed = False
+        self.ident = None
+        self.started_at = None
+        self.rss_baseline = None
+        self.injected = None
+        self.reason = None
+        self.thread = None
+
+    def __enter__(self):
+        if self.thread is None:
+            self.thread = _ORIGINAL_THREAD(target=self.monitor, name='ManholeCommandGuard')
+            self.thread.daemon = True
+            self.thread.start()
+        with self.lock:
+            self.ident = _ORIGINAL_GET_IDENT()
+            self.started_at = _monotonic()
+            self.rss_baseline = get_rss() if self.max_rss_growth is not None else None
+            self.injected = self.reason = None
+            self.running.set()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self.lock:
+            self.running.clear()
+            if self.injected is not None and not (exc_type and issubclass(exc_type, CommandLimitExceeded)):
+                _set_async_exc(self.ident, None)  # the command ended before the exception was raised
+
+    def check(self):
+        """
+        Raises the exception in the guarded thread if a limit is exceeded. Returns the reason if it did.
+        """
+        with self.lock:
+            if self.closed or not self.running.is_set() or self.injected is not None:
+                return None
+            elapsed = _monotonic() - self.started_at
+            if self.timeout is not None and elapsed > self.timeout:
+                exception = CommandTimeout
+                self.reason = f'Interrupted: the command ran for more than {self.timeout} seconds (command_timeout).'
+            elif self.max_rss_growth is not None and get_rss() - self.rss_baseline > self.max_rss_growth:
+                exception = CommandMemoryLimit
+                self.reason = f'Interrupted: the command grew the RSS by more than {self.max_rss_growth} bytes (command_max_rss_growth).'
+            else:
+                return None
+            self.injected = exception
+            _set_async_exc(self.ident, exception)
+            return self.reason
+
+    def monitor(self):
+        while not self.closed:
+            self.running.wait()
+            _ORIGINAL_SLEEP(self.interval)
+            self.check()
+
+    def close(self):
+        self.closed = True
+        self.running.set()  # wake up the watcher
+
+
+def make_guard():
+    """
+    Returns a :class:`CommandGuard` with the limits configured in ``manhole.install()`` or ``None`` if there are none.
+    """
+    from . import _MANHOLE
+
+    if _MANHOLE is None or (_MANHOLE.command_timeout is None and _MANHOLE.command_max_rss_growth is None):
+        return None
+    return CommandGuard(_MANHOLE.command_timeout, _MANHOLE.command_max_rss_growth)
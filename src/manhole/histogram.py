@@ -0,0 +1,99 @@
+"""
+Small log-linear histogram used by the measuring helpers (GIL probe, latency tracer, GC pauses etc).
+"""
+
+import math
+
+
+class Histogram:
+    """
+    Histogram of durations (in seconds). Bucket boundaries grow by a factor of ``2 ** (1 / resolution)`` so percentiles
+    are accurate within that factor without keeping every value around.
+
+    Not synchronized: concurrent ``add()`` calls may very rarely lose an update, which is fine for statistics.
+
+    Args:
+        resolution (int): Buckets per doubling. Default: ``8`` (about 9% precision).
+        floor (float): Values below this go in the first bucket. Default: ``1e-6`` (one microsecond).
+    """
+
+    def __init__(self, resolution=8, floor=1e-6):
+        self.resolution = resolution
+        self.floor = floor
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def bucket(self, value):
+        if value <= self.floor:
+            return 0
+        return int(math.log2(value / self.floor) * self.resolution) + 1
+
+    def upper_bound(self, bucket):
+        return self.floor * 2 ** (bucket / self.resolution)
+
+    def add(self, value):
+        bucket = self.bucket(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """
+        Returns the upper bound of the bucket holding the given percentile (capped at the maximum seen value).
+        """
+        if not self.count:
+            return None
+        threshold = self.count * percent / 100.0
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= threshold:
+                return min(self.upper_bound(bucket), self.max)
+        return self.max
+
+    def buckets(self):
+        """
+        Returns a list of ``(upper_bound, count)`` tuples for the non-empty buckets.
+        """
+        return [(self.upper_bound(bucket), self.counts[bucket]) for bucket in sorted(self.counts)]
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+    def format(self, width=40):
+        """
+        Returns the histogram as text (one bar per non-empty bucket).
+        """
+        buckets = self.buckets()
+        if not buckets:
+            return '(empty)'
+        biggest = max(count for _, count in buckets)
+        return '\n'.join(
+            f'{format_duration(upper_bound):>10} | {"#" * max(1, count * width // biggest):<{width}} {count}'
+            for upper_bound, count in buckets
+        )
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return '-'
+    if seconds < 1e-3:
+        return f'{seconds * 1e6:.0f}us'
+    if seconds < 1:
+        return f'{seconds * 1e3:.2f}ms'
+    return f'{seconds:.3f}s'
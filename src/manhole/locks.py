@@ -0,0 +1,346 @@
+"""
+Lock instrumentation: who holds which lock, how long threads wait for them and the waits-for graph (deadlocks).
+
+``threading.Lock`` and ``threading.RLock`` are replaced with thin wrappers, so only the locks created afterwards are
+instrumented (including the ones created by ``threading.Condition``, ``threading.Event``, ``queue.Queue`` etc, but not
+the ones from modules that did ``from threading import Lock`` before that). Use the ``instrument_locks`` option of
+``manhole.install()`` to instrument the locks created at startup too.
+
+The instrumented locks always track their holder (it's cheap) but everything else only happens while the monitor is
+on (see :func:`lock_monitor`):
+
+* an uncontended acquire is a non-blocking attempt and a counter increment,
+* a contended acquire registers the waiting thread (that's the waits-for graph), times the wait and, for a *sample*
+  fraction of the waits, records the waiting stack.
+
+Stats are grouped by the place where the locks were created.
+"""
+
+import random
+import sys
+import threading
+
+from . import _get_original
+from .histogram import Histogram
+
+_perf_counter = _get_original('time', 'perf_counter')
+_get_ident = _get_original('_thread', 'get_ident')
+_enumerate = _get_original('threading', 'enumerate')
+_random = random.random
+
+_THREADING_GLOBALS = vars(threading)
+# what threading.Lock and threading.RLock were before instrumenting (could be gevent's)
+_ORIGINAL_LOCK = None
+_ORIGINAL_RLOCK = None
+_SITES = {}
+_MONITOR = None
+
+
+class LockSite:
+    """
+    Stats for all the locks created at the same place.
+    """
+
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        self.acquisitions = 0
+        self.contentions = 0
+        self.waits = Histogram()
+        self.stacks = {}
+
+    def add_stack(self, frame, max_stack=10):
+        stack = []
+        while frame is not None and len(stack) < max_stack:
+            code = frame.f_code
+            stack.append(f'{code.co_filename}:{frame.f_lineno} in {code.co_name}')
+            frame = frame.f_back
+        stack = tuple(reversed(stack))
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def summary(self, max_stacks=3):
+        stacks = sorted(self.stacks.items(), key=lambda item: item[1], reverse=True)
+        return {
+            'lock': f'{self.kind} created at {self.name}',
+            'acquisitions': self.acquisitions,
+            'contentions': self.contentions,
+            'total_wait': self.waits.total,
+            'wait': self.waits.summary(),
+            'stacks': [{'count': count, 'stack': list(stack)} for stack, count in stacks[:max_stacks]],
+        }
+
+
+def _creation_site(kind):
+    frame = sys._getframe(2)  # pylint: disable=W0212
+    while frame.f_back is not None and frame.f_globals is _THREADING_GLOBALS:  # Condition, Event, Semaphore etc
+        frame = frame.f_back
+    code = frame.f_code
+    name = f'{code.co_filename}:{frame.f_lineno} in {code.co_name}'
+    site = _SITES.get((kind, name))
+    if site is None:
+        site = _SITES.setdefault((kind, name), LockSite(kind, name))
+    return site
+
+
+class LockMonitor:
+    def __init__(self, sample):
+        self.sample = sample
+        self.started = _perf_counter()
+        # thread ident: (lock, when it started waiting)
+        self.waiting = {}
+
+    def wait(self, lock, blocking, timeout):
+        """
+        Blocks until *lock* is acquired, like ``acquire(blocking, timeout)``, recording the wait.
+        """
+        site = lock.site
+        if not blocking:
+            return lock._lock.acquire(False)
+        ident = _get_ident()
+        if self.sample and _random() < self.sample:
+            site.add_stack(sys._getframe(2))  # pylint: disable=W0212
+        start = _perf_counter()
+        self.waiting[ident] = lock, start
+        try:
+            acquired = lock._lock.acquire(True, timeout)
+        finally:
+            self.waiting.pop(ident, None)
+        site.contentions += 1
+        site.waits.add(_perf_counter() - start)
+        return acquired
+
+
+class InstrumentedLock:
+    """
+    Wrapper for a ``threading.Lock`` that tracks its holder.
+    """
+
+    __slots__ = ('__weakref__', '_lock', 'owner', 'site')
+
+    def __init__(self):
+        self._lock = _ORIGINAL_LOCK()
+        self.owner = None
+        self.site = _creation_site('Lock')
+
+    def acquire(self, blocking=True, timeout=-1):
+        monitor = _MONITOR
+        if monitor is None:
+            acquired = self._lock.acquire(blocking, timeout)
+        else:
+            acquired = self._lock.acquire(False) or monitor.wait(self, blocking, timeout)
+            if acquired:
+                self.site.acquisitions += 1
+        if acquired:
+            self.owner = _get_ident()
+        return acquired
+
+    def release(self):
+        self.owner = None  # before releasing, another thread could get it right away
+        self._lock.release()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def _at_fork_reinit(self):
+        self._lock._at_fork_reinit()
+        self.owner = None
+
+    def __getattr__(self, name):
+        if name == '_lock':  # not initialized
+            raise AttributeError(name)
+        return getattr(self._lock, name)
+
+    def __repr__(self):
+        return f'<{type(self).__name__} {"locked" if self.owner else "unlocked"} created at {self.site.name} {self._lock!r}>'
+
+
+class InstrumentedRLock:
+    """
+    Wrapper for a ``threading.RLock`` that tracks its holder.
+    """
+
+    __slots__ = ('__weakref__', '_lock', 'count', 'owner', 'site')
+
+    def __init__(self):
+        self._lock = _ORIGINAL_RLOCK()
+        self.owner = None
+        self.count = 0
+        self.site = _creation_site('RLock')
+
+    def acquire(self, blocking=True, timeout=-1):
+        monitor = _MONITOR
+        if monitor is None:
+            acquired = self._lock.acquire(blocking, timeout)
+        else:
+            acquired = self._lock.acquire(False) or monitor.wait(self, blocking, timeout)
+            if acquired:
+                self.site.acquisitions += 1
+        if acquired:
+            self.owner = _get_ident()
+            self.count += 1
+        return acquired
+
+    def release(self):
+        if self.owner == _get_ident():
+            self.count -= 1
+            if not self.count:
+                self.owner = None
+        self._lock.release()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    # used by threading.Condition
+    def _release_save(self):
+        count = self.count
+        self.owner = None
+        self.count = 0
+        return self._lock._release_save(), count
+
+    def _acquire_restore(self, state):
+        state, count = state
+        self._lock._acquire_restore(state)
+        self.owner = _get_ident()
+        self.count = count
+
+    def _is_owned(self):
+        return self._lock._is_owned()
+
+    def _at_fork_reinit(self):
+        self._lock._at_fork_reinit()
+        self.owner = None
+        self.count = 0
+
+    def __getattr__(self, name):
+        if name == '_lock':  # not initialized
+            raise AttributeError(name)
+        return getattr(self._lock, name)
+
+    def __repr__(self):
+        return f'<{type(self).__name__} owner={self.owner} count={self.count} created at {self.site.name} {self._lock!r}>'
+
+
+def instrument():
+    """
+    Replaces ``threading.Lock`` and ``threading.RLock`` with the instrumented wrappers.
+    """
+    global _ORIGINAL_LOCK, _ORIGINAL_RLOCK  # pylint: disable=W0603
+
+    if threading.Lock is not InstrumentedLock:
+        _ORIGINAL_LOCK, threading.Lock = threading.Lock, InstrumentedLock
+    if threading.RLock is not InstrumentedRLock:
+        _ORIGINAL_RLOCK, threading.RLock = threading.RLock, InstrumentedRLock
+
+
+def uninstrument():
+    """
+    Restores ``threading.Lock`` and ``threading.RLock``. The locks that were already created stay instrumented.
+    """
+    if threading.Lock is InstrumentedLock:
+        threading.Lock = _ORIGINAL_LOCK
+    if threading.RLock is InstrumentedRLock:
+        threading.RLock = _ORIGINAL_RLOCK
+
+
+def _thread_names():
+    return {thread.ident: thread.name for thread in _enumerate()}
+
+
+def waits_for(monitor=None):
+    """
+    Returns the threads that are waiting for a lock: ``{thread ident: (lock, seconds waiting)}``.
+    """
+    monitor = monitor or _MONITOR
+    if monitor is None:
+        return {}
+    now = _perf_counter()
+    return {ident: (lock, now - start) for ident, (lock, start) in list(monitor.waiting.items())}
+
+
+def find_deadlocks(waiting):
+    """
+    Returns the cycles in the waits-for graph (thread -> lock it waits for -> thread that holds it -> ...), each as a
+    list of ``(thread ident, lock)`` edges.
+    """
+    cycles = []
+    seen = set()
+    for start in waiting:
+        path = []
+        positions = {}
+        ident = start
+        while ident in waiting and ident not in seen and ident not in positions:
+            positions[ident] = len(path)
+            lock = waiting[ident][0]
+            path.append((ident, lock))
+            ident = lock.owner
+        if ident in positions:
+            cycles.append(path[positions[ident] :])
+        seen.update(positions)
+    return cycles
+
+
+def lock_monitor(enabled=True, sample=0.05):
+    """
+    Turns the lock monitor on or off. Turning it on resets the stats.
+
+    Args:
+        enabled (bool): Turn it on (instrumenting ``threading.Lock`` and ``threading.RLock`` if not done already).
+        sample (float): Fraction of the contended acquires for which the waiting stack is recorded.
+
+    Returns what :func:`lock_report` returns.
+    """
+    global _MONITOR  # pylint: disable=W0603
+
+    if enabled:
+        instrument()
+        for site in list(_SITES.values()):
+            site.reset()
+        _MONITOR = LockMonitor(sample)
+    else:
+        _MONITOR = None
+    return lock_report()
+
+
+def lock_report(top=10):
+    """
+    Returns what the lock monitor found: the *top* most contended locks (by total wait time), the threads waiting for a
+    lock right now (and who holds it) and the deadlocks (cycles in the waits-for graph).
+    """
+    monitor = _MONITOR
+    names = _thread_names()
+
+    def describe(lock):
+        return f'{lock.site.kind} created at {lock.site.name}'
+
+    waiting = waits_for(monitor)
+    sites = sorted((site for site in list(_SITES.values()) if site.contentions), key=lambda site: site.waits.total, reverse=True)
+    return {
+        'enabled': monitor is not None,
+        'duration': _perf_counter() - monitor.started if monitor else None,
+        'instrumented': threading.Lock is InstrumentedLock,
+        'sites': len(_SITES),
+        'contended': [site.summary() for site in sites[:top]],
+        'waiting': [
+            {
+                'thread': names.get(ident, ident),
+                'lock': describe(lock),
+                'held_by': names.get(lock.owner, lock.owner),
+                'waiting_for': elapsed,
+            }
+            for ident, (lock, elapsed) in sorted(waiting.items(), key=lambda item: item[1][1], reverse=True)
+        ],
+        'deadlocks': [
+            [
+                {'thread': names.get(ident, ident), 'waits_for': describe(lock), 'held_by': names.get(lock.owner, lock.owner)}
+                for ident, lock in cycle
+            ]
+            for cycle in find_deadlocks(waiting)
+        ],
+    }
@@ -0,0 +1,151 @@
+"""
+pymalloc and process memory statistics, as structured data.
+
+``sys._debugmallocstats()`` writes to the C level stderr (file descriptor 2), which the manhole doesn't redirect, so
+the output is captured by pointing fd 2 to a temporary file for the duration of the call (anything else written to fd 2
+by other threads meanwhile ends up there too). The text is then parsed into per size class usage, arena totals and the
+free lists.
+
+Together with ``/proc/self/smaps_rollup`` this tells apart memory held by live objects, memory pymalloc keeps in
+partially used arenas (it can only return an arena to the system when it's completely empty) and memory that's
+elsewhere (C extensions, ``malloc`` fragmentation etc).
+"""
+
+import os
+import re
+import sys
+import tempfile
+
+from . import _ORIGINAL_ALLOCATE_LOCK
+
+_LOCK = _ORIGINAL_ALLOCATE_LOCK()
+
+SIZE_CLASS = re.compile(r'^\s*(\d+)\s+(\d+)\s+(\d+)\s+(\d+)\s+(\d+)\s*$')
+COUNTER = re.compile(r'^# (.+?)\s+=\s+([\d,]+)$')
+UNUSED_POOLS = re.compile(r'^(\d+) unused pools \* (\d+) bytes\s+=\s+([\d,]+)$')
+FREE_LIST = re.compile(r'^\s*(\d+) free (.+?) \* (\d+) bytes each\s+=\s+([\d,]+)$')
+SMAPS_ROLLUP = '/proc/self/smaps_rollup'
+
+
+def _key(name):
+    return re.sub(r'\W+', '_', name.strip().lower()).strip('_')
+
+
+def capture_debugmallocstats():
+    """
+    Returns what ``sys._debugmallocstats()`` prints.
+    """
+    with _LOCK, tempfile.TemporaryFile() as fh:
+        saved = os.dup(2)
+        try:
+            os.dup2(fh.fileno(), 2)
+            sys._debugmallocstats()  # pylint: disable=W0212
+        finally:
+            os.dup2(saved, 2)
+            os.close(saved)
+        fh.seek(0)
+        return fh.read().decode('ascii', 'replace')
+
+
+def parse_debugmallocstats(text):
+    """
+    Parses the output of ``sys._debugmallocstats()``. Returns a dict with the ``size_classes``, the ``arenas`` counters
+    (the ``# name = value`` lines before the first total), the ``arena_map`` counters and the ``free_lists``.
+    """
+    size_classes = []
+    arenas = {}
+    arena_map = {}
+    free_lists = []
+    counters = arenas
+    for line in text.splitlines():
+        match = SIZE_CLASS.match(line)
+        if match:
+            size_class, size, pools, blocks, free_blocks = map(int, match.groups())
+            size_classes.append({'class': size_class, 'size': size, 'pools': pools, 'blocks': blocks, 'free_blocks': free_blocks})
+            continue
+        match = COUNTER.match(line)
+        if match:
+            counters.setdefault(_key(match.group(1)), int(match.group(2).replace(',', '')))
+            continue
+        match = UNUSED_POOLS.match(line)
+        if match:
+            counters['unused_pools'] = int(match.group(1))
+            counters['bytes_in_unused_pools'] = int(match.group(3).replace(',', ''))
+            continue
+        match = FREE_LIST.match(line)
+        if match:
+            count, name, size, total = match.groups()
+            free_lists.append({'type': name, 'count': int(count), 'size': int(size), 'bytes': int(total.replace(',', ''))})
+            continue
+        if line.startswith('Total'):
+            counters['total'] = int(line.partition('=')[2].strip().replace(',', ''))
+            counters = arena_map
+    return {'size_classes': size_classes, 'arenas': arenas, 'arena_map': arena_map, 'free_lists': free_lists}
+
+
+def pymalloc_stats():
+    """
+    Returns the parsed ``sys._debugmallocstats()`` output, with a few derived numbers:
+
+    * ``utilization`` for each size class (blocks in use / blocks in the pools of that class),
+    * ``arena_bytes``, ``used_bytes`` and ``free_bytes`` (available blocks and unused pools) in the arenas, and
+      ``fragmentation``: how much of the arenas isn't used by live blocks.
+
+    Returns ``None`` if pymalloc isn't used (eg: ``PYTHONMALLOC=malloc``).
+    """
+    stats = parse_debugmallocstats(capture_debugmallocstats())
+    if not stats['size_classes']:
+        return None
+    for size_class in stats['size_classes']:
+        capacity = size_class['blocks'] + size_class['free_blocks']
+        size_class['utilization'] = size_class['blocks'] / capacity if capacity else None
+    arenas = stats['arenas']
+    arena_bytes = arenas.get('total', 0)
+    used_bytes = arenas.get('bytes_in_allocated_blocks', 0)
+    stats['arena_bytes'] = arena_bytes
+    stats['used_bytes'] = used_bytes
+    stats['free_bytes'] = arenas.get('bytes_in_available_blocks', 0) + arenas.get('bytes_in_unused_pools', 0)
+    stats['fragmentation'] = 1 - used_bytes / arena_bytes if arena_bytes else None
+    return stats
+
+
+def smaps_rollup(path=SMAPS_ROLLUP):
+    """
+    Returns ``/proc/self/smaps_rollup`` (Linux 4.14+) as a dict of byte counts, or ``None`` if it's not available.
+    """
+    try:
+        with open(path) as fh:
+            lines = fh.readlines()
+    except OSError:
+        return None
+    rollup = {}
+    for line in lines[1:]:  # the first line is the address range
+        name, _, value = line.partition(':')
+        value = value.split()
+        if value and value[0].isdigit():
+            rollup[_key(name)] = int(value[0]) * 1024 if value[1:] == ['kB'] else int(value[0])
+    return rollup
+
+
+def malloc_stats():
+    """
+    Returns the pymalloc statistics (see :func:`pymalloc_stats`) and the process memory totals from
+    ``/proc/self/smaps_rollup``.
+
+    The ``summary`` compares them: ``rss`` and ``anonymous`` memory of the process, how much of it pymalloc arenas
+    take, how much of that is free (held because the arenas aren't empty) and what's left for everything else.
+    """
+    pymalloc = pymalloc_stats()
+    rollup = smaps_rollup()
+    summary = {}
+    if rollup is not None:
+        summary['rss'] = rollup.get('rss')
+        summary['anonymous'] = rollup.get('anonymous')
+    if pymalloc is not None:
+        summary['pymalloc_arenas'] = pymalloc['arena_bytes']
+        summary['pymalloc_used'] = pymalloc['used_bytes']
+        summary['pymalloc_free'] = pymalloc['free_bytes']
+        summary['pymalloc_fragmentation'] = pymalloc['fragmentation']
+        if summary.get('anonymous') is not None:
+            summary['other_anonymous'] = summary['anonymous'] - pymalloc['arena_bytes']
+    return {'summary': summary, 'pymalloc': pymalloc, 'smaps_rollup': rollup}
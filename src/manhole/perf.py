@@ -0,0 +1,119 @@
+"""
+Linux ``perf`` support: the perf trampoline (Python 3.12+), turned on from the manhole.
+
+While the trampoline is active every Python function runs through a small piece of generated machine code, and its
+address is written in ``/tmp/perf-<pid>.map`` (with the function name), so ``perf record`` / ``perf report`` can show
+the Python frames mixed with the native ones, without restarting the process with ``-X perf``.
+
+Only the functions that get called while the trampoline is active go through it: a function that was already running
+before (eg: the main loop) shows up in ``perf`` only if it's called again. The map file keeps growing (entries are never
+removed) and it's left in place for ``perf report``.
+"""
+
+import os
+import sys
+
+from . import _ORIGINAL_ALLOCATE_LOCK
+from . import _ORIGINAL_SLEEP
+from . import _get_original
+
+_perf_counter = _get_original('time', 'perf_counter')
+_select = _get_original('select', 'select')
+_LOCK = _ORIGINAL_ALLOCATE_LOCK()
+
+
+def perf_map_path(pid=None):
+    return f'/tmp/perf-{pid or os.getpid()}.map'
+
+
+def is_supported():
+    return sys.platform.startswith('linux') and hasattr(sys, 'activate_stack_trampoline')
+
+
+def _check_supported():
+    if not is_supported():
+        raise RuntimeError('The perf trampoline needs Python 3.12+ on Linux.')
+
+
+def perf_map_info(path=None):
+    """
+    Returns the path, size and number of entries of the perf map file (``None`` for the last two if it doesn't exist).
+    """
+    path = path or perf_map_path()
+    try:
+        with open(path, 'rb') as fh:
+            entries = sum(chunk.count(b'\n') for chunk in iter(lambda: fh.read(1024**2), b''))
+            size = fh.tell()
+    except FileNotFoundError:
+        entries = size = None
+    return {'path': path, 'size': size, 'entries': entries}
+
+
+def perf_status():
+    """
+    Returns if the perf trampoline is supported and active, and where the perf map file is.
+    """
+    supported = is_supported()
+    return {
+        'pid': os.getpid(),
+        'supported': supported,
+        'active': supported and sys.is_stack_trampoline_active(),
+        'map': perf_map_info(),
+    }
+
+
+def perf_trampoline(enabled=True):
+    """
+    Turns the perf trampoline on or off. Returns what :func:`perf_status` returns.
+    """
+    _check_supported()
+    if enabled:
+        sys.activate_stack_trampoline('perf')
+    else:
+        sys.deactivate_stack_trampoline()
+    return perf_status()
+
+
+def perf_window(duration=30.0, started=None, wait=_ORIGINAL_SLEEP):
+    """
+    Turns the perf trampoline on for *duration* seconds (run ``perf record`` meanwhile). If it was already on (eg:
+    ``-X perf``) it's left on.
+
+    *started* is called with the status once the trampoline is on, then *wait* is called with the *duration*.
+
+    Returns what :func:`perf_status` returns plus the *duration* and the number of entries added to the map file.
+    """
+    _check_supported()
+    if not _LOCK.acquire(False):
+        raise RuntimeError('A perf window is already open.')
+    try:
+        was_active = sys.is_stack_trampoline_active()
+        entries = perf_map_info()['entries'] or 0
+        sys.activate_stack_trampoline('perf')
+        start = _perf_counter()
+        try:
+            if started is not None:
+                started(perf_status())
+            wait(duration)
+        finally:
+            if not was_active:
+                sys.deactivate_stack_trampoline()
+        result = perf_status()
+        result['duration'] = _perf_counter() - start
+        result['entries_added'] = (result['map']['entries'] or 0) - entries
+        return result
+    finally:
+        _LOCK.release()
+
+
+def handle_request(client, duration=30.0):
+    """
+    Opens a perf window (``manhole-cli --perf-window``). Sends a message when the trampoline is on and another one with
+    the result when the window ends. The window ends early if the client closes the connection.
+    """
+    from .channel import send_message
+
+    def wait(seconds):
+        _select([client], [], [], seconds)
+
+    send_message(client, perf_window(float(duration), started=lambda status: send_message(client, status), wait=wait))
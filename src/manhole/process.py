@@ -0,0 +1,52 @@
+"""
+Cheap process and thread metrics. Most of these read ``/proc`` and return ``None`` where that isn't available.
+"""
+
+import os
+import resource
+import sys
+
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (ValueError, OSError, AttributeError):
+    _PAGE_SIZE = resource.getpagesize()
+try:
+    _CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+except (ValueError, OSError, AttributeError):
+    _CLOCK_TICKS = 100
+
+
+def get_rss():
+    """
+    Returns the current resident set size in bytes. Falls back to the peak RSS where ``/proc`` isn't available.
+    """
+    try:
+        with open('/proc/self/statm', 'rb') as fh:
+            return int(fh.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def get_cpu_time():
+    """
+    Returns the user+system CPU seconds used by the whole process.
+    """
+    times = os.times()
+    return times.user + times.system
+
+
+def get_thread_cpu_time(native_id):
+    """
+    Returns the user+system CPU seconds used by the thread with the given native id (see ``threading.get_native_id``).
+    """
+    if native_id is None:
+        return None
+    try:
+        with open(f'/proc/self/task/{native_id}/stat', 'rb') as fh:
+            stat = fh.read()
+    except OSError:
+        return None
+    # the command name (2nd field) can contain spaces and parens, skip past the last paren
+    fields = stat[stat.rfind(b')') + 2 :].split()
+    return (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS
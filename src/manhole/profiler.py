@@ -0,0 +1,220 @@
+"""
+Deterministic profiler for all the threads of the process.
+
+``cProfile`` only profiles the thread that enabled it (and on Python 3.12+, where it's based on ``sys.monitoring``,
+it sees every thread but mixes their calls in a single call stack). This installs a small profile function in every
+thread instead, keeps separate call stacks and stats for each thread and merges them at the end in the format that
+``pstats`` reads.
+
+On Python 3.12+ ``threading.setprofile_all_threads`` reaches the threads that are already running. On older versions
+only the threads started while profiling can be reached (``threading.setprofile``).
+"""
+
+import marshal
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import types
+
+from . import _ORIGINAL_ALLOCATE_LOCK
+from . import _ORIGINAL_SLEEP
+from . import _get_original
+
+_perf_counter = _get_original('time', 'perf_counter')
+_get_ident = threading.get_ident
+_LOCK = _ORIGINAL_ALLOCATE_LOCK()
+
+
+def _c_function_key(function):
+    """
+    Returns a ``pstats`` key for a builtin function or method, named like ``cProfile`` names them.
+    """
+    name = getattr(function, '__name__', repr(function))
+    owner = getattr(function, '__self__', None)
+    if owner is None or isinstance(owner, types.ModuleType):
+        module = getattr(function, '__module__', None)
+        label = f'<built-in method {module}.{name}>' if module else f'<built-in method {name}>'
+    else:
+        label = f"<method '{name}' of '{type(owner).__name__}' objects>"
+    return '~', 0, label
+
+
+class ThreadStats:
+    """
+    Call stack and stats of a single thread.
+
+    Stats are stored like ``pstats`` wants them: ``{key: [primitive calls, calls, total time, cumulative time,
+    {caller key: calls}]}``.
+    """
+
+    def __init__(self):
+        self.stack = []
+        self.active = {}
+        self.stats = {}
+        self.code_keys = {}
+
+    def enter(self, key, now):
+        self.stack.append([key, now, 0.0])
+        self.active[key] = self.active.get(key, 0) + 1
+
+    def leave(self, now):
+        if not self.stack:  # returning from something that was running before profiling started
+            return
+        key, start, children = self.stack.pop()
+        elapsed = now - start
+        depth = self.active[key] - 1
+        self.active[key] = depth
+        entry = self.stats.get(key)
+        if entry is None:
+            entry = self.stats[key] = [0, 0, 0.0, 0.0, {}]
+        entry[1] += 1
+        entry[2] += elapsed - children
+        if not depth:  # recursive calls are counted once in the cumulative time
+            entry[0] += 1
+            entry[3] += elapsed
+        if self.stack:
+            parent = self.stack[-1]
+            parent[2] += elapsed
+            callers = entry[4]
+            callers[parent[0]] = callers.get(parent[0], 0) + 1
+
+
+class Profiler:
+    """
+    Collects the stats of all the threads it's installed in.
+    """
+
+    def __init__(self):
+        self.threads = {}
+        self.running = False
+        self.skip_thread = None
+        self.lock = _ORIGINAL_ALLOCATE_LOCK()
+
+    def __call__(self, frame, event, arg):
+        now = _perf_counter()
+        ident = _get_ident()
+        with self.lock:  # stop() finishes the stacks from another thread
+            if not self.running or ident == self.skip_thread:
+                sys.setprofile(None)
+                return
+            thread = self.threads.get(ident)
+            if thread is None:
+                thread = self.threads[ident] = ThreadStats()
+            if event == 'call':
+                code = frame.f_code
+                key = thread.code_keys.get(code)
+                if key is None:
+                    key = thread.code_keys[code] = (code.co_filename, code.co_firstlineno, code.co_name)
+                thread.enter(key, now)
+            elif event == 'c_call':
+                thread.enter(_c_function_key(arg), now)
+            else:
+                thread.leave(now)
+
+    def start(self):
+        self.running = True
+        self.skip_thread = _get_ident()
+        if hasattr(threading, 'setprofile_all_threads'):
+            threading.setprofile_all_threads(self)
+            return True
+        else:
+            threading.setprofile(self)
+            return False
+
+    def stop(self):
+        if hasattr(threading, 'setprofile_all_threads'):
+            threading.setprofile_all_threads(None)
+        else:
+            threading.setprofile(None)
+        with self.lock:
+            self.running = False  # threads that still have the hook remove it on their next event
+            # like cProfile, count the calls that haven't finished yet as if they ended now
+            now = _perf_counter()
+            for thread in self.threads.values():
+                while thread.stack:
+                    thread.leave(now)
+
+    def merged_stats(self):
+        merged = {}
+        for thread in list(self.threads.values()):
+            for key, (primitive_calls, calls, total_time, cumulative_time, callers) in list(thread.stats.items()):
+                entry = merged.get(key)
+                if entry is None:
+                    merged[key] = (primitive_calls, calls, total_time, cumulative_time, dict(callers))
+                else:
+                    merged_callers = entry[4]
+                    for caller, count in callers.items():
+                        merged_callers[caller] = merged_callers.get(caller, 0) + count
+                    merged[key] = (
+                        entry[0] + primitive_calls,
+                        entry[1] + calls,
+                        entry[2] + total_time,
+                        entry[3] + cumulative_time,
+                        merged_callers,
+                    )
+        return merged
+
+
+def _top(stats, sort_key, top):
+    stats.sort_stats(sort_key)
+    entries = []
+    for function in stats.fcn_list[:top]:
+        primitive_calls, calls, total_time, cumulative_time, _ = stats.stats[function]
+        entries.append(
+            {
+                'function': pstats.func_std_string(function),
+                'calls': calls,
+                'primitive_calls': primitive_calls,
+                'tottime': total_time,
+                'cumtime': cumulative_time,
+            }
+        )
+    return entries
+
+
+def profile_all(duration=10.0, top=20, path=None):
+    """
+    Profiles all the threads (except the calling one) for *duration* seconds.
+
+    Args:
+        duration (float): Seconds to profile. Profiling is turned off afterwards, even if this gets interrupted.
+        top (int): How many functions to return in each of the top lists.
+        path (str): Where to save the stats (``pstats`` format). Default: a new ``manhole-profile-<pid>-*.pstats``
+            file in the temporary directory.
+
+    Returns a dict with the path of the stats file, the number of threads seen, whether the threads that were already
+    running were profiled (Python 3.12+ only) and the top functions by cumulative and by total time.
+    """
+    if not _LOCK.acquire(False):
+        raise RuntimeError('Already profiling.')
+    profiler = Profiler()
+    try:
+        existing_threads = profiler.start()
+        _ORIGINAL_SLEEP(duration)
+    finally:
+        profiler.stop()
+        _LOCK.release()
+
+    merged = profiler.merged_stats()
+    if path is None:
+        fd, path = tempfile.mkstemp(prefix=f'manhole-profile-{os.getpid()}-', suffix='.pstats')
+        os.close(fd)
+    with open(path, 'wb') as fh:
+        marshal.dump(merged, fh)
+
+    result = {
+        'duration': duration,
+        'path': path,
+        'threads': len(profiler.threads),
+        'existing_threads': existing_threads,
+        'calls': sum(entry[1] for entry in merged.values()),
+    }
+    if merged:
+        stats = pstats.Stats(path)
+        result['by_cumulative'] = _top(stats, 'cumulative', top)
+        result['by_total'] = _top(stats, 'tottime', top)
+    else:
+        result['by_cumulative'] = result['by_total'] = []
+    return result
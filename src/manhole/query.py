@@ -0,0 +1,131 @@
+"""
+Server side of ``manhole-cli -e``: evaluates expressions and sends back structured results.
+"""
+
+import json
+import reprlib
+from contextlib import nullcontext
+
+from . import _get_original
+from . import get_namespace
+from .channel import send_message
+from .guard import CommandLimitExceeded
+from .guard import make_guard
+
+_perf_counter = _get_original('time', 'perf_counter')
+
+DEFAULT_MAX_SIZE = 4096
+
+
+def make_repr(max_size):
+    """
+    Returns a ``repr`` function that won't go deep into big containers.
+    """
+    limits = reprlib.Repr()
+    limits.maxlevel = 6
+    limits.maxdict = limits.maxlist = limits.maxtuple = limits.maxset = limits.maxfrozenset = limits.maxdeque = 100
+    limits.maxarray = 100
+    limits.maxstring = limits.maxother = limits.maxlong = max_size
+    return limits.repr
+
+
+def json_size(value, limit):
+    """
+    Returns a lower bound of the size of *value* encoded as JSON, or ``None`` as soon as that goes over *limit*. Only
+    looks at as many items as needed, unlike encoding everything and checking the size afterwards. Raises ``TypeError``
+    for values that can't be encoded.
+    """
+    size = 0
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, str):
+            size += len(value) + 2
+        elif isinstance(value, int):
+            size += value.bit_length() // 4 + 1  # a bit less than the number of digits
+        elif value is None or isinstance(value, float):
+            size += 1
+        elif isinstance(value, (list, tuple)):
+            size += len(value) + 1
+            if size <= limit:
+                stack.extend(value)
+        elif isinstance(value, dict):
+            size += 2 * len(value) + 1
+            if size <= limit:
+                stack.extend(value.keys())
+                stack.extend(value.values())
+        else:
+            raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+        if size > limit:
+            return None
+    return size
+
+
+def evaluate(expression, namespace, max_size=DEFAULT_MAX_SIZE, safe_repr=None, guard=None):
+    """
+    Evaluates *expression* (statements are allowed too, their result is ``None``) in *namespace*, within the limits of
+    the *guard* (see :mod:`manhole.guard`). Returns a dict with the type, ``repr`` and (if possible) JSON representation
+    of the result, or the error.
+
+    Representations longer than *max_size* are truncated (``repr``) or left out (JSON), and ``truncated`` is set.
+    """
+    safe_repr = safe_repr or make_repr(max_size)
+    result = {'expression': expression}
+    start = _perf_counter()
+    try:
+        try:
+            code = compile(expression, '<manhole-query>', 'eval')
+        except SyntaxError:
+            code = compile(expression, '<manhole-query>', 'exec')
+        with guard or nullcontext():
+            value = eval(code, namespace)
+    except CommandLimitExceeded:
+        result['elapsed'] = _perf_counter() - start
+        result['error'] = guard.reason
+        return result
+    except Exception as exc:
+        result['elapsed'] = _perf_counter() - start
+        result['error'] = f'{type(exc).__name__}: {exc}'
+        return result
+    result['elapsed'] = _perf_counter() - start
+    result['type'] = f'{type(value).__module__}.{type(value).__qualname__}'
+
+    try:
+        value_repr = safe_repr(value)
+    except Exception as exc:
+        value_repr = f'<repr failed: {exc!r}>'
+    if len(value_repr) > max_size:
+        value_repr = value_repr[:max_size]
+        result['truncated'] = True
+    result['repr'] = value_repr
+
+    if value is None or isinstance(value, (bool, int, float, str, list, tuple, dict)):
+        try:
+            # the size is checked first, encoding a big value would hold the GIL for a long time just to throw it away
+            encoded = None if json_size(value, max_size) is None else json.dumps(value)
+        except (TypeError, ValueError):
+            pass
+        else:
+            if encoded is not None and len(encoded) <= max_size:
+                result['json'] = value
+            else:
+                result['truncated'] = True
+    return result
+
+
+def handle_request(client, expressions, max_size=DEFAULT_MAX_SIZE):
+    """
+    Sends one result message for each of the *expressions*. They share the same namespace so later expressions can use
+    names assigned by earlier ones.
+    """
+    from . import _MANHOLE
+
+    namespace = get_namespace(_MANHOLE.locals)
+    safe_repr = make_repr(max_size)
+    guard = make_guard()
+    try:
+        for expression in expressions:
+            send_message(client, evaluate(expression, namespace, max_size, safe_repr, guard))
+    finally:
+        if guard is not None:
+            guard.close()
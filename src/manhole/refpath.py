@@ -0,0 +1,208 @@
+"""
+Finds who keeps an object (or the instances of a type) alive.
+
+Instead of walking ``gc.get_referrers`` backwards (each call scans every object the GC tracks) this does a breadth
+first search with ``gc.get_referents`` from the roots that usually retain things - module globals and the locals of
+the frames of the other threads - towards the target. The first paths found are the shortest ones. The search has a
+wall-clock and a visited-objects budget and gives the GIL away every few steps, so the application keeps running
+(slower) while it searches.
+"""
+
+import gc
+import reprlib
+import sys
+import types
+from collections import deque
+
+from . import _ORIGINAL_SLEEP
+from . import _get_original
+
+_perf_counter = _get_original('time', 'perf_counter')
+_get_ident = _get_original('_thread', 'get_ident')
+
+_ATTRIBUTE = 'attribute'
+_DICT = 'dict'
+_ITEM = 'item'
+_KEY = 'key'
+_REFERENT = 'referent'
+
+_key_repr = reprlib.Repr()
+_key_repr.maxstring = _key_repr.maxother = 40
+
+
+def _instance_dict(obj):
+    """
+    Returns the ``__dict__`` of *obj* without triggering ``__getattr__``, or ``None``.
+    """
+    try:
+        mapping = object.__getattribute__(obj, '__dict__')
+    except Exception:
+        return None
+    if type(mapping) is types.MappingProxyType:  # classes
+        referents = gc.get_referents(mapping)
+        mapping = referents[0] if referents else None
+    return mapping if type(mapping) is dict else None
+
+
+def _referents(obj):
+    """
+    Yields ``(kind, label, child)`` for everything *obj* references. Containers, frames and objects with a
+    ``__dict__`` get labels (key, index, attribute or local name), anything else is an unlabeled referent.
+    """
+    kind = type(obj)
+    if kind is dict:
+        for key, value in list(obj.items()):
+            yield _ITEM, key, value
+            yield _KEY, key, key
+    elif kind is list or kind is tuple:
+        for index, value in enumerate(list(obj)):
+            yield _ITEM, index, value
+    elif kind is types.FrameType:
+        try:
+            variables = list(obj.f_locals.items())
+        except Exception:
+            variables = ()
+        for name, value in variables:
+            yield _ATTRIBUTE, name, value
+        if obj.f_back is not None:
+            yield _REFERENT, None, obj.f_back
+    else:
+        mapping = _instance_dict(obj)
+        if mapping is not None:
+            yield _DICT, None, mapping
+            for name, value in list(mapping.items()):
+                yield _ATTRIBUTE, name, value
+        if kind is types.ModuleType:
+            # the state of extension modules can hold objects that must not escape (eg: freelists in 3.12's _asyncio)
+            return
+        for child in gc.get_referents(obj):
+            if child is not mapping:
+                yield _REFERENT, None, child
+
+
+def _roots(skip_thread):
+    """
+    Yields ``(label, object)`` for the loaded modules and for every frame of the threads (except *skip_thread*).
+    """
+    for name, module in list(sys.modules.items()):
+        if module is not None:
+            yield name, module
+    names = {}
+    for thread in _get_original('threading', 'enumerate')():
+        names[thread.ident] = thread.name
+    for ident, frame in sys._current_frames().items():
+        if ident == skip_thread:
+            continue
+        thread_name = names.get(ident, ident)
+        while frame is not None:
+            yield f'{thread_name}:{frame.f_code.co_name}({frame.f_code.co_filename}:{frame.f_lineno})', frame
+            frame = frame.f_back
+
+
+def _format_step(kind, label, child):
+    if kind == _ATTRIBUTE:
+        return f'.{label}'
+    elif kind == _ITEM:
+        return f'[{_key_repr.repr(label)}]'
+    elif kind == _KEY:
+        return f'{{{_key_repr.repr(label)}}}'
+    elif kind == _DICT:
+        return '.__dict__'
+    else:
+        return f'->{type(child).__name__}'
+
+
+def ref_paths(target, max_paths=5, max_depth=20, timeout=5.0, max_visited=500000, pause_every=1000):
+    """
+    Finds the shortest reference paths from module globals or thread frames to *target*.
+
+    Args:
+        target: The object to look for. If it's a class then its instances (exact type) are looked for instead.
+        max_paths (int): Stop after finding this many paths.
+        max_depth (int): Don't follow references deeper than this.
+        timeout (float): Stop after this many seconds.
+        max_visited (int): Stop after looking at this many objects.
+        pause_every (int): Release the GIL (``time.sleep(0)``) after looking at this many objects.
+
+    Returns a dict with the ``paths`` (shortest first), the number of objects ``visited``, the ``elapsed`` time and
+    why the search ended (``stopped``: ``"done"``, ``"max_paths"``, ``"timeout"`` or ``"max_visited"``). Path
+    notation: ``.name`` is an attribute or a local variable, ``[key]`` an item, ``{key}`` a dict key and ``->type`` any
+    other reference. The frames of the calling thread are not searched.
+    """
+    start = _perf_counter()
+    deadline = start + timeout
+    if isinstance(target, type):
+
+        def matches(obj):
+            return type(obj) is target
+    else:
+
+        def matches(obj):
+            return obj is target
+
+    # id -> object, holds a reference so ids can't be reused while searching
+    seen = {}
+    # id -> (parent id, kind, label) or (root label,)
+    parents = {}
+    queue = deque()
+    for label, root in _roots(_get_ident()):
+        if id(root) not in seen:
+            seen[id(root)] = root
+            parents[id(root)] = (label,)
+            queue.append((root, 0))
+
+    found = []
+    found_edges = set()
+    stopped = 'done'
+    visited = 0
+    while queue:
+        obj, depth = queue.popleft()
+        visited += 1
+        if visited % pause_every == 0:
+            _ORIGINAL_SLEEP(0)
+            if _perf_counter() > deadline:
+                stopped = 'timeout'
+                break
+        if visited >= max_visited:
+            stopped = 'max_visited'
+            break
+        if depth >= max_depth:
+            continue
+        try:
+            referents = list(_referents(obj))
+        except Exception:  # eg: a broken __dict__ property, nothing to follow then
+            referents = ()
+        for kind, label, child in referents:
+            if matches(child):
+                edge = (id(obj), kind, label) if child is target else id(child)
+                if edge not in found_edges:
+                    found_edges.add(edge)
+                    found.append((obj, kind, label, child))
+                continue
+            if id(child) in seen:
+                continue
+            seen[id(child)] = child
+            parents[id(child)] = (id(obj), kind, label)
+            if kind != _DICT:  # the attributes were already yielded
+                queue.append((child, depth + 1))
+        if len(found) >= max_paths:
+            stopped = 'max_paths'
+            break
+
+    paths = []
+    for parent, kind, label, child in found[:max_paths]:
+        steps = [_format_step(kind, label, child)]
+        current = id(parent)
+        while len(parents[current]) == 3:
+            parent_id, kind, label = parents[current]
+            steps.append(_format_step(kind, label, seen[current]))
+            current = parent_id
+        steps.append(parents[current][0])
+        paths.append(''.join(reversed(steps)))
+    del seen, parents, queue, found
+    return {
+        'paths': paths,
+        'visited': visited,
+        'elapsed': _perf_counter() - start,
+        'stopped': stopped,
+    }
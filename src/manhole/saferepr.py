@@ -0,0 +1,96 @@
+"""
+Cheap, bounded ``repr`` for dumping locals.
+
+Only the builtin scalars, strings and containers (and the types explicitly allowed) get a real ``repr``: other objects
+are shown as ``<module.Class object at 0x...>`` without calling their ``__repr__`` (it could be slow, take locks or have
+side effects). Strings are sliced before they are repr-ed and containers are only iterated up to a few items (unlike
+``reprlib``, dicts and sets are not sorted first), so the cost doesn't depend on the size of the values.
+"""
+
+import fnmatch
+from itertools import islice
+
+# ints this big are slow to convert (and newer Pythons refuse to)
+MAX_INT_BITS = 1024
+
+
+class SafeRepr:
+    """
+    A ``repr`` function that returns at most *max_size* characters, shows at most *max_items* items of each container
+    and doesn't go deeper than *max_level* containers.
+    """
+
+    def __init__(self, max_size=100, max_items=10, max_level=3, types=()):
+        self.max_size = max_size
+        self.max_items = max_items
+        self.max_level = max_level
+        self.types = tuple(types)
+
+    def __call__(self, obj):
+        try:
+            value = self.repr(obj, self.max_level)
+        except Exception as exc:  # eg: a container that changed size
+            value = f'<repr failed: {type(exc).__name__}>'
+        if len(value) > self.max_size:
+            value = value[: self.max_size - 3] + '...'
+        return value
+
+    def repr(self, obj, level):
+        cls = type(obj)
+        if cls in (str, bytes, bytearray):
+            if len(obj) > self.max_size:
+                return repr(obj[: self.max_size]) + '...'
+            return repr(obj)
+        elif cls is int:
+            if obj.bit_length() > MAX_INT_BITS:
+                return f'<int with {obj.bit_length()} bits>'
+            return repr(obj)
+        elif cls in (type(None), bool, float, complex, range):
+            return repr(obj)
+        elif cls is dict:
+            if level <= 0:
+                return '{...}'
+            items = [f'{self.repr(key, level - 1)}: {self.repr(value, level - 1)}' for key, value in islice(obj.items(), self.max_items)]
+            return self.join('{', items, '}', len(obj))
+        elif cls in (list, tuple, set, frozenset):
+            opening, closing = {list: ('[', ']'), tuple: ('(', ')'), set: ('{', '}'), frozenset: ('frozenset({', '})')}[cls]
+            if not obj:
+                return {set: 'set()', frozenset: 'frozenset()'}.get(cls, opening + closing)
+            if level <= 0:
+                return f'{opening}...{closing}'
+            items = [self.repr(item, level - 1) for item in islice(obj, self.max_items)]
+            if cls is tuple and len(obj) == 1:
+                closing = ',)'
+            return self.join(opening, items, closing, len(obj))
+        elif self.types and isinstance(obj, self.types):
+            return repr(obj)
+        else:
+            return f'<{cls.__module__}.{cls.__qualname__} object at {id(obj):#x}>'
+
+    def join(self, opening, items, closing, size):
+        if size > len(items):
+            items.append(f'... ({size} items)')
+        return opening + ', '.join(items) + closing
+
+
+def frame_matches(frame, patterns):
+    """
+    Checks if the ``module.function`` of *frame* matches one of the glob *patterns*.
+    """
+    name = f'{frame.f_globals.get("__name__", "?")}.{frame.f_code.co_name}'
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+
+
+def format_locals(frame, safe_repr, budget):
+    """
+    Returns the ``name = value`` lines for the locals of *frame* and what's left of the *budget* (characters).
+    """
+    lines = []
+    for name, value in list(frame.f_locals.items()):
+        if budget <= 0:
+            lines.append('... (locals budget exhausted)')
+            break
+        line = f'{name} = {safe_repr(value)}'
+        budget -= len(line)
+        lines.append(line)
+    return lines, budget
@@ -0,0 +1,299 @@
+"""
+Compact snapshot of the process (stacks with locals, GC stats, modules, type histogram) in a single file, for offline
+analysis with ``manhole-snapshot``.
+
+File layout::
+
+    MAGIC | section | section | ... | index | trailer
+
+Each section is a zlib compressed JSON document. The index is a JSON list of ``[name, offset, length]`` entries and the
+trailer (``!QI`` index offset and length, then the ``MAGIC`` again) is at the very end, so a reader can ``mmap`` the
+file and decompress only the sections it needs (eg: a single thread). There's one section for each thread, named
+``thread:<ident>``.
+
+The file is written next to *path* and renamed at the end, so there's never a partial snapshot at *path*.
+"""
+
+import argparse
+import gc
+import json
+import linecache
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+from . import _get_original
+from .saferepr import SafeRepr
+
+_perf_counter = _get_original('time', 'perf_counter')
+_time = _get_original('time', 'time')
+_enumerate = _get_original('threading', 'enumerate')
+
+MAGIC = b'MHSNAP\x00\x01'
+TRAILER = struct.Struct('!QI8s')
+
+
+def _module_attribute(module, name):
+    # not getattr, modules can have a __getattr__ that imports stuff
+    value = vars(module).get(name)
+    return value if isinstance(value, str) else None
+
+
+def collect_thread(ident, frame, name, safe_repr, max_locals):
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        local_reprs = {}
+        for index, (local_name, value) in enumerate(list(frame.f_locals.items())):
+            if index == max_locals:
+                local_reprs['...'] = f'{len(frame.f_locals) - max_locals} more'
+                break
+            try:
+                local_reprs[local_name] = safe_repr(value)
+            except Exception as exc:
+                local_reprs[local_name] = f'<repr failed: {exc!r}>'
+        frames.append(
+            {
+                'filename': code.co_filename,
+                'lineno': frame.f_lineno,
+                'name': code.co_name,
+                'line': linecache.getline(code.co_filename, frame.f_lineno).strip(),
+                'locals': local_reprs,
+            }
+        )
+        frame = frame.f_back
+    frames.reverse()
+    return {'ident': ident, 'name': name, 'frames': frames}
+
+
+def collect_gc():
+    return {
+        'enabled': gc.isenabled(),
+        'count': gc.get_count(),
+        'threshold': gc.get_threshold(),
+        'stats': gc.get_stats(),
+        'garbage': len(gc.garbage),
+    }
+
+
+def collect_modules():
+    return [
+        [name, _module_attribute(module, '__file__'), _module_attribute(module, '__version__')]
+        for name, module in sorted(sys.modules.items())
+        if module is not None
+    ]
+
+
+def collect_types(top):
+    counts = {}
+    for obj in gc.get_objects():
+        cls = type(obj)
+        counts[cls] = counts.get(cls, 0) + 1
+    histogram = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+    return {
+        'objects': sum(counts.values()),
+        'top': [[f'{cls.__module__}.{cls.__qualname__}', count] for cls, count in histogram[:top]],
+    }
+
+
+class SnapshotWriter:
+    def __init__(self, fh):
+        self.fh = fh
+        self.index = []
+        fh.write(MAGIC)
+        self.offset = len(MAGIC)
+
+    def add(self, name, document):
+        payload = zlib.compress(json.dumps(document, separators=(',', ':'), default=repr).encode('utf8'), 1)
+        self.fh.write(payload)
+        self.index.append([name, self.offset, len(payload)])
+        self.offset += len(payload)
+
+    def close(self):
+        index = json.dumps(self.index, separators=(',', ':')).encode('utf8')
+        self.fh.write(index)
+        self.fh.write(TRAILER.pack(self.offset, len(index), MAGIC))
+
+
+def snapshot(path=None, max_repr=200, max_locals=50, types=True, top_types=200):
+    """
+    Writes a snapshot of the process in *path* (see :mod:`manhole.snapshot` and ``manhole-snapshot``).
+
+    Args:
+        path (str): Where to save it. Default: a new ``manhole-snapshot-<pid>-*.snap`` file in the temporary directory.
+        max_repr (int): Maximum size of the ``repr`` of locals (see :class:`manhole.saferepr.SafeRepr`, other objects'
+            ``__repr__`` isn't called).
+        max_locals (int): How many locals to save for each frame.
+        types (bool): Include a histogram of the types of the objects tracked by the GC. This is the slowest part
+            with big heaps.
+        top_types (int): How many types to save in the histogram.
+
+    Returns a dict with the path, size and how long it took.
+    """
+    start = _perf_counter()
+    if path is None:
+        fd, path = tempfile.mkstemp(prefix=f'manhole-snapshot-{os.getpid()}-', suffix='.snap')
+        os.close(fd)
+    safe_repr = SafeRepr(max_repr)
+    names = {thread.ident: thread.name for thread in _enumerate()}
+    frames = sys._current_frames()  # pylint: disable=W0212
+    temporary = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(temporary, 'wb') as fh:
+            writer = SnapshotWriter(fh)
+            writer.add(
+                'meta',
+                {
+                    'pid': os.getpid(),
+                    'time': _time(),
+                    'argv': sys.argv,
+                    'executable': sys.executable,
+                    'version': sys.version,
+                    'threads': [[ident, names.get(ident, str(ident))] for ident in frames],
+                },
+            )
+            for ident, frame in frames.items():
+                writer.add(f'thread:{ident}', collect_thread(ident, frame, names.get(ident, str(ident)), safe_repr, max_locals))
+            writer.add('gc', collect_gc())
+            writer.add('modules', collect_modules())
+            if types:
+                writer.add('types', collect_types(top_types))
+            writer.close()
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.unlink(temporary)
+    return {'path': path, 'size': os.path.getsize(path), 'elapsed': _perf_counter() - start}
+
+
+class SnapshotReader:
+    """
+    Reads a snapshot file. Sections are decompressed on demand.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as fh:
+            self.mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mmap) < len(MAGIC) + TRAILER.size or self.mmap[: len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f'{path!r} is not a manhole snapshot.')
+        index_offset, index_size, magic = TRAILER.unpack(self.mmap[-TRAILER.size :])
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f'{path!r} is truncated.')
+        self.index = {name: (offset, size) for name, offset, size in json.loads(self.mmap[index_offset : index_offset + index_size])}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.mmap.close()
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def section(self, name):
+        offset, size = self.index[name]
+        return json.loads(zlib.decompress(self.mmap[offset : offset + size]))
+
+    def threads(self):
+        """
+        Returns the ``(ident, name)`` of the threads in the snapshot.
+        """
+        return [tuple(thread) for thread in self.section('meta')['threads']]
+
+    def thread(self, ident_or_name):
+        """
+        Returns a thread (with its stack), looked up by ident or name.
+        """
+        for ident, name in self.threads():
+            if ident_or_name in (ident, name, str(ident)):
+                return self.section(f'thread:{ident}')
+        raise KeyError(ident_or_name)
+
+
+def format_summary(reader, top):
+    meta = reader.section('meta')
+    lines = [
+        f"PID: {meta['pid']} | taken: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(meta['time']))} | "
+        f"Python {meta['version'].split()[0]}",
+        f"argv: {' '.join(meta['argv'])}",
+        '',
+        'Threads:',
+    ]
+    lines.extend(f'  {ident:>16}  {name}' for ident, name in reader.threads())
+    if 'gc' in reader:
+        gc_info = reader.section('gc')
+        lines.append('')
+        lines.append(
+            f"GC: enabled: {gc_info['enabled']} | counts: {'/'.join(map(str, gc_info['count']))} | collections: "
+            f"{'/'.join(str(stats['collections']) for stats in gc_info['stats'])} | garbage: {gc_info['garbage']}"
+        )
+    if 'modules' in reader:
+        lines.append(f"Modules: {len(reader.section('modules'))}")
+    if 'types' in reader:
+        types = reader.section('types')
+        lines.append('')
+        lines.append(f"Types ({types['objects']} objects tracked by the GC):")
+        lines.extend(f'  {count:>10}  {name}' for name, count in types['top'][:top])
+    return lines
+
+
+def format_thread(thread):
+    lines = [f"######### Thread {thread['name']} ({thread['ident']}) #########"]
+    for frame in thread['frames']:
+        lines.append(f"File: \"{frame['filename']}\", line {frame['lineno']}, in {frame['name']}")
+        if frame['line']:
+            lines.append(f"  {frame['line']}")
+        for name, value in frame['locals'].items():
+            lines.append(f'    {name} = {value}')
+    return lines
+
+
+parser = argparse.ArgumentParser(prog='manhole-snapshot', description='Read a snapshot written by manhole.snapshot().')
+parser.add_argument('path', metavar='PATH', help='Snapshot file.')
+action = parser.add_mutually_exclusive_group()
+action.add_argument(
+    '-t', '--thread', dest='threads', action='append', metavar='THREAD', help='Show the stack and locals of THREAD (ident or name).'
+)
+action.add_argument('--all-threads', action='store_true', help='Show the stack and locals of all the threads.')
+action.add_argument('--modules', action='store_true', help='List the modules that were loaded.')
+action.add_argument('--section', metavar='NAME', help='Print a section as JSON.')
+parser.add_argument('--types', type=int, default=20, metavar='N', help='How many types to show in the summary. Default: %(default)s.')
+
+
+def main(args=None):
+    args = parser.parse_args(args)
+    try:
+        reader = SnapshotReader(args.path)
+    except (OSError, ValueError) as exc:
+        parser.exit(1, f'{parser.prog}: {exc}\n')
+    with reader:
+        if args.threads or args.all_threads:
+            lines = []
+            for ident_or_name in args.threads or [ident for ident, _ in reader.threads()]:
+                try:
+                    lines.extend(format_thread(reader.thread(ident_or_name)))
+                except KeyError:
+                    parser.exit(1, f'{parser.prog}: no thread {ident_or_name!r} in the snapshot\n')
+                lines.append('')
+        elif args.modules:
+            lines = [f'{name}  {version or ""}  {filename or ""}'.rstrip() for name, filename, version in reader.section('modules')]
+        elif args.section:
+            if args.section not in reader:
+                parser.exit(1, f'{parser.prog}: no {args.section!r} section, there are: {", ".join(reader.index)}\n')
+            lines = [json.dumps(reader.section(args.section), indent=2)]
+        else:
+            lines = format_summary(reader, args.types)
+    print('\n'.join(lines))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""
+Stall watchdog: records the stacks of all threads when the main thread or the event loop stops responding.
+
+By the time someone connects a short stall is usually over, so a real OS thread keeps checking a heartbeat and, when
+it's late by more than the threshold, takes a snapshot of the stacks right away and keeps it in a bounded history.
+
+The heartbeat comes from either:
+
+* the application calling :func:`heartbeat` (eg: once per iteration of its main loop), or
+* an asyncio event loop: if the application never called :func:`heartbeat` the watchdog looks for a running loop
+  (the one in the main thread if there is one) and pings it with ``call_soon_threadsafe``.
+
+Note that a thread that holds the GIL also stops the watchdog, so in that case the snapshot is taken when the GIL is
+released, not when the threshold passed (the duration is still right).
+"""
+
+import sys
+from collections import deque
+
+from . import _ORIGINAL_EVENT
+from . import _ORIGINAL_THREAD
+from . import _get_original
+
+_monotonic = _get_original('time', 'monotonic')
+_time = _get_original('time', 'time')
+_enumerate = _get_original('threading', 'enumerate')
+_main_thread = _get_original('threading', 'main_thread')
+
+LOOP_SEARCH_INTERVAL = 1.0
+
+
+def snapshot(max_stack, skip=()):
+    """
+    Returns a compact ``{thread name: ["file:line in function", ...]}`` snapshot of the stacks of all threads (innermost
+    last, at most *max_stack* entries each).
+    """
+    names = {thread.ident: thread.name for thread in _enumerate()}
+    stacks = {}
+    for ident, frame in sys._current_frames().items():  # pylint: disable=W0212
+        if ident in skip:
+            continue
+        stack = []
+        while frame is not None and len(stack) < max_stack:
+            code = frame.f_code
+            stack.append(f'{code.co_filename}:{frame.f_lineno} in {code.co_name}')
+            frame = frame.f_back
+        stack.reverse()
+        stacks[names.get(ident, str(ident))] = stack
+    return stacks
+
+
+def find_loop():
+    """
+    Returns a running asyncio event loop, preferably the one in the main thread.
+    """
+    asyncio = sys.modules.get('asyncio')
+    if asyncio is None:
+        return None
+    from .tasks import find_loops
+
+    loops = find_loops(asyncio)
+    main_ident = _main_thread().ident
+    for loop, ident in loops.items():
+        if ident == main_ident:
+            return loop
+    return next(iter(loops), None)
+
+
+class StallWatchdog:
+    """
+    Records the stalls longer than *threshold* seconds. Only the last *history* stalls are kept.
+    """
+
+    def __init__(self, threshold=0.5, history=50, max_stack=30):
+        self.threshold = threshold
+        self.history = deque(maxlen=history)
+        self.max_stack = max_stack
+        self.manual = False
+        self.loop = None
+        self.loop_searched_at = None
+        self.waiting_since = None
+        self.pending = None
+        self.stopped = _ORIGINAL_EVENT()
+        self.thread = None
+
+    def start(self):
+        self.thread = _ORIGINAL_THREAD(target=self.monitor, name='ManholeStallWatchdog')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def restart(self):
+        """
+        Drops the recorded stalls and starts a new monitoring thread. Used after a fork: the child only has the thread
+        that forked, and the stalls (and the event loops) are the parent's.
+        """
+        self.history.clear()
+        self.loop = None
+        self.loop_searched_at = None
+        self.waiting_since = None
+        self.pending = None
+        self.stopped = _ORIGINAL_EVENT()
+        return self.start()
+
+    def beat(self):
+        now = _monotonic()
+        record = self.pending
+        if record is not None:
+            record['duration'] = now - self.waiting_since
+            self.pending = None
+        self.waiting_since = now if self.manual else None
+
+    def heartbeat(self):
+        self.manual = True
+        self.beat()
+
+    def ping(self, now):
+        """
+        Schedules a beat in the event loop (if there's no beat already scheduled).
+        """
+        loop = self.loop
+        if loop is None or not loop.is_running():
+            self.loop = None
+            if self.loop_searched_at is not None and now - self.loop_searched_at < LOOP_SEARCH_INTERVAL:
+                return
+            self.loop_searched_at = now
+            loop = self.loop = find_loop()
+            if loop is None:
+                return
+        self.waiting_since = now  # before scheduling, the beat might run right away
+        try:
+            loop.call_soon_threadsafe(self.beat)
+        except RuntimeError:  # closed meanwhile
+            self.loop = None
+            self.waiting_since = None
+
+    def monitor(self):
+        interval = max(self.threshold / 4, 0.005)
+        while not self.stopped.wait(interval):
+            now = _monotonic()
+            waiting_since = self.waiting_since
+            if waiting_since is None:
+                if not self.manual:
+                    self.ping(now)
+                continue
+            if not self.manual and not (self.loop is not None and self.loop.is_running()):
+                self.beat()  # the loop stopped, the scheduled beat won't run
+                continue
+            late = now - waiting_since
+            if self.pending is not None or late < self.threshold:
+                continue
+            self.pending = record = {
+                'started': _time() - late,
+                'duration': None,  # set when the heartbeat comes back
+                'stacks': snapshot(self.max_stack, skip=(self.thread.ident,)),
+            }
+            self.history.append(record)
+            if waiting_since != self.waiting_since and record['duration'] is None:  # the beat came meanwhile
+                record['duration'] = late
+                self.pending = None
+
+    def stalls(self):
+        """
+        Returns the recorded stalls, oldest first. The last one has a ``None`` duration if it's still stalled.
+        """
+        return list(self.history)
+
+
+def heartbeat():
+    """
+    Tells the stall watchdog (see the ``stall_watchdog`` option of ``manhole.install()``) that the application is
+    responsive. Does nothing if the watchdog isn't enabled.
+    """
+    from . import _MANHOLE
+
+    watchdog = _MANHOLE and _MANHOLE.stall_watchdog
+    if watchdog is not None:
+        watchdog.heartbeat()
+
+
+def stalls():
+    """
+    Returns the stalls recorded by the stall watchdog (see the ``stall_watchdog`` option of ``manhole.install()``).
+    """
+    from . import _MANHOLE
+
+    watchdog = _MANHOLE and _MANHOLE.stall_watchdog
+    if watchdog is None:
+        raise RuntimeError('The stall watchdog is not enabled. Use manhole.install(stall_watchdog=<seconds>).')
+    source = 'heartbeat' if watchdog.manual else 'event loop' if watchdog.loop is not None else None
+    return {'threshold': watchdog.threshold, 'source': source, 'stalls': watchdog.stalls()}
+
+
+def handle_request(client):
+    """
+    Sends the recorded stalls as a single message (``manhole-cli --stalls``).
+    """
+    from .channel import send_message
+
+    send_message(client, stalls())
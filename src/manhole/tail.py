@@ -0,0 +1,167 @@
+"""
+Live tail of the application's output and logging records (``manhole-cli --tail``).
+
+Unlike the REPL's output redirection, nothing here ever waits for the client: a ``logging`` handler (added to the root
+logger, or any other) and a tee around ``sys.stdout`` / ``sys.stderr`` append the records to a bounded ``deque`` and
+return. Appending to a ``deque`` is atomic, so the application's threads don't take any lock (the handler skips the
+usual ``logging.Handler`` lock too). When the queue is full the oldest records are dropped. The connection thread
+drains the queue and sends the records to the client, so a slow terminal only makes it drop more records.
+
+Records below the logger's effective level never reach the handler (the logger levels are left alone). Records can be
+sampled (only a *sample* fraction of them is kept) to keep the overhead down on very chatty applications.
+"""
+
+import logging
+import random
+import sys
+from collections import deque
+
+from . import _get_original
+
+_select = _get_original('select', 'select')
+_time = _get_original('time', 'time')
+_FORMATTER = logging.Formatter()
+
+
+class TailHandler(logging.Handler):
+    """
+    Logging handler that puts the records in the *tail* queue.
+    """
+
+    def __init__(self, tail, level):
+        super().__init__(level)
+        self.tail = tail
+
+    def handle(self, record):
+        # like logging.Handler.handle, without the lock
+        if self.filter(record):
+            self.emit(record)
+        return True
+
+    def emit(self, record):
+        try:
+            message = record.getMessage()
+        except Exception:
+            message = f'{record.msg!r} % {record.args!r} (formatting failed)'
+        exception = None
+        if record.exc_info:
+            # formatted right away, queuing the traceback would keep all its frames alive
+            exception = record.exc_text or _FORMATTER.formatException(record.exc_info)
+        self.tail.push(record.created, 'log', record.levelname, record.name, message, exception)
+
+
+class TeeStream:
+    """
+    Writes to *stream* and puts a copy of the text in the *tail* queue. Once the tail is stopped it only writes to
+    *stream*.
+    """
+
+    def __init__(self, stream, tail, name):
+        self.stream = stream
+        self.tail = tail
+        self.name = name
+
+    def write(self, text):
+        result = self.stream.write(text)
+        tail = self.tail
+        if tail is not None and text:
+            tail.push(_time(), self.name, None, None, text, None)
+        return result
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class Tail:
+    """
+    Collects logging records (at *level* or above, from the *logger* and its children) and what is written to the
+    *streams* (names in ``sys``) in a queue of *size* records. Only a *sample* fraction of the records is kept.
+
+    Use it as a context manager or call :meth:`start` and :meth:`stop`.
+    """
+
+    def __init__(self, size=10000, level=logging.INFO, sample=1.0, logger='', streams=('stdout', 'stderr')):
+        self.queue = deque(maxlen=size)
+        self.sample = sample
+        self.logger = logging.getLogger(logger or None)
+        self.handler = TailHandler(self, level)
+        self.streams = streams
+        self.tees = []
+        self.dropped = 0  # approximate, concurrent increments can get lost
+
+    def push(self, *record):
+        if self.sample < 1.0 and random.random() >= self.sample:  # noqa: S311 (just sampling)
+            return
+        queue = self.queue
+        if len(queue) == queue.maxlen:
+            self.dropped += 1
+        queue.append(record)
+
+    def start(self):
+        self.logger.addHandler(self.handler)
+        for name in self.streams:
+            tee = TeeStream(getattr(sys, name), self, name)
+            setattr(sys, name, tee)
+            self.tees.append(tee)
+        return self
+
+    def stop(self):
+        self.logger.removeHandler(self.handler)
+        for tee in self.tees:
+            tee.tail = None
+            if getattr(sys, tee.name) is tee:
+                setattr(sys, tee.name, tee.stream)
+            # otherwise it got wrapped again (eg: by the REPL), it stays but doesn't copy anymore
+        del self.tees[:]
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def drain(self):
+        """
+        Takes all the records out of the queue and returns them as dicts.
+        """
+        records = []
+        queue = self.queue
+        while True:
+            try:
+                created, source, level, logger, message, exception = queue.popleft()
+            except IndexError:
+                break
+            record = {'time': created, 'source': source, 'message': message}
+            if source == 'log':
+                record['level'] = level
+                record['logger'] = logger
+                if exception:
+                    record['exception'] = exception
+            records.append(record)
+        return records
+
+
+def handle_request(client, level='INFO', sample=1.0, size=10000, streams=True, logger='', interval=0.2):
+    """
+    Sends the records as they come (``manhole-cli --tail``): a message with a batch of records and the number of dropped
+    records every *interval* seconds (if there is anything new), until the client disconnects.
+    """
+    from .channel import send_message
+
+    if isinstance(level, str):
+        name, level = level, logging.getLevelName(level.upper())
+        if not isinstance(level, int):
+            raise ValueError(f'Unknown logging level {name!r}.')
+    tail = Tail(size, level, sample, logger, ('stdout', 'stderr') if streams else ())
+    with tail:
+        send_message(client, {'level': logging.getLevelName(level), 'sample': sample, 'size': size, 'logger': tail.logger.name})
+        dropped = 0
+        while not _select([client], [], [], interval)[0]:  # the client doesn't send anything, it can only disconnect
+            records = tail.drain()
+            if records or tail.dropped != dropped:
+                dropped = tail.dropped
+                send_message(client, {'records': records, 'dropped': dropped})
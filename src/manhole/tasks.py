@@ -0,0 +1,160 @@
+"""
+Inventory of the asyncio tasks of all the event loops in the process.
+
+``dump_stacktraces()`` shows what the threads are doing, but a thread running an event loop only shows the loop itself
+while thousands of tasks are suspended in it. This finds the running loops (by looking for ``run_forever`` in the
+stacks of the threads and at the loops of the known tasks) and lists their tasks with the chain of awaiting
+coroutines, grouped by identical stacks. Nothing is scheduled on the loops, the tasks are only looked at from the
+calling thread.
+
+asyncio isn't imported here: if the application didn't import it there can't be any event loops.
+"""
+
+import re
+import reprlib
+import sys
+import weakref
+
+from . import _get_original
+
+_monotonic = _get_original('time', 'monotonic')
+
+# when each task was first seen (tasks don't record when they were created)
+_FIRST_SEEN = weakref.WeakKeyDictionary()
+
+_short_repr = reprlib.Repr()
+_short_repr.maxstring = _short_repr.maxother = 80
+_ADDRESS = re.compile(r' at 0x[0-9a-f]+')
+
+
+def _thread_names():
+    return {thread.ident: thread.name for thread in _get_original('threading', 'enumerate')()}
+
+
+def find_loops(asyncio):
+    """
+    Returns a ``{loop: thread ident}`` dict of the running event loops (the ident is ``None`` if unknown).
+    """
+    loops = {}
+    for ident, frame in sys._current_frames().items():
+        while frame is not None:
+            if frame.f_code.co_name == 'run_forever':
+                loop = frame.f_locals.get('self')
+                if isinstance(loop, asyncio.AbstractEventLoop):
+                    loops[loop] = ident
+                    break
+            frame = frame.f_back
+    for collection in ('_all_tasks', '_scheduled_tasks', '_eager_tasks'):
+        tasks = getattr(asyncio.tasks, collection, None)
+        if tasks is None:
+            continue
+        for _ in range(1000):
+            try:
+                tasks = list(tasks)
+            except RuntimeError:  # changed size during iteration
+                continue
+            break
+        else:
+            tasks = ()
+        for task in tasks:
+            loop = task.get_loop()
+            if loop not in loops and loop.is_running():
+                loops[loop] = getattr(loop, '_thread_id', None)
+    return loops
+
+
+def coroutine_stack(coroutine, limit):
+    """
+    Returns the ``(filename, lineno, name)`` of each coroutine (or generator) in the await chain, and what the last one
+    awaits.
+    """
+    stack = []
+    while coroutine is not None and len(stack) < limit:
+        frame = getattr(coroutine, 'cr_frame', None) or getattr(coroutine, 'gi_frame', None)
+        if frame is None:
+            if hasattr(coroutine, 'cr_code') or hasattr(coroutine, 'gi_code'):
+                break  # finished
+            return stack, coroutine
+        stack.append((frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name))
+        awaited = getattr(coroutine, 'cr_await', None)
+        if awaited is None:
+            awaited = getattr(coroutine, 'gi_yieldfrom', None)
+        coroutine = awaited
+    return stack, None
+
+
+def _describe_awaited(asyncio, task, awaited):
+    waiter = getattr(task, '_fut_waiter', None)
+    if waiter is None:
+        waiter = awaited
+    if waiter is None:
+        return None
+    if isinstance(waiter, asyncio.Task):
+        return f'Task {waiter.get_name()!r}'
+    return _ADDRESS.sub('', _short_repr.repr(waiter))
+
+
+def _state(task, coroutine):
+    if getattr(coroutine, 'cr_running', False) or getattr(coroutine, 'gi_running', False):
+        return 'running'
+    if hasattr(task, 'cancelling') and task.cancelling():
+        return 'cancelling'
+    return task._state.lower()
+
+
+def asyncio_tasks(max_stack=30, max_tasks=10):
+    """
+    Lists the pending tasks of all the running event loops, grouped by identical coroutine stacks.
+
+    Args:
+        max_stack (int): Don't follow await chains longer than this.
+        max_tasks (int): How many task names to show for each group.
+
+    Returns a dict with the ``loops`` (which thread runs them and how many tasks they have) and the ``groups`` of tasks
+    (largest first), each with the count, the stack (outermost coroutine first), the states, what the tasks are
+    awaiting and the age of the oldest task. Ages are measured from the first time a task was listed by this helper.
+    """
+    asyncio = sys.modules.get('asyncio')
+    if asyncio is None:
+        return {'loops': [], 'groups': []}
+    now = _monotonic()
+    names = _thread_names()
+    loops = []
+    groups = {}
+    for loop, ident in find_loops(asyncio).items():
+        tasks = asyncio.all_tasks(loop)
+        loops.append(
+            {
+                'loop': _short_repr.repr(loop),
+                'thread': names.get(ident, ident),
+                'tasks': len(tasks),
+            }
+        )
+        for task in tasks:
+            age = now - _FIRST_SEEN.setdefault(task, now)
+            coroutine = task.get_coro()
+            stack, awaited = coroutine_stack(coroutine, max_stack)
+            key = tuple(stack)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = {
+                    'count': 0,
+                    'stack': [f'{filename}:{lineno} in {name}' for filename, lineno, name in stack],
+                    'states': {},
+                    'awaiting': {},
+                    'oldest': 0.0,
+                    'tasks': [],
+                }
+            group['count'] += 1
+            state = _state(task, coroutine)
+            group['states'][state] = group['states'].get(state, 0) + 1
+            description = _describe_awaited(asyncio, task, awaited)
+            if description is not None:
+                group['awaiting'][description] = group['awaiting'].get(description, 0) + 1
+            group['oldest'] = max(group['oldest'], age)
+            if len(group['tasks']) < max_tasks:
+                group['tasks'].append(task.get_name())
+    return {
+        'loops': loops,
+        'groups': sorted(groups.values(), key=lambda group: group['count'], reverse=True),
+    }
@@ -0,0 +1,136 @@
+"""
+Server side of ``manhole-cli --top``.
+
+Samples are deliberately cheap: only the innermost frame of each thread is looked at (no ``linecache``, no full stack
+extraction) and only what changed since the previous sample is sent to the client.
+"""
+
+import gc
+import os
+import sys
+
+from . import _ORIGINAL__ACTIVE
+from . import _get_original
+from .channel import send_message
+from .process import get_cpu_time
+from .process import get_rss
+from .process import get_thread_cpu_time
+
+_select = _get_original('select', 'select')
+_monotonic = _get_original('time', 'monotonic')
+
+MIN_INTERVAL = 0.1
+
+
+def describe_frame(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})'
+
+
+class Sampler:
+    """
+    Takes samples of the process and thread state and computes rates against the previous sample.
+    """
+
+    def __init__(self):
+        self.time = None
+        self.cpu = None
+        self.thread_cpu = {}
+        self.gc_stats = None
+
+    def sample(self):
+        now = _monotonic()
+        elapsed = now - self.time if self.time is not None else None
+        self.time = now
+
+        cpu = get_cpu_time()
+        process_cpu = None if elapsed is None else round(100 * (cpu - self.cpu) / elapsed, 1)
+        self.cpu = cpu
+
+        gc_stats = gc.get_stats()
+        if self.gc_stats is None:
+            gc_delta = None
+        else:
+            gc_delta = {
+                'collections': [after['collections'] - before['collections'] for after, before in zip(gc_stats, self.gc_stats)],
+                'collected': sum(after['collected'] - before['collected'] for after, before in zip(gc_stats, self.gc_stats)),
+                'uncollectable': sum(after['uncollectable'] - before['uncollectable'] for after, before in zip(gc_stats, self.gc_stats)),
+            }
+        self.gc_stats = gc_stats
+
+        threads = {}
+        thread_cpu = {}
+        for ident, frame in sys._current_frames().items():
+            thread = _ORIGINAL__ACTIVE.get(ident)
+            native_id = getattr(thread, 'native_id', None)
+            seconds = get_thread_cpu_time(native_id)
+            previous = self.thread_cpu.get(ident)
+            if seconds is None or previous is None or elapsed is None:
+                usage = None
+            else:
+                usage = round(100 * (seconds - previous) / elapsed, 1)
+            thread_cpu[ident] = seconds
+            threads[str(ident)] = {
+                'name': thread.name if thread else '?',
+                'native_id': native_id,
+                'cpu': usage,
+                'where': describe_frame(frame),
+            }
+        self.thread_cpu = thread_cpu
+
+        return {
+            'pid': os.getpid(),
+            'rss': get_rss(),
+            'cpu': process_cpu,
+            'gc': {'count': gc.get_count(), 'delta': gc_delta},
+            'threads': threads,
+        }
+
+
+def diff(previous, current):
+    """
+    Returns what changed from *previous* to *current*. Threads are diffed field by field and threads that went away are
+    listed under ``gone``.
+    """
+    changes = {key: value for key, value in current.items() if key != 'threads' and previous.get(key) != value}
+    old_threads = previous.get('threads', {})
+    threads = {}
+    for ident, fields in current['threads'].items():
+        old_fields = old_threads.get(ident, {})
+        changed = {key: value for key, value in fields.items() if old_fields.get(key) != value}
+        if changed:
+            threads[ident] = changed
+    if threads:
+        changes['threads'] = threads
+    gone = [ident for ident in old_threads if ident not in current['threads']]
+    if gone:
+        changes['gone'] = gone
+    return changes
+
+
+def apply_diff(state, changes):
+    """
+    Client side counterpart of :func:`diff`.
+    """
+    threads = state.setdefault('threads', {})
+    for ident in changes.get('gone', ()):
+        threads.pop(ident, None)
+    for ident, fields in changes.get('threads', {}).items():
+        threads.setdefault(ident, {}).update(fields)
+    state.update((key, value) for key, value in changes.items() if key not in ('threads', 'gone'))
+    return state
+
+
+def handle_request(client, interval=1.0):
+    """
+    Sends a diff every *interval* seconds until the client closes the connection (or sends anything).
+    """
+    interval = max(float(interval), MIN_INTERVAL)
+    sampler = Sampler()
+    previous = {}
+    while True:
+        current = sampler.sample()
+        send_message(client, diff(previous, current))
+        previous = current
+        if _select([client], [], [], interval)[0]:
+            break
@@ -0,0 +1,396 @@
+"""
+Latency tracer for a few chosen functions.
+
+On Python 3.12+ this uses ``sys.monitoring`` with local events only, so only the code objects of the traced functions
+get instrumented. On older Pythons the function's ``__code__`` is temporarily swapped with a small trampoline that times
+the call - a ``setprofile`` based tracer would only see the calling thread (``threading.setprofile_all_threads`` is
+3.12+ too). Either way everything is restored when the tracing window ends.
+"""
+
+import importlib
+import itertools
+import sys
+import threading
+import types
+from functools import partial
+from heapq import heappush
+from heapq import heapreplace
+
+from . import _ORIGINAL_ALLOCATE_LOCK
+from . import _ORIGINAL_SLEEP
+from . import _get_original
+from .histogram import Histogram
+from .query import make_repr
+
+_perf_counter = _get_original('time', 'perf_counter')
+_get_ident = _get_original('_thread', 'get_ident')
+
+POLL_INTERVAL = 0.01
+
+_ACTIVE = set()
+_ACTIVE_LOCK = _ORIGINAL_ALLOCATE_LOCK()
+# Trampolines look up their callers here. Entries are never removed (a trampoline could be running while tracing
+# ends), they are switched to a plain passthrough instead.
+_CALLS = {}
+_KEYS = itertools.count()
+
+
+def resolve(target):
+    """
+    Returns the function for *target*: a function, method or a ``"package.module:Class.method"`` (or
+    ``"package.module.Class.method"``) string.
+    """
+    if isinstance(target, str):
+        if ':' in target:
+            module_name, _, path = target.partition(':')
+            obj = importlib.import_module(module_name)
+        else:
+            parts = target.split('.')
+            for position in range(len(parts) - 1, 0, -1):
+                try:
+                    obj = importlib.import_module('.'.join(parts[:position]))
+                except ImportError:
+                    continue
+                path = '.'.join(parts[position:])
+                break
+            else:
+                raise ValueError(f'Cannot import anything from {target!r}.')
+        for attribute in path.split('.'):
+            obj = getattr(obj, attribute)
+        target = obj
+    target = getattr(target, '__func__', target)  # methods, classmethod and staticmethod objects
+    if not isinstance(target, types.FunctionType):
+        raise TypeError(f'Cannot trace {target!r}: not a Python function.')
+    return target
+
+
+class Recorder:
+    """
+    Collects the durations of one function and the arguments of its slowest calls.
+    """
+
+    def __init__(self, function, slowest, max_repr):
+        self.function = function
+        self.name = f'{function.__module__}.{function.__qualname__}'
+        self.histogram = Histogram()
+        self.errors = 0
+        self.slowest = []
+        self.slowest_count = slowest
+        self.safe_repr = make_repr(max_repr)
+        self.max_repr = max_repr
+        self.sequence = itertools.count()
+
+    def is_slow(self, elapsed):
+        return len(self.slowest) < self.slowest_count or elapsed > self.slowest[0][0]
+
+    def record(self, elapsed, error, arguments):
+        """
+        Records a call. *arguments* is a function returning ``(name, value)`` pairs, only called for the slowest calls.
+        """
+        self.histogram.add(elapsed)
+        if error:
+            self.errors += 1
+        if self.slowest_count and self.is_slow(elapsed):
+            entry = (
+                elapsed,
+                next(self.sequence),
+                ', '.join(self.format_argument(name, value) for name, value in arguments()),
+                threading.current_thread().name,
+                error,
+            )
+            if len(self.slowest) < self.slowest_count:
+                heappush(self.slowest, entry)
+            else:
+                heapreplace(self.slowest, entry)
+
+    def format_argument(self, name, value):
+        try:
+            value = self.safe_repr(value)[: self.max_repr]
+        except Exception as exc:
+            value = f'<repr failed: {exc!r}>'
+        return value if name is None else f'{name}={value}'
+
+    def result(self):
+        result = self.histogram.summary()
+        result['errors'] = self.errors
+        result['slowest'] = [
+            {'elapsed': elapsed, 'arguments': arguments, 'thread': thread, 'error': error}
+            for elapsed, _, arguments, thread, error in sorted(self.slowest, reverse=True)
+        ]
+        result['histogram'] = self.histogram.buckets()
+        return result
+
+
+def _frame_arguments(frame):
+    code = frame.f_code
+    count = code.co_argcount + code.co_kwonlyargcount
+    count += bool(code.co_flags & 0x04) + bool(code.co_flags & 0x08)  # *args and **kwargs
+    variables = frame.f_locals
+    return [(name, variables.get(name)) for name in code.co_varnames[:count]]
+
+
+class MonitoringBackend:
+    """
+    Uses ``sys.monitoring`` (Python 3.12+).
+
+    There's no local event for a call that ends with an exception (``PY_UNWIND`` can only be enabled globally), so the
+    calls in flight are kept with their frame and :meth:`poll` looks for the frames that aren't on the stack of their
+    thread anymore (and aren't suspended generators or coroutines). The duration of those calls is only accurate to the
+    polling interval.
+    """
+
+    name = 'sys.monitoring'
+    poll_interval = POLL_INTERVAL
+
+    def __init__(self, recorders):
+        self.recorders = recorders
+        self.calls = {}  # id(frame): [start, frame, thread ident, number of yields and resumes]
+        self.callbacks = {}
+        self.tool_id = None
+
+    def on_start(self, code, offset):
+        frame = sys._getframe(1)
+        self.calls[id(frame)] = [_perf_counter(), frame, _get_ident(), 0]
+
+    def on_return(self, code, offset, value):
+        frame = sys._getframe(1)
+        call = self.calls.pop(id(frame), None)
+        if call is not None:
+            self.recorders[code].record(_perf_counter() - call[0], False, partial(_frame_arguments, frame))
+
+    def on_yield(self, code, offset, value):
+        call = self.calls.get(id(sys._getframe(1)))
+        if call is not None:
+            call[3] += 1
+
+    def on_resume(self, code, offset):
+        call = self.calls.get(id(sys._getframe(1)))
+        if call is not None:
+            call[2] = _get_ident()  # generators and coroutines can be resumed from another thread
+            call[3] += 1
+
+    def poll(self):
+        """
+        Records the calls that ended with an exception.
+        """
+        running = [(key, call, call[2:]) for key, call in list(self.calls.items()) if not call[3] % 2]
+        if not running:
+            return
+        stacks = sys._current_frames()  # pylint: disable=W0212
+        now = _perf_counter()
+        for key, call, state in running:
+            start, frame, ident, _ = call
+            current = stacks.get(ident)
+            while current is not None and current is not frame:
+                current = current.f_back
+            # skip it if it was suspended or resumed meanwhile, it might not be on the stack that was looked at
+            if current is None and call[2:] == state and self.calls.pop(key, None) is call:
+                self.recorders[frame.f_code].record(now - start, True, partial(_frame_arguments, frame))
+
+    def attach(self):
+        monitoring = sys.monitoring
+        for tool_id in (monitoring.PROFILER_ID, 3, 4, 5, monitoring.OPTIMIZER_ID, monitoring.DEBUGGER_ID):
+            if monitoring.get_tool(tool_id) is None:
+                monitoring.use_tool_id(tool_id, 'manhole-tracer')
+                self.tool_id = tool_id
+                break
+        else:
+            raise RuntimeError('All the sys.monitoring tool ids are in use.')
+        events = monitoring.events
+        self.callbacks = {
+            events.PY_START: self.on_start,
+            events.PY_RETURN: self.on_return,
+            events.PY_YIELD: self.on_yield,
+            events.PY_RESUME: self.on_resume,
+        }
+        for event, callback in self.callbacks.items():
+            monitoring.register_callback(self.tool_id, event, callback)
+        for code in self.recorders:
+            local_events = events.PY_START | events.PY_RETURN
+            if code.co_flags & 0x2A0:  # CO_GENERATOR, CO_COROUTINE or CO_ASYNC_GENERATOR
+                local_events |= events.PY_YIELD | events.PY_RESUME
+            monitoring.set_local_events(self.tool_id, code, local_events)
+
+    def detach(self):
+        if self.tool_id is None:
+            return
+        monitoring = sys.monitoring
+        for code in self.recorders:
+            monitoring.set_local_events(self.tool_id, code, 0)
+        for event in self.callbacks:
+            monitoring.register_callback(self.tool_id, event, None)
+        monitoring.free_tool_id(self.tool_id)
+        self.tool_id = None
+        self.calls.clear()
+
+
+_TRAMPOLINE = """
+def _factory():
+    {freevars}
+    {prefix}def {name}(*_manhole_args, **_manhole_kwargs):
+        if _manhole_args is None:
+            ({freevars_tuple})
+        return {call}
+"""
+
+
+def _passthrough(function):
+    def call(args, kwargs):
+        return function(*args, **kwargs)
+
+    return call
+
+
+def _make_caller(function, recorder):
+    def arguments(args, kwargs):
+        return lambda: [(None, value) for value in args] + list(kwargs.items())
+
+    if function.__code__.co_flags & 0x80:  # CO_COROUTINE
+
+        async def call(args, kwargs):
+            start = _perf_counter()
+            try:
+                result = await function(*args, **kwargs)
+            except BaseException:
+                recorder.record(_perf_counter() - start, True, arguments(args, kwargs))
+                raise
+            recorder.record(_perf_counter() - start, False, arguments(args, kwargs))
+            return result
+
+    elif function.__code__.co_flags & 0x20:  # CO_GENERATOR
+
+        def call(args, kwargs):
+            start = _perf_counter()
+            try:
+                result = yield from function(*args, **kwargs)
+            except BaseException:
+                recorder.record(_perf_counter() - start, True, arguments(args, kwargs))
+                raise
+            recorder.record(_perf_counter() - start, False, arguments(args, kwargs))
+            return result
+
+    else:
+
+        def call(args, kwargs):
+            start = _perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            except BaseException:
+                recorder.record(_perf_counter() - start, True, arguments(args, kwargs))
+                raise
+            recorder.record(_perf_counter() - start, False, arguments(args, kwargs))
+            return result
+
+    return call
+
+
+class TrampolineBackend:
+    """
+    Swaps the ``__code__`` of the traced functions (any Python version).
+    """
+
+    name = 'trampoline'
+    poll_interval = None
+
+    def __init__(self, recorders):
+        self.recorders = recorders
+        self.swapped = []
+
+    @staticmethod
+    def make_trampoline(function, key):
+        code = function.__code__
+        if code.co_flags & 0x200:  # CO_ASYNC_GENERATOR
+            raise TypeError(f'Cannot trace {function!r}: async generators are not supported before Python 3.12.')
+        call = f"__import__('manhole.tracer', None, None, ('_CALLS',))._CALLS[{key}](_manhole_args, _manhole_kwargs)"
+        prefix = ''
+        if code.co_flags & 0x80:
+            prefix, call = 'async ', f'await {call}'
+        elif code.co_flags & 0x20:
+            call = f'(yield from {call})'
+        source = _TRAMPOLINE.format(
+            freevars=''.join(f'{name} = ' for name in code.co_freevars) + 'None',
+            freevars_tuple=''.join(f'{name}, ' for name in code.co_freevars),
+            prefix=prefix,
+            name=code.co_name if code.co_name.isidentifier() else '_manhole_trampoline',
+            call=call,
+        )
+        namespace = {}
+        exec(compile(source, code.co_filename, 'exec'), namespace)  # noqa: S102
+        (trampoline,) = (const for const in namespace['_factory'].__code__.co_consts if isinstance(const, types.CodeType))
+        if hasattr(code, 'co_qualname'):
+            trampoline = trampoline.replace(co_qualname=code.co_qualname)
+        return trampoline
+
+    def attach(self):
+        for code, recorder in self.recorders.items():
+            function = recorder.function
+            original = types.FunctionType(code, function.__globals__, function.__name__, function.__defaults__, function.__closure__)
+            original.__kwdefaults__ = function.__kwdefaults__
+            key = next(_KEYS)
+            trampoline = self.make_trampoline(function, key)
+            _CALLS[key] = _make_caller(original, recorder)
+            function.__code__ = trampoline
+            self.swapped.append((function, code, trampoline, key, original))
+
+    def detach(self):
+        while self.swapped:
+            function, code, trampoline, key, original = self.swapped.pop()
+            if function.__code__ is trampoline:  # otherwise something else replaced it meanwhile, leave that alone
+                function.__code__ = code
+            _CALLS[key] = _passthrough(original)
+
+
+def trace_latency(*targets, duration=10.0, slowest=5, max_repr=200):
+    """
+    Traces calls to the given functions for *duration* seconds and returns their latencies.
+
+    Args:
+        targets: Functions, methods or ``"package.module:Class.method"`` strings.
+        duration (float): Seconds to trace. The functions are restored afterwards, even if this gets interrupted.
+        slowest (int): Keep the arguments of this many slowest calls (per function).
+        max_repr (int): Maximum size of the ``repr`` of each argument.
+
+    Returns a dict with the backend used and, for each function, the latency percentiles (in seconds), the number of
+    calls that raised, the slowest calls (with their arguments, thread and whether they raised) and the histogram.
+    """
+    if not targets:
+        raise TypeError('trace_latency() needs at least one function to trace.')
+    recorders = {}
+    for target in targets:
+        function = resolve(target)
+        recorders[function.__code__] = Recorder(function, slowest, max_repr)
+
+    if hasattr(sys, 'monitoring'):
+        backend = MonitoringBackend(recorders)
+    else:
+        backend = TrampolineBackend(recorders)
+
+    with _ACTIVE_LOCK:
+        busy = [recorder.name for recorder in recorders.values() if recorder.function in _ACTIVE]
+        if busy:
+            raise RuntimeError(f'Already tracing: {", ".join(busy)}.')
+        _ACTIVE.update(recorder.function for recorder in recorders.values())
+    try:
+        try:
+            backend.attach()
+            if backend.poll_interval is None:
+                _ORIGINAL_SLEEP(duration)
+            else:
+                deadline = _perf_counter() + duration
+                while True:
+                    remaining = deadline - _perf_counter()
+                    if remaining <= 0:
+                        break
+                    _ORIGINAL_SLEEP(min(remaining, backend.poll_interval))
+                    backend.poll()
+        finally:
+            backend.detach()
+    finally:
+        with _ACTIVE_LOCK:
+            _ACTIVE.difference_update(recorder.function for recorder in recorders.values())
+
+    return {
+        'duration': duration,
+        'backend': backend.name,
+        'functions': {recorder.name: recorder.result() for recorder in recorders.values()},
+    }
@@ -0,0 +1,161 @@
+"""
+Server side of ``manhole-cli --run SCRIPT`` and ``manhole-cli --inject MODULE``: runs a whole file in the process.
+
+The client sends a ``run`` request with the SHA-256 of the file. If code with that hash was compiled before it's reused,
+otherwise the server asks for the source, which comes in a single ``DATA`` frame, checks the hash, compiles it and
+caches the code object (the last ``CACHE_SIZE`` files are kept). Re-running an unchanged script only costs a round
+trip.
+
+Scripts run as ``__main__`` in a fresh copy of the REPL namespace. Modules (``--inject``) are executed in a new module
+object that replaces ``sys.modules[name]``, so ``import name`` works in the REPL afterwards. What the code ``print()``s
+(only the file's own calls, ``sys.stdout`` isn't redirected) is streamed back in ``TEXT`` frames. The ``command_timeout``
+and ``command_max_rss_growth`` limits apply. ``sys.exit()`` only ends the script (a non-zero code is reported as an
+error).
+"""
+
+import builtins
+import hashlib
+import linecache
+import sys
+import traceback
+import types
+from collections import OrderedDict
+from contextlib import nullcontext
+from functools import partial
+
+from . import _ORIGINAL_ALLOCATE_LOCK
+from . import _get_original
+from . import get_namespace
+from .channel import DATA
+from .channel import TEXT
+from .channel import ProtocolError
+from .channel import recv_frame
+from .channel import send_frame
+from .channel import send_message
+from .guard import CommandLimitExceeded
+from .guard import make_guard
+
+_perf_counter = _get_original('time', 'perf_counter')
+
+CACHE_SIZE = 32
+
+_CACHE = OrderedDict()
+_LOCK = _ORIGINAL_ALLOCATE_LOCK()
+
+
+class FrameWriter:
+    """
+    Minimal text file that sends what is written to it as ``TEXT`` frames.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = _ORIGINAL_ALLOCATE_LOCK()  # the code might print from several threads
+
+    def write(self, text):
+        if text:
+            with self.lock:
+                send_frame(self.sock, TEXT, text.encode('utf8', 'replace'))
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def get_code(digest, filename, fetch_source):
+    """
+    Returns a ``(code, cached)`` tuple. On a cache miss *fetch_source* is called to get the source (``bytes``), which
+    must match the SHA-256 *digest*.
+    """
+    with _LOCK:
+        code = _CACHE.get(digest)
+        if code is not None:
+            _CACHE.move_to_end(digest)
+            return code, True
+    source = fetch_source()
+    actual = hashlib.sha256(source).hexdigest()
+    if actual != digest:
+        raise ValueError(f'The source of {filename!r} has the SHA-256 {actual}, expected {digest}.')
+    filename = f'{filename}@{digest[:12]}'  # so tracebacks show the right lines even if the file changes later
+    code = compile(source, filename, 'exec', dont_inherit=True)
+    linecache.cache[filename] = len(source), None, source.decode('utf8', 'replace').splitlines(True), filename
+    with _LOCK:
+        _CACHE[digest] = code
+        while len(_CACHE) > CACHE_SIZE:
+            _, evicted = _CACHE.popitem(last=False)
+            linecache.cache.pop(evicted.co_filename, None)
+    return code, False
+
+
+def run_code(code, output, module=None, guard=None):
+    """
+    Runs *code* as a script or, if *module* is given, as the module with that name. Returns the error message (or
+    ``None``). The traceback is written to *output*.
+    """
+    from . import _MANHOLE
+
+    print_ = partial(builtins.print, file=output)
+    if module is None:
+        namespace = get_namespace(_MANHOLE.locals)
+        namespace.update(__name__='__main__', __file__=code.co_filename, print=print_)
+    else:
+        target = types.ModuleType(module)
+        target.__file__ = code.co_filename
+        namespace = vars(target)
+        namespace['print'] = print_
+        previous = sys.modules.get(module)
+        sys.modules[module] = target
+    try:
+        try:
+            with guard or nullcontext():
+                exec(code, namespace)  # noqa: S102
+        finally:
+            if module is not None and namespace.get('print') is print_:
+                del namespace['print']  # the functions in the module will use the builtin print
+    except CommandLimitExceeded:
+        error = guard.reason
+    except SystemExit as exc:  # sys.exit() ends the script, not the process (or the manhole thread)
+        if exc.code in (None, 0):
+            return None
+        error = f'SystemExit: {exc.code}'
+    except Exception as exc:
+        output.write(''.join(traceback.format_exception(type(exc), exc, exc.__traceback__.tb_next)))  # skip this frame
+        error = f'{type(exc).__name__}: {exc}'
+    else:
+        return None
+    if module is not None:
+        if previous is None:
+            sys.modules.pop(module, None)
+        else:
+            sys.modules[module] = previous
+    return error
+
+
+def handle_request(client, digest, filename, module=None):
+    """
+    Runs a file (see the module docstring). Sends a message telling if the code was cached (if it wasn't the client
+    must send the source), the output in ``TEXT`` frames and then a message with the elapsed time and the error (if
+    any).
+    """
+
+    def fetch_source():
+        send_message(client, {'cached': False})
+        kind, source = recv_frame(client)
+        if kind != DATA:
+            raise ProtocolError(f'Expected the source of {filename!r}, got a {kind!r} frame.')
+        return source
+
+    code, cached = get_code(digest, filename, fetch_source)
+    if cached:
+        send_message(client, {'cached': True})
+    guard = make_guard()
+    start = _perf_counter()
+    try:
+        error = run_code(code, FrameWriter(client), module, guard)
+    finally:
+        if guard is not None:
+            guard.close()
+    result = {'elapsed': _perf_counter() - start, 'cached': cached}
+    if error is not None:
+        result['error'] = error
+    send_message(client, result)
@@ -0,0 +1,285 @@
+"""
+Offline benchmarks for manhole (Linux).
+
+Usage::
+
+    python tests/benchmark.py [--rounds N] [--only NAME ...] [--json results.json]
+
+Each benchmark starts the processes it needs (see the ``bench_*`` scenarios in ``helper.py``). Results are printed as
+text and optionally written as JSON so they can be compared between releases.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from manhole.channel import format_request
+
+TIMEOUT = int(os.getenv('MANHOLE_TEST_TIMEOUT', 10))
+HELPER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'helper.py')
+
+
+def percentiles(samples):
+    """
+    Returns a summary (count/mean/min/p50/p90/p99/max) of the given samples.
+    """
+    samples = sorted(samples)
+    if not samples:
+        return {'count': 0}
+
+    def percentile(percent):
+        return samples[min(len(samples) - 1, int(round(percent / 100.0 * (len(samples) - 1))))]
+
+    return {
+        'count': len(samples),
+        'mean': sum(samples) / len(samples),
+        'min': samples[0],
+        'p50': percentile(50),
+        'p90': percentile(90),
+        'p99': percentile(99),
+        'max': samples[-1],
+    }
+
+
+class Service:
+    """
+    Runs a ``helper.py`` scenario and gives access to the lines it prints.
+    """
+
+    def __init__(self, scenario):
+        self.proc = subprocess.Popen(
+            [sys.executable, '-u', HELPER, scenario],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            env=dict(os.environ, PYTHONPATH=os.path.dirname(HELPER)),
+        )
+        self.uds_path = f'/tmp/manhole-{self.proc.pid}'
+
+    def wait_for_line(self, prefix):
+        deadline = time.monotonic() + TIMEOUT
+        while time.monotonic() < deadline:
+            line = self.proc.stdout.readline().decode()
+            if line.startswith(prefix):
+                return line.split()[1:]
+            if not line:
+                break
+        raise RuntimeError(f'Helper never printed {prefix!r}.')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            self.proc.send_signal(signal.SIGTERM)
+            self.proc.wait(TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+        self.proc.stdout.close()
+
+
+def connect(uds_path, timeout=TIMEOUT):
+    """
+    Connects as soon as possible. Returns the socket and the monotonic time when the connection succeeded.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(uds_path)
+        except OSError:
+            sock.close()
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.0005)
+        else:
+            return sock, time.monotonic()
+
+
+def read_until(sock, marker, size=None):
+    """
+    Reads until *marker* was received (and at least *size* bytes). Returns the number of bytes read.
+    """
+    sock.settimeout(TIMEOUT)
+    received = 0
+    tail = b''
+    while True:
+        chunk = sock.recv(1024**2)
+        if not chunk:
+            raise RuntimeError(f'Connection closed before receiving {marker!r}.')
+        received += len(chunk)
+        tail = (tail + chunk)[-len(marker) :]
+        if tail == marker and (size is None or received >= size):
+            return received
+
+
+def bench_install(rounds):
+    """
+    Time from calling ``install()`` to a connectable socket.
+    """
+    samples = []
+    for _ in range(rounds):
+        with Service('bench_install') as service:
+            (before,) = service.wait_for_line('BEFORE_INSTALL')
+            sock, connected = connect(service.uds_path)
+            sock.close()
+            samples.append(connected - float(before))
+    return percentiles(samples)
+
+
+def bench_first_prompt(rounds):
+    """
+    Time from connecting to receiving the first ``>>>`` prompt (includes the stacktrace dump). The ``repl`` request is
+    sent right away, like ``manhole-cli`` does, otherwise the server waits for it until ``request_timeout``.
+    """
+    samples = []
+    with Service('bench_install') as service:
+        service.wait_for_line('BEFORE_INSTALL')
+        for _ in range(rounds):
+            start = time.monotonic()
+            sock, _ = connect(service.uds_path)
+            with sock:
+                sock.sendall(format_request('repl'))
+                read_until(sock, b'>>> ')
+                samples.append(time.monotonic() - start)
+    return percentiles(samples)
+
+
+def bench_dump_stacktraces(rounds, thread_counts=(10, 100, 1000, 5000)):
+    """
+    Cost of ``dump_stacktraces()`` with many threads (measured in this process).
+    """
+    import manhole
+
+    manhole.install(verbose=False, thread=False, patch_fork=False, strict=False)
+    results = {}
+    old_stack_size = threading.stack_size(256 * 1024)
+    try:
+        for count in thread_counts:
+            stop = threading.Event()
+            threads = [threading.Thread(target=stop.wait, daemon=True) for _ in range(count - threading.active_count())]
+            for thread in threads:
+                thread.start()
+            samples = []
+            old_stderr = sys.stderr
+            try:
+                for _ in range(rounds):
+                    sys.stderr = io.StringIO()
+                    start = time.perf_counter()
+                    manhole.dump_stacktraces()
+                    samples.append(time.perf_counter() - start)
+            finally:
+                sys.stderr = old_stderr
+                stop.set()
+                for thread in threads:
+                    thread.join()
+            results[str(count)] = percentiles(samples)
+    finally:
+        threading.stack_size(old_stack_size)
+    return results
+
+
+def bench_exec(rounds, statements=5000):
+    """
+    Statements per second through the ``exec`` connection handler.
+    """
+    samples = []
+    payload = b'x = 1\n' * statements + b'exit()\n'
+    with Service('bench_exec') as service:
+        for _ in range(rounds):
+            start = time.monotonic()
+            sock, _ = connect(service.uds_path)
+            with sock:
+                sock.sendall(payload)
+                sock.settimeout(TIMEOUT)
+                # the handler closes the connection after exit()
+                while sock.recv(1024):
+                    pass
+            samples.append(statements / (time.monotonic() - start))
+    return percentiles(samples)
+
+
+def bench_output(rounds, size=16 * 1024**2):
+    """
+    Bytes per second printed through the REPL.
+    """
+    samples = []
+    with Service('bench_install') as service:
+        service.wait_for_line('BEFORE_INSTALL')
+        sock, _ = connect(service.uds_path)
+        with sock:
+            sock.sendall(format_request('repl'))
+            read_until(sock, b'>>> ')
+            for _ in range(rounds):
+                start = time.monotonic()
+                sock.sendall(b"sys.stdout.write('x' * %d) and None\n" % size)
+                read_until(sock, b'>>> ', size)
+                samples.append(size / (time.monotonic() - start))
+    return percentiles(samples)
+
+
+def bench_fork(rounds):
+    """
+    Time from ``os.fork()`` to a connectable socket in the child (with ``reinstall_delay=0``).
+    """
+    samples = []
+    for _ in range(rounds):
+        with Service('bench_fork') as service:
+            pid, before = service.wait_for_line('FORKED')
+            try:
+                sock, connected = connect(f'/tmp/manhole-{pid}')
+                sock.close()
+                samples.append(connected - float(before))
+            finally:
+                os.kill(int(pid), signal.SIGKILL)
+    return percentiles(samples)
+
+
+BENCHMARKS = {
+    'install': bench_install,
+    'first_prompt': bench_first_prompt,
+    'dump_stacktraces': bench_dump_stacktraces,
+    'exec': bench_exec,
+    'output': bench_output,
+    'fork': bench_fork,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run manhole benchmarks.')
+    parser.add_argument('--rounds', type=int, default=10, help='Rounds for each benchmark. Default: %(default)s.')
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), default=list(BENCHMARKS), help='Run only these benchmarks.')
+    parser.add_argument('--json', dest='json_path', help='Write the results to this file.')
+    args = parser.parse_args()
+
+    import manhole
+
+    results = {
+        'manhole': manhole.__version__,
+        'python': sys.version,
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'rounds': args.rounds,
+        'benchmarks': {},
+    }
+    for name in args.only:
+        start = time.monotonic()
+        results['benchmarks'][name] = result = BENCHMARKS[name](args.rounds)
+        print(f'{name} ({time.monotonic() - start:.1f}s): {json.dumps(result, indent=2)}')
+
+    if args.json_path:
+        with open(args.json_path, 'w') as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -88,6 +88,35 @@ if __name__ == '__main__':
             manhole.install(oneshot_on='USR2')
             manhole.install(strict=False)
             time.sleep(TIMEOUT)
+        elif test_name == 'test_release':
+            manhole.install()
+            time.sleep(0.3)
+            thread = manhole._MANHOLE.thread
+            start = time.time()
+            manhole._MANHOLE.release()
+            print(f'Released in {time.time() - start:.3f}s (alive={thread.is_alive()})')
+            manhole.install(strict=False)
+            time.sleep(TIMEOUT)
+        elif test_name == 'test_release_busy':
+            import socket
+
+            manhole.install(connection_handler='exec')
+            time.sleep(0.3)
+            thread = manhole._MANHOLE.thread
+            fds = thread.wakeup_fds
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(manhole._MANHOLE.uds_name)
+            time.sleep(0.3)
+            manhole._MANHOLE.stop_timeout = 0.1
+            manhole._MANHOLE.release()
+            print(f'Released (alive={thread.is_alive()})')
+            client.close()
+            thread.join(TIMEOUT)
+            for fd in fds:
+                try:
+                    os.fstat(fd)
+                except OSError:
+                    print(f'Closed fd {fd}')
         elif test_name == 'test_unbuffered':
             manhole.install(verbose=True)
             print(os.getpid())
@@ -137,6 +166,18 @@ if __name__ == '__main__':
                     os.unlink(path)
                     raise AssertionError(path + ' exists !')
             print('SUCCESS')
+        elif test_name == 'test_stack_dump_on_removed_fork':
+            manhole.install(stack_dump_on='USR2')
+            manhole.install(strict=False)
+            pid = os.fork()
+            if pid:
+                os.waitpid(pid, 0)
+                print('SUCCESS')
+            else:
+                try:
+                    print('Child stacks file:', os.path.exists(f'/tmp/manhole-{os.getpid()}-stacks'))
+                finally:
+                    os._exit(0)
         elif test_name == 'test_fork_exec':
             manhole.install(reinstall_delay=5)
             print('Installed.')
@@ -241,12 +282,100 @@ if __name__ == '__main__':
         elif test_name == 'test_redirect_stderr_disabled':
             manhole.install(socket_path=SOCKET_PATH, redirect_stderr=False)
             time.sleep(TIMEOUT)
+        elif test_name == 'test_command_limits':
+            manhole.install(command_timeout=0.5, command_max_rss_growth=100 * 1024 * 1024)
+            time.sleep(TIMEOUT * 10)
+        elif test_name == 'test_tail':
+            manhole.install()
+            log = logging.getLogger('helper.tail')
+            logging.getLogger().setLevel(logging.INFO)
+            for i in range(int(TIMEOUT * 10)):
+                log.info('tick %s', i)
+                log.debug('hidden')
+                try:
+                    raise ZeroDivisionError('division by zero')
+                except ZeroDivisionError:
+                    log.exception('failed')
+                print('printed', i)
+                time.sleep(0.1)
+        elif test_name == 'test_thread_scheduling':
+            manhole.install(thread_priority='idle', thread_affinity=[max(os.sched_getaffinity(0))])
+            time.sleep(TIMEOUT)
         elif test_name == 'test_sigmask':
             manhole.install(socket_path=SOCKET_PATH, sigmask=[signal.SIGUSR1])
             time.sleep(TIMEOUT)
+        elif test_name == 'test_stack_dump_on':
+            import ctypes
+
+            manhole.install(stack_dump_on='USR2')
+            while not os.path.exists(f'/tmp/manhole-{os.getpid()}'):  # the manhole must listen before the GIL is taken
+                time.sleep(0.05)
+            time.sleep(0.1)
+            print('Holding the GIL.', file=OUTPUT, flush=True)
+            ctypes.PyDLL(None).sleep(TIMEOUT * 10)  # functions from a PyDLL are called without releasing the GIL
+        elif test_name == 'test_stalls':
+            from manhole.stalls import heartbeat
+
+            def stall():
+                manhole._get_original('time', 'sleep')(0.6)  # a patched sleep (gevent) would just switch to the hub
+
+            manhole.install(stall_watchdog=0.2)
+            heartbeat()
+            stall()
+            heartbeat()
+            print('Stalled.', file=OUTPUT, flush=True)
+            for _ in range(TIMEOUT * 50):
+                heartbeat()
+                time.sleep(0.02)
+        elif test_name == 'test_stalls_fork':
+            from manhole.stalls import heartbeat
+            from manhole.stalls import stalls
+
+            sleep = manhole._get_original('time', 'sleep')
+
+            def stall_and_wait():
+                heartbeat()
+                sleep(0.4)
+                heartbeat()
+                for _ in range(TIMEOUT * 50):
+                    if stalls()['stalls']:
+                        return stalls()['stalls']
+                    sleep(0.02)
+                raise AssertionError('No stall recorded.')
+
+            manhole.install(stall_watchdog=0.1)
+            print('Parent stalls:', len(stall_and_wait()))
+            pid = os.fork()
+            if pid:
+                os.waitpid(pid, 0)
+                print('SUCCESS')
+            else:
+                try:
+                    print('Child stalls after fork:', len(stalls()['stalls']))
+                    print('Child stalls:', len(stall_and_wait()))
+                finally:
+                    os._exit(0)
         elif test_name == 'test_connection_handler_exec_func':
             manhole.install(connection_handler=manhole.handle_connection_exec, locals={'tete': lambda: print('TETE')})
             time.sleep(TIMEOUT * 10)
+        elif test_name == 'bench_install':
+            print(f'BEFORE_INSTALL {time.monotonic()}', file=OUTPUT, flush=True)
+            manhole.install(verbose=False)
+            time.sleep(TIMEOUT * 10)
+        elif test_name == 'bench_exec':
+            manhole.install(verbose=False, connection_handler='exec')
+            time.sleep(TIMEOUT * 10)
+        elif test_name == 'bench_fork':
+            manhole.install(verbose=False, reinstall_delay=0)
+            time.sleep(0.3)
+            before = time.monotonic()
+            pid = os.fork()
+            if pid:
+                print(f'FORKED {pid} {before}', file=OUTPUT, flush=True)
+                os.waitpid(pid, 0)
+            else:
+                time.sleep(TIMEOUT)
+                os._exit(0)
         elif test_name == 'test_connection_handler_exec_str':
             manhole.install(connection_handler='exec', locals={'tete': lambda: print('TETE')})
             time.sleep(TIMEOUT * 10)
@@ -0,0 +1,209 @@
+"""
+Measures how much an active manhole session hurts the application it is attached to.
+
+Usage::
+
+    python tests/host_impact.py [--duration SECONDS] [--rate REQUESTS_PER_SECOND] [--json results.json]
+
+Starts the ``wsgi.py`` application (with a bit of CPU work per request) on ``wsgiref`` and drives it at a fixed request
+rate. Latencies are measured from the time each request was *scheduled*, so stalls aren't hidden by the load generator
+slowing down. The workload runs in three phases:
+
+* ``baseline`` - no manhole installed.
+* ``idle`` - manhole installed, nobody connected.
+* ``sessions`` - manhole installed and scripted sessions keep attaching, running commands, dumping stacks and detaching.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from benchmark import percentiles
+from benchmark import read_until
+from manhole.channel import format_request
+
+TIMEOUT = int(os.getenv('MANHOLE_TEST_TIMEOUT', 10))
+SESSION_COMMANDS = (
+    b'dump_stacktraces()\n',
+    b'len(sys.modules)\n',
+    b"[t.name for t in __import__('threading').enumerate()]\n",
+)
+
+
+def serve(with_manhole, work):
+    from socketserver import ThreadingMixIn
+    from wsgiref.simple_server import WSGIRequestHandler
+    from wsgiref.simple_server import WSGIServer
+    from wsgiref.simple_server import make_server
+
+    import wsgi
+
+    if with_manhole:
+        import manhole
+
+        manhole.install(verbose=False)
+
+    class Server(ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+        request_queue_size = 128
+
+    class Handler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    def application(environ, start_response):
+        total = 0
+        for i in range(work):
+            total += i * i
+        return wsgi.application(environ, start_response)
+
+    server = make_server('127.0.0.1', 0, application, server_class=Server, handler_class=Handler)
+    print(f'LISTENING {server.server_port}', flush=True)
+    server.serve_forever()
+
+
+class App:
+    def __init__(self, with_manhole, work):
+        self.proc = subprocess.Popen(
+            [sys.executable, '-u', __file__, '--serve', '--work', str(work), *(['--with-manhole'] if with_manhole else [])],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            env=dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__))),
+        )
+        line = self.proc.stdout.readline().decode()
+        if not line.startswith('LISTENING'):
+            self.close()
+            raise RuntimeError(f'Application failed to start: {line!r}')
+        self.port = int(line.split()[1])
+        self.uds_path = f'/tmp/manhole-{self.proc.pid}'
+
+    def close(self):
+        self.proc.send_signal(signal.SIGTERM)
+        try:
+            self.proc.wait(TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+        self.proc.stdout.close()
+
+
+def drive(port, rate, duration, concurrency):
+    """
+    Sends *rate* requests per second for *duration* seconds. Returns the latencies and the number of errors.
+    """
+    latencies = []
+    errors = []
+    start = time.monotonic() + 0.1
+    total = int(rate * duration)
+
+    def worker(offset):
+        for i in range(offset, total, concurrency):
+            scheduled = start + i / rate
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=TIMEOUT)
+            try:
+                connection.request('GET', '/')
+                connection.getresponse().read()
+            except (OSError, http.client.HTTPException) as exc:
+                errors.append(repr(exc))
+            else:
+                latencies.append(time.monotonic() - scheduled)
+            finally:
+                connection.close()
+
+    workers = [threading.Thread(target=worker, args=(offset,)) for offset in range(concurrency)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return latencies, errors
+
+
+def run_sessions(uds_path, stop, pause):
+    """
+    Keeps attaching to the manhole until *stop* is set. Returns the session durations.
+    """
+    durations = []
+    while not stop.is_set():
+        start = time.monotonic()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(TIMEOUT)
+        try:
+            sock.connect(uds_path)
+            sock.sendall(format_request('repl'))
+            read_until(sock, b'>>> ')
+            for command in SESSION_COMMANDS:
+                sock.sendall(command)
+                read_until(sock, b'>>> ')
+        finally:
+            sock.close()
+        durations.append(time.monotonic() - start)
+        stop.wait(pause)
+    return durations
+
+
+def run_phase(name, args):
+    app = App(with_manhole=name != 'baseline', work=args.work)
+    try:
+        stop = threading.Event()
+        sessions = []
+        session_thread = None
+        if name == 'sessions':
+            session_thread = threading.Thread(target=lambda: sessions.extend(run_sessions(app.uds_path, stop, args.pause)))
+            session_thread.start()
+        try:
+            latencies, errors = drive(app.port, args.rate, args.duration, args.concurrency)
+        finally:
+            stop.set()
+            if session_thread:
+                session_thread.join()
+    finally:
+        app.close()
+    result = {'latency': percentiles(latencies), 'errors': len(errors)}
+    if name == 'sessions':
+        result['sessions'] = percentiles(sessions)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure application latency with and without manhole sessions.')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds for each phase. Default: %(default)s.')
+    parser.add_argument('--rate', type=float, default=200, help='Requests per second. Default: %(default)s.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Client threads. Default: %(default)s.')
+    parser.add_argument('--work', type=int, default=2000, help='Loop iterations per request. Default: %(default)s.')
+    parser.add_argument('--pause', type=float, default=0.1, help='Seconds between sessions. Default: %(default)s.')
+    parser.add_argument('--json', dest='json_path', help='Write the results to this file.')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--with-manhole', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args.with_manhole, args.work)
+
+    results = {'rate': args.rate, 'duration': args.duration, 'work': args.work, 'phases': {}}
+    for name in ('baseline', 'idle', 'sessions'):
+        results['phases'][name] = result = run_phase(name, args)
+        print(f'{name}: {json.dumps(result, indent=2)}')
+
+    baseline = results['phases']['baseline']['latency']
+    sessions = results['phases']['sessions']['latency']
+    if baseline.get('count') and sessions.get('count'):
+        results['overhead'] = {key: sessions[key] - baseline[key] for key in ('p50', 'p90', 'p99', 'max')}
+        print(f'overhead: {json.dumps(results["overhead"], indent=2)}')
+
+    if args.json_path:
+        with open(args.json_path, 'w') as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
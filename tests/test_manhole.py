@@ -89,6 +89,24 @@ def test_simple():
                 assert_manhole_running(proc, uds_path)
 
 
+def test_completion():
+    def complete(client):
+        client.sock.send(b'foobar = 1\n')
+        client.sock.send(b'\x00manhole:complete {"id": 1, "expression": ""}\n')
+        wait_for_strings(client.read, TIMEOUT, '\x00manhole:completions {"id": 1, "expression": "", "names": [', '"foobar"')
+        client.sock.send(b'\x00manhole:complete {"id": 2, "expression": "os.path"}\n')
+        wait_for_strings(client.read, TIMEOUT, '\x00manhole:completions {"id": 2, "expression": "os.path", "names": [', '"join"')
+        client.sock.send(b"print('STILL', 'RUNNING')\n")
+        wait_for_strings(client.read, TIMEOUT, 'STILL RUNNING')
+
+    with TestProcess(sys.executable, HELPER, 'test_simple') as proc:
+        with dump_on_error(proc.read):
+            wait_for_strings(proc.read, TIMEOUT, '/tmp/manhole-')
+            uds_path = re.findall(r'(/tmp/manhole-\d+)', proc.read())[0]
+            wait_for_strings(proc.read, TIMEOUT, 'Waiting for new connection')
+            assert_manhole_running(proc, uds_path, extra=complete)
+
+
 @pytest.mark.parametrize('variant', ['str', 'func'])
 def test_connection_handler_exec(variant):
     with TestProcess(sys.executable, HELPER, 'test_connection_handler_exec_' + variant) as proc:
@@ -130,6 +148,22 @@ def test_install_twice_not_strict():
             assert_manhole_running(proc, uds_path)
 
 
+def test_release():
+    with TestProcess(sys.executable, '-u', HELPER, 'test_release') as proc:
+        with dump_on_error(proc.read):
+            wait_for_strings(proc.read, TIMEOUT, 'Manhole thread stopped.', 'Released in', '(alive=False)')
+            assert float(re.findall(r'Released in ([\d.]+)s', proc.read())[0]) < 0.25
+            uds_path = re.findall(r'(/tmp/manhole-\d+)', proc.read())[0]
+            assert_manhole_running(proc, uds_path)
+
+
+def test_release_busy():
+    with TestProcess(sys.executable, '-u', HELPER, 'test_release_busy') as proc:
+        with dump_on_error(proc.read):
+            wait_for_strings(proc.read, TIMEOUT, 'busy with a connection', 'Released (alive=True)', 'Manhole thread stopped.')
+            wait_for_strings(proc.read, TIMEOUT, 'Closed fd', 'Closed fd')
+
+
 @pytest.mark.xfail('sys.gettrace() and is_module_available("gevent") and is_module_available("__pypy__")')
 def test_daemon_connection():
     with TestProcess(sys.executable, HELPER, 'test_daemon_connection') as proc:
@@ -199,12 +233,63 @@ def check_locals(uds_path):
             wait_for_strings(client.read, TIMEOUT, 'v1 v2')
 
 
+def test_command_limits():
+    def runaway(client):
+        client.sock.send(b'while True:\n    try:\n        pass\n    except Exception:\n        pass\n\n')
+        wait_for_strings(
+            client.read, TIMEOUT, 'CommandTimeout', 'Interrupted: the command ran for more than 0.5 seconds (command_timeout).'
+        )
+        client.sock.send(b'x = [str(i) * 10 for i in range(10 ** 9)]\n')
+        wait_for_strings(client.read, TIMEOUT, 'CommandMemoryLimit', 'Interrupted: the command grew the RSS by more than 104857600 bytes')
+        client.sock.send(b"print('STILL', 'RUNNING')\n")
+        wait_for_strings(client.read, TIMEOUT, 'STILL RUNNING')
+
+    with TestProcess(sys.executable, HELPER, 'test_command_limits') as proc:
+        with dump_on_error(proc.read):
+            wait_for_strings(proc.read, TIMEOUT, '/tmp/manhole-')
+            uds_path = re.findall(r'(/tmp/manhole-\d+)', proc.read())[0]
+            wait_for_strings(proc.read, TIMEOUT, 'Waiting for new connection')
+            assert_manhole_running(proc, uds_path, extra=runaway)
+            wait_for_strings(proc.read, TIMEOUT, 'Interrupted: the command ran for more than 0.5 seconds')
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='Needs per-thread scheduling')
+def test_thread_scheduling():
+    def check_scheduling(client):
+        client.sock.send(
+            b'import threading\n'
+            b'print("POLICY", os.sched_getscheduler(0) == os.SCHED_IDLE)\n'
+            b'print("AFFINITY", os.sched_getaffinity(0) == {max(os.sched_getaffinity(threading.main_thread().native_id))})\n'
+            b'print("MAIN", os.sched_getscheduler(threading.main_thread().native_id) == os.SCHED_OTHER)\n'
+        )
+        wait_for_strings(client.read, TIMEOUT, 'POLICY True', 'AFFINITY True', 'MAIN True')
+
+    with TestProcess(sys.executable, HELPER, 'test_thread_scheduling') as proc:
+        with dump_on_error(proc.read):
+            wait_for_strings(proc.read, TIMEOUT, '/tmp/manhole-')
+            uds_path = re.findall(r'(/tmp/manhole-\d+)', proc.read())[0]
+            wait_for_strings(proc.read, TIMEOUT, 'Waiting for new connection')
+            assert_manhole_running(proc, uds_path, extra=check_scheduling)
+
+
 def test_fork_exec():
     with TestProcess(sys.executable, HELPER, 'test_fork_exec') as proc:
         with dump_on_error(proc.read):
             wait_for_strings(proc.read, TIMEOUT, 'SUCCESS')
 
 
+def test_stack_dump_on_removed_fork():
+    with TestProcess(sys.executable, '-u', HELPER, 'test_stack_dump_on_removed_fork') as proc:
+        with dump_on_error(proc.read):
+            wait_for_strings(proc.read, TIMEOUT, 'Child stacks file: False', 'SUCCESS')
+
+
+def test_stalls_fork():
+    with TestProcess(sys.executable, '-u', HELPER, 'test_stalls_fork') as proc:
+        with dump_on_error(proc.read):
+            wait_for_strings(proc.read, TIMEOUT, 'Parent stalls: 1', 'Child stalls after fork: 0', 'Child stalls: 1', 'SUCCESS')
+
+
 def test_socket_path():
     with TestProcess(sys.executable, HELPER, 'test_socket_path') as proc:
         with dump_on_error(proc.read):
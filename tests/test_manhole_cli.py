@@ -1,6 +1,10 @@
+import json
 import os
+import re
 import signal
+import socket
 import sys
+import threading
 
 import pytest
 from process_tests import TestProcess
@@ -22,7 +26,12 @@ def test_pid_validation():
     exc = pytest.raises(subprocess.CalledProcessError, subprocess.check_output, ['manhole-cli', 'asdfasdf'], stderr=subprocess.STDOUT)
     assert (
         exc.value.output
-        == b"""usage: manhole-cli [-h] [-t TIMEOUT] [-1 | -2 | -s SIGNAL] PID
+        == b"""usage: manhole-cli [-h] [-t TIMEOUT] [-1 | -2 | -s SIGNAL]
+                   [--stack-dump-on SIGNAL]
+                   [--top | -e EXPR | --stalls | --perf-window SECONDS | --download NAME | --run SCRIPT | --inject MODULE | --tail]
+                   [--top-interval SECONDS] [--tail-level LEVEL]
+                   [--tail-sample RATE] [-o PATH]
+                   PID
 manhole-cli: error: argument PID: PID must be in one of these forms: 1234 or /tmp/manhole-1234
 """
     )
@@ -33,7 +42,12 @@ def test_sig_number_validation():
         subprocess.CalledProcessError, subprocess.check_output, ['manhole-cli', '-s', '12341234', '12341234'], stderr=subprocess.STDOUT
     )
     assert exc.value.output.startswith(
-        b"""usage: manhole-cli [-h] [-t TIMEOUT] [-1 | -2 | -s SIGNAL] PID
+        b"""usage: manhole-cli [-h] [-t TIMEOUT] [-1 | -2 | -s SIGNAL]
+                   [--stack-dump-on SIGNAL]
+                   [--top | -e EXPR | --stalls | --perf-window SECONDS | --download NAME | --run SCRIPT | --inject MODULE | --tail]
+                   [--top-interval SECONDS] [--tail-level LEVEL]
+                   [--tail-sample RATE] [-o PATH]
+                   PID
 manhole-cli: error: argument -s/--signal: Invalid signal number 12341234. Expected one of: """
     )
 
@@ -42,7 +56,12 @@ def test_help(testdir):
     result = testdir.run('manhole-cli', '--help')
     result.stdout.fnmatch_lines(
         [
-            'usage: manhole-cli [-h] [-t TIMEOUT] [-1 | -2 | -s SIGNAL] PID',
+            'usage: manhole-cli [-h] [-t TIMEOUT] [-1 | -2 | -s SIGNAL]',
+            '                   [--stack-dump-on SIGNAL]',
+            '                   [--top | -e EXPR | --stalls | --perf-window SECONDS | --download NAME | --run SCRIPT | --inject MODULE | --tail]',
+            '                   [--top-interval SECONDS] [--tail-level LEVEL]',
+            '                   [--tail-sample RATE] [-o PATH]',
+            '                   PID',
             'Connect to a manhole.',
             'positional arguments:',
             '  PID                   A numerical process id, or a path in the form:*',
@@ -53,6 +72,30 @@ def test_help(testdir):
             '  -2, -USR2             Send USR2 (*) to the process before connecting.',
             '  -s SIGNAL, --signal SIGNAL',
             '                        Send the given SIGNAL to the process before*',
+            '  --stack-dump-on SIGNAL',
+            "                        If the prompt doesn't arrive within the timeout send",
+            '  --top                 Show a live view of threads (sorted by CPU usage), GC',
+            '*',
+            '  -e EXPR, --eval EXPR  Evaluate EXPR in the process and print the result as a',
+            '*',
+            '  --stalls              Show the stalls recorded by the stall watchdog (see',
+            '  --perf-window SECONDS',
+            '*',
+            '  --download NAME       Download the data staged with download(obj, NAME) in',
+            '*',
+            '  --run SCRIPT          Run SCRIPT in the process (as __main__, with the REPL',
+            '*',
+            '  --inject MODULE       Load the MODULE file in the process as a module (named',
+            '*',
+            '  --tail                Show the logging records and the output of the process',
+            '*',
+            '  --top-interval SECONDS',
+            '*',
+            '  --tail-level LEVEL    Only show the records at LEVEL or above with --tail.',
+            '*',
+            '  --tail-sample RATE    Only show this fraction of the records with --tail.',
+            '*',
+            '  -o PATH, --output PATH',
         ]
     )
 
@@ -133,3 +176,220 @@ def test_unbuffered():
                     wait_for_strings(client.read, TIMEOUT, '(ManholeConsole)', '>>>')
                     for i in range(5):
                         wait_for_strings(client.read, 5, f'line{i}')
+
+
+def test_stack_dump_on():
+    with TestProcess(sys.executable, HELPER, 'test_stack_dump_on') as service:
+        with dump_on_error(service.read):
+            wait_for_strings(service.read, TIMEOUT, 'Holding the GIL.')
+            with TestProcess('manhole-cli', '--stack-dump-on', 'USR2', str(service.proc.pid), bufsize=0, stdin=subprocess.PIPE) as client:
+                with dump_on_error(client.read):
+                    wait_for_strings(
+                        client.read,
+                        TIMEOUT,
+                        "The prompt didn't arrive in 1 seconds, stacks dumped by faulthandler:",
+                        'Current thread',
+                        'helper.py", line',
+                    )
+
+
+def test_stalls():
+    with TestProcess(sys.executable, HELPER, 'test_stalls') as service:
+        with dump_on_error(service.read):
+            wait_for_strings(service.read, TIMEOUT, 'Stalled.')
+            output = subprocess.check_output(['manhole-cli', '--stalls', str(service.proc.pid)], universal_newlines=True)
+            assert output.startswith('Threshold: 0.2s | heartbeat from: heartbeat() | stalls: ')
+            assert 'stalled for 0.6' in output
+            assert '--- MainThread ---' in output
+            assert 'helper.py:' in output
+            assert ' in stall' in output
+            wait_for_strings(service.read, TIMEOUT, "Handling 'stalls' request.", 'DONE.')
+
+
+def test_perf_window():
+    with TestProcess(sys.executable, HELPER, 'test_simple') as service:
+        with dump_on_error(service.read):
+            wait_for_strings(service.read, TIMEOUT, 'Waiting for new connection')
+            output = subprocess.run(
+                ['manhole-cli', '--perf-window', '0.5', str(service.proc.pid)],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+            )
+            if sys.version_info >= (3, 12):
+                assert output.returncode == 0, output.stdout
+                first, second = output.stdout.splitlines()
+                assert first == f'Perf trampoline is on for 0.5 seconds, run eg: perf record -F 99 -g -p {service.proc.pid} -- sleep 0.5'
+                assert second.startswith('Perf trampoline off after 0.5 seconds. ')
+                assert f'/tmp/perf-{service.proc.pid}.map: ' in second
+            else:
+                assert output.returncode == 1
+                assert output.stdout == "Request failed: RuntimeError('The perf trampoline needs Python 3.12+ on Linux.')\n"
+            wait_for_strings(service.read, TIMEOUT, "Handling 'perf' request.", 'DONE.')
+
+
+def test_download(tmp_path):
+    with TestProcess(sys.executable, HELPER, 'test_simple') as service:
+        with dump_on_error(service.read):
+            wait_for_strings(service.read, TIMEOUT, 'Waiting for new connection')
+            subprocess.check_call(
+                ['manhole-cli', '-e', "download(bytes(range(256)) * 40000, 'blob.bin')", str(service.proc.pid)], stdout=subprocess.DEVNULL
+            )
+            path = tmp_path / 'blob'
+            output = subprocess.run(
+                ['manhole-cli', '--download', 'blob.bin', '-o', str(path), str(service.proc.pid)],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+            )
+            assert output.returncode == 0, output.stdout
+            assert output.stdout.startswith(f"Downloaded 'blob.bin' to {str(path)!r}: 9.8 MiB in ")
+            assert path.read_bytes() == bytes(range(256)) * 40000
+            assert not (tmp_path / 'blob.part').exists()
+
+            output = subprocess.run(
+                ['manhole-cli', '--download', 'blob.bin', '-o', str(path), str(service.proc.pid)],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+            )
+            assert output.returncode == 1
+            assert output.stdout.startswith("Request failed: LookupError(\"Nothing was staged as 'blob.bin'")
+            wait_for_strings(service.read, TIMEOUT, "Handling 'download' request.", 'DONE.')
+
+
+def test_run(tmp_path):
+    script = tmp_path / 'check.py'
+    script.write_text(
+        'import sys\nprint(__name__, sorted(k for k in dir() if k.startswith("dump_")))\nprint(sys.argv[0].endswith("helper.py"))\n'
+    )
+    module = tmp_path / 'injected.py'
+    module.write_text('VALUE = 42\nprint("loading")\n')
+    broken = tmp_path / 'broken.py'
+    broken.write_text('1 / 0\n')
+
+    def run(*args):
+        return subprocess.run(
+            ['manhole-cli', *args, str(service.proc.pid)],
+            capture_output=True,
+            text=True,
+        )
+
+    with TestProcess(sys.executable, HELPER, 'test_simple') as service:
+        with dump_on_error(service.read):
+            wait_for_strings(service.read, TIMEOUT, 'Waiting for new connection')
+            first = run('--run', str(script))
+            assert first.returncode == 0, first.stderr
+            assert first.stdout == "__main__ ['dump_greenlets', 'dump_stacktraces']\nTrue\n"
+            assert re.match(rf'Ran {str(script)!r} in [0-9.]+s\.\n$', first.stderr)
+            second = run('--run', str(script))
+            assert second.stdout == first.stdout
+            assert re.match(rf'Ran {str(script)!r} in [0-9.]+s \(cached\)\.\n$', second.stderr)
+
+            output = run('--inject', str(module))
+            assert output.returncode == 0, output.stderr
+            assert output.stdout == 'loading\n'
+            output = run('-e', 'import injected', '-e', 'injected.VALUE')
+            assert json.loads(output.stdout.splitlines()[1])['json'] == 42
+
+            output = run('--run', str(broken))
+            assert output.returncode == 1
+            assert 'ZeroDivisionError: division by zero' in output.stdout
+            assert 'broken.py@' in output.stdout
+            assert re.match(rf'Ran {str(broken)!r} failed after [0-9.]+s: ZeroDivisionError: division by zero\n$', output.stderr)
+            wait_for_strings(service.read, TIMEOUT, "Handling 'run' request.", 'DONE.')
+
+
+@pytest.mark.parametrize('options', [['--tail'], ['--tail', '--tail-level', 'INFO']])
+def test_tail(options):
+    with TestProcess(sys.executable, HELPER, 'test_tail') as service:
+        with dump_on_error(service.read):
+            wait_for_strings(service.read, TIMEOUT, 'Waiting for new connection')
+            with TestProcess('manhole-cli', *options, str(service.proc.pid), bufsize=0) as client:
+                with dump_on_error(client.read):
+                    wait_for_strings(
+                        client.read,
+                        TIMEOUT,
+                        "Tailing the output and the 'root' logger records at INFO or above.",
+                        ' INFO     helper.tail: tick ',
+                        'ERROR    helper.tail: failed',
+                        'ZeroDivisionError: division by zero',
+                        'printed ',
+                    )
+                    assert 'hidden' not in client.read()
+            wait_for_strings(service.read, TIMEOUT, "Handling 'tail' request.", 'DONE.', 'Waiting for new connection')
+
+
+@pytest.mark.parametrize('options', [['--top'], ['--top', '--top-interval', '0.2']])
+def test_top(options):
+    with TestProcess(sys.executable, HELPER, 'test_simple') as service:
+        with dump_on_error(service.read):
+            wait_for_strings(service.read, TIMEOUT, '/tmp/manhole-')
+            with TestProcess('manhole-cli', *options, str(service.proc.pid), bufsize=0) as client:
+                with dump_on_error(client.read):
+                    wait_for_strings(
+                        client.read, TIMEOUT, f'PID: {service.proc.pid} | RSS: ', 'GC: counts', 'MainThread', 'ManholeConnectionThread'
+                    )
+            wait_for_strings(service.read, TIMEOUT, "Handling 'top' request.", 'DONE.', 'Waiting for new connection')
+
+
+def test_eval():
+    with TestProcess(sys.executable, HELPER, 'test_simple') as service:
+        with dump_on_error(service.read):
+            wait_for_strings(service.read, TIMEOUT, 'Waiting for new connection')
+            output = subprocess.run(
+                ['manhole-cli', '-e', "'v' + str(1)", '-e', 'x = len(sys.argv) + 1', '-e', 'x', '-e', 'nope', str(service.proc.pid)],
+                stdout=subprocess.PIPE,
+                check=False,
+            )
+            assert output.returncode == 1
+            results = [json.loads(line) for line in output.stdout.splitlines()]
+            assert [result.get('json') for result in results[:3]] == ['v1', None, 3]
+            assert [result.get('repr') for result in results[:3]] == ["'v1'", 'None', '3']
+            assert results[3]['error'] == "NameError: name 'nope' is not defined"
+            assert all(result['elapsed'] >= 0 for result in results)
+            wait_for_strings(service.read, TIMEOUT, "Handling 'query' request.", 'DONE.')
+
+
+def test_eval_custom_handler():
+    with TestProcess(sys.executable, HELPER, 'test_connection_handler_exec_str') as service:
+        with dump_on_error(service.read):
+            wait_for_strings(service.read, TIMEOUT, 'Waiting for new connection')
+            output = subprocess.run(['manhole-cli', '-e', 'tete()', str(service.proc.pid)], stdout=subprocess.PIPE, check=False)
+            assert output.returncode == 1
+            assert json.loads(output.stdout) == {'error': 'Structured requests are only served by the default REPL connection handler.'}
+            wait_for_strings(service.read, TIMEOUT, "Refusing 'query' request")
+            assert 'TETE' not in service.read()
+
+
+def test_read_request_fragmented():
+    from manhole import read_request
+    from manhole.channel import format_request
+
+    request = format_request('query', expressions=['1'])
+    server, client = socket.socketpair()
+    with server, client:
+        client.sendall(request[:3])
+        timer = threading.Timer(0.02, client.sendall, args=(request[3:],))
+        timer.start()
+        assert read_request(server, 1) == ('query', {'expressions': ['1']})
+        timer.join()
+
+        client.sendall(b'\x00man')
+        assert read_request(server, 0.05) is None  # the rest never came
+        assert server.recv(100) == b'\x00man'
+
+        client.sendall(b'print(1)\n')
+        assert read_request(server, 1) is None
+        assert server.recv(100) == b'print(1)\n'
+
+
+def test_top_diff():
+    from manhole.top import apply_diff
+    from manhole.top import diff
+
+    first = {'rss': 1, 'threads': {'1': {'name': 'a', 'cpu': None}, '2': {'name': 'b', 'cpu': None}}}
+    second = {'rss': 1, 'threads': {'1': {'name': 'a', 'cpu': 50.0}, '3': {'name': 'c', 'cpu': 0.0}}}
+    changes = diff(first, second)
+    assert changes == {'threads': {'1': {'cpu': 50.0}, '3': {'name': 'c', 'cpu': 0.0}}, 'gone': ['2']}
+    assert apply_diff(apply_diff({}, diff({}, first)), changes) == second
@@ -0,0 +1,104 @@
+import io
+import json
+import os
+import socket
+import threading
+
+from manhole.completion import REPLY
+from manhole.completion import format_request
+from manhole.completion import handle_request
+from manhole.completion import list_names
+from manhole.completion import split_replies
+
+
+class Config:
+    debug = False
+
+    @property
+    def expensive(self):
+        raise AssertionError('only the attributes of config are listed')
+
+
+def test_list_names():
+    namespace = {'config': Config(), 'os': os}
+    names = list_names('', namespace)
+    assert {'config', 'os', 'len', 'while'} <= set(names)
+    assert names == sorted(names)
+    assert {'debug', 'expensive', '__class__'} <= set(list_names('config', namespace))
+    assert 'join' in list_names('os.path', namespace)
+
+
+def test_list_names_only_attributes():
+    calls = []
+    namespace = {'call': lambda: calls.append(1) or os}
+    assert list_names('call().path', namespace) == []
+    assert list_names('missing.attr', namespace) == []
+    assert calls == []
+
+
+def test_handle_request():
+    output = io.StringIO()
+    handle_request(format_request(7, 'config').rstrip('\n'), {'config': Config()}, output)
+    line = output.getvalue()
+    assert line.startswith(REPLY)
+    assert line.endswith('\n')
+    reply = json.loads(line[len(REPLY) :])
+    assert reply['id'] == 7
+    assert reply['expression'] == 'config'
+    assert 'debug' in reply['names']
+
+
+def test_handle_request_malformed():
+    output = io.StringIO()
+    handle_request('\x00manhole:complete {"expression": ""}', {}, output)
+    assert json.loads(output.getvalue()[len(REPLY) :]) == {'id': None, 'error': "KeyError('id')"}
+
+
+def test_split_replies():
+    reply = f'{REPLY}{json.dumps({"id": 1, "names": ["a"]})}\n'
+    output, replies, pending = split_replies(f'>>> foo{reply}bar\n')
+    assert output == '>>> foobar\n'
+    assert replies == [{'id': 1, 'names': ['a']}]
+    assert pending == ''
+
+    output, replies, pending = split_replies(f'>>> {reply[:10]}')
+    assert (output, replies) == ('>>> ', [])
+    output, replies, pending = split_replies(pending + reply[10:] + reply)
+    assert (output, pending) == ('', '')
+    assert replies == [{'id': 1, 'names': ['a']}] * 2
+
+    assert split_replies('\x00other\nrest') == ('\x00other\nrest', [], '')
+
+
+def test_cli_completer():
+    from manhole.cli import Completer
+
+    client, server = socket.socketpair()
+    completer = Completer(client, 1)
+    requests = []
+
+    def serve():
+        with server.makefile('r') as fh:
+            for line in fh:
+                request = json.loads(line[len('\x00manhole:complete ') :])
+                requests.append(request['expression'])
+                names = ['path', 'pathsep', 'sep', '_exit'] if request['expression'] else ['os', 'other']
+                completer.replies.put({'id': request['id'], 'names': names})
+
+    thread = threading.Thread(target=serve)
+    thread.start()
+    try:
+        assert completer.complete('o', 0) is None  # not enabled before the console banner shows up
+        completer.enabled = True
+        assert [completer.complete('o', state) for state in range(3)] == ['os', 'other', None]
+        assert [completer.complete('os.pa', state) for state in range(3)] == ['os.path', 'os.pathsep', None]
+        assert [completer.complete('os.', state) for state in range(4)] == ['os.path', 'os.pathsep', 'os.sep', None]
+        assert completer.complete('os._', 0) == 'os._exit'
+        assert requests == ['', 'os']
+        completer.invalidate()
+        assert completer.complete('ot', 0) == 'other'
+        assert requests == ['', 'os', '']
+    finally:
+        client.close()
+        thread.join()
+        server.close()
@@ -0,0 +1,127 @@
+import array
+import os
+import socket
+import threading
+import zlib
+
+import pytest
+
+from manhole import download as download_module
+from manhole.channel import DATA
+from manhole.channel import iter_frames
+from manhole.download import download
+from manhole.download import handle_request
+
+
+@pytest.fixture(autouse=True)
+def _staged():
+    yield
+    for name in list(download_module._STAGED):
+        download_module._STAGED.pop(name).close()
+
+
+def fetch(name):
+    server, client = socket.socketpair()
+    errors = []
+
+    def serve():
+        try:
+            handle_request(server, name)
+        except Exception as exc:
+            errors.append(exc)
+        finally:
+            server.close()
+
+    thread = threading.Thread(target=serve)
+    thread.start()
+    with client:
+        frames = list(iter_frames(client))
+    thread.join()
+    if errors:
+        raise errors[0]
+    return frames
+
+
+def test_buffer(monkeypatch):
+    monkeypatch.setattr(download_module, 'CHUNK_SIZE', 1000)
+    data = bytes(range(256)) * 100
+    result = download(data, 'data')
+    assert result['name'] == 'data'
+    assert result['size'] == len(data)
+    assert result['command'].endswith(' --download data')
+
+    frames = fetch('data')
+    (_, header), *chunks, (_, trailer) = frames
+    assert header == {'name': 'data', 'size': len(data), 'source': "bytes 'B' [25600]"}
+    assert [kind for kind, _ in chunks] == [DATA] * 26
+    assert b''.join(payload for _, payload in chunks) == data
+    assert trailer == {'size': len(data), 'crc32': zlib.crc32(data)}
+    assert 'data' not in download_module._STAGED
+
+
+def test_typed_and_strided():
+    numbers = array.array('d', range(1000))
+    assert download(numbers)['name'] == 'array.bin'
+    assert b''.join(payload for kind, payload in fetch('array.bin') if kind == DATA) == numbers.tobytes()
+
+    download(memoryview(b'abcdef')[::2], 'strided')
+    assert b''.join(payload for kind, payload in fetch('strided') if kind == DATA) == b'ace'
+
+
+@pytest.mark.parametrize('kind', ['path', 'file'])
+def test_file(tmp_path, monkeypatch, kind):
+    monkeypatch.setattr(download_module, 'CHUNK_SIZE', 4096)
+    path = tmp_path / 'dump.bin'
+    data = b'x' * 3000 + b'y' * 3000
+    path.write_bytes(data)
+    if kind == 'path':
+        assert download(path)['name'] == 'dump.bin'
+    else:
+        with path.open('rb') as fh:
+            fh.read(10)
+            download(fh, 'dump.bin')
+            assert fh.tell() == 10
+    frames = fetch('dump.bin')
+    chunks = [payload for kind, payload in frames if kind == DATA]
+    assert [len(chunk) for chunk in chunks] == [4096, 1904]
+    assert b''.join(chunks) == data
+    assert frames[-1][1] == {'size': 6000, 'crc32': zlib.crc32(data)}
+
+
+def test_file_truncated(tmp_path, monkeypatch):
+    monkeypatch.setattr(download_module, 'CHUNK_SIZE', 4096)
+    path = tmp_path / 'dump.bin'
+    path.write_bytes(b'x' * 10000)
+    download(path)
+    read_chunk = download_module._read_chunk
+
+    def truncate_and_read(fd, offset, length):
+        if offset:
+            os.truncate(path, 5000)
+        return read_chunk(fd, offset, length)
+
+    monkeypatch.setattr(download_module, '_read_chunk', truncate_and_read)
+    with pytest.raises(RuntimeError, match=r'File got truncated while sending it \(5000 bytes left, expected 8192\)'):
+        fetch('dump.bin')
+
+
+def test_empty_file(tmp_path):
+    path = tmp_path / 'empty'
+    path.write_bytes(b'')
+    download(path)
+    assert fetch('empty')[1:] == [(b'j', {'size': 0, 'crc32': 0})]
+
+
+def test_errors(tmp_path):
+    with pytest.raises(TypeError, match="Cannot download 'object' objects"):
+        download(object())
+    with pytest.raises(ValueError, match='is not a regular file'):
+        download(tmp_path)
+    with pytest.raises(LookupError, match="Nothing was staged as 'missing'"):
+        fetch('missing')
+
+
+def test_replace():
+    download(b'first', 'data')
+    download(b'second', 'data')
+    assert b''.join(payload for kind, payload in fetch('data') if kind == DATA) == b'second'
@@ -0,0 +1,76 @@
+import gc
+import time
+
+import pytest
+
+from manhole import gcpauses
+from manhole.gcpauses import GCRecorder
+
+
+@pytest.fixture
+def recorder():
+    recorder = GCRecorder(size=4, worst=2).install()
+    try:
+        yield recorder
+    finally:
+        recorder.remove()
+
+
+def test_record(recorder):
+    garbage = [[] for _ in range(10000)]
+    for item in garbage:
+        item.append(item)
+    del garbage, item
+    start = time.time()
+    gc.collect(2)
+    gc.collect(0)
+
+    report = recorder.report()
+    assert report['enabled']
+    assert report['collections'] >= 2
+    assert {0, 2} <= set(report['generations'])
+    assert report['generations'][2]['collected'] >= 10000
+    assert report['generations'][2]['count'] >= 1
+    assert report['generations'][2]['histogram']
+    first, second = report['recent'][-2:]
+    assert first['generation'] == 2
+    assert first['collected'] >= 10000
+    assert start - 1 < first['started'] < time.time()
+    assert second['generation'] == 0
+    assert report['worst'][0]['generation'] == 2
+    assert report['worst'][0]['duration'] >= second['duration']
+
+
+def test_ring(recorder):
+    for _ in range(10):
+        gc.collect(1)
+    report = recorder.report(recent=100)
+    assert report['collections'] >= 10
+    assert report['dropped'] == report['collections'] - 4
+    assert len(report['recent']) == 4
+    first, second = report['worst']
+    assert first['duration'] >= second['duration']
+    assert first['duration'] >= max(recorder.durations)  # might not be in the ring anymore
+
+
+def test_remove(recorder):
+    recorder.remove()
+    assert recorder.callback not in gc.callbacks
+    count = recorder.count
+    gc.collect()
+    assert recorder.count == count
+    assert not recorder.report()['enabled']
+
+
+def test_gc_monitor():
+    gcpauses.gc_monitor()
+    try:
+        gc.collect()
+        report = gcpauses.gc_pauses()
+        assert report['enabled']
+        assert report['collections'] >= 1
+        assert report['gc']['threshold'] == gc.get_threshold()
+    finally:
+        report = gcpauses.gc_monitor(enabled=False)
+    assert not report['enabled']
+    assert not any(getattr(callback, '__self__', None).__class__ is GCRecorder for callback in gc.callbacks)
@@ -0,0 +1,44 @@
+import sys
+import threading
+
+from manhole.gil import gil_probe
+from manhole.histogram import Histogram
+
+
+def test_gil_probe():
+    result = gil_probe(duration=0.3, interval=0.005)
+    assert result['count'] > 10
+    assert 0 <= result['p50'] <= result['p99'] <= result['max']
+    assert result['switch_interval'] == sys.getswitchinterval()
+    assert sum(count for _, count in result['histogram']) == result['count']
+
+
+def test_gil_probe_switch_interval():
+    old = sys.getswitchinterval()
+    stop = threading.Event()
+
+    def burn():
+        while not stop.is_set():
+            pass
+
+    thread = threading.Thread(target=burn)
+    thread.start()
+    try:
+        result = gil_probe(duration=0.3, interval=0.001, switch_interval=0.02)
+    finally:
+        stop.set()
+        thread.join()
+    assert result['switch_interval'] == 0.02
+    assert sys.getswitchinterval() == old
+    assert result['max'] > 0.005
+
+
+def test_histogram_percentiles():
+    histogram = Histogram()
+    for i in range(1, 101):
+        histogram.add(i / 1000.0)
+    assert histogram.count == 100
+    assert histogram.min == 0.001
+    assert histogram.max == 0.1
+    assert 0.05 <= histogram.percentile(50) <= 0.05 * 2 ** (1 / 8)
+    assert histogram.percentile(100) == 0.1
@@ -0,0 +1,72 @@
+import io
+import time
+
+import pytest
+
+from manhole.greenlets import HubWatchdog
+from manhole.greenlets import dump_greenlets
+
+gevent = pytest.importorskip('gevent')
+Event = pytest.importorskip('gevent.event').Event
+
+
+def wait_for(event):
+    event.wait()
+
+
+def test_dump_greenlets():
+    event = Event()
+    greenlets = [gevent.spawn(wait_for, event) for _ in range(20)]
+    gevent.sleep(0)
+    try:
+        output = io.StringIO()
+        dump_greenlets(file=output)
+    finally:
+        event.set()
+        gevent.joinall(greenlets)
+    output = output.getvalue()
+    assert '######### 20 greenlet(s) (suspended: 20), eg: Greenlet-' in output
+    assert ', in wait_for\n  event.wait()' in output
+
+
+def blocker():
+    time.sleep(0.3)  # not monkey patched, blocks the hub
+
+
+def test_hub_watchdog():
+    watchdog = HubWatchdog(0.05).start()
+    try:
+        greenlet = gevent.spawn(blocker)
+        greenlet.name = 'Blocker'
+        greenlet.join()
+        gevent.sleep(0.1)
+    finally:
+        watchdog.stop()
+    (block,) = watchdog.blocks()
+    assert block['greenlet'] == 'Blocker'
+    assert 0.25 < block['duration'] < 1
+    assert 'in blocker' in ''.join(block['stack'])
+    assert watchdog.switches > 2
+    import greenlet as greenlet_module
+
+    assert greenlet_module.gettrace() is None
+
+
+def test_hub_watchdog_restart():
+    watchdog = HubWatchdog(0.05).start()
+    try:
+        gevent.spawn(blocker).join()
+        gevent.sleep(0.1)
+        assert len(watchdog.blocks()) == 1
+        previous_thread = watchdog.thread
+        watchdog.stopped.set()  # like after a fork, the monitoring thread is gone
+        previous_thread.join()
+        watchdog.restart()
+        assert watchdog.thread is not previous_thread
+        assert watchdog.blocks() == []
+        gevent.spawn(blocker).join()
+        gevent.sleep(0.1)
+    finally:
+        watchdog.stop()
+    (block,) = watchdog.blocks()
+    assert 'in blocker' in ''.join(block['stack'])
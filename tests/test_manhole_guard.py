@@ -0,0 +1,60 @@
+import time
+
+import pytest
+
+from manhole.guard import CommandGuard
+from manhole.guard import CommandLimitExceeded
+from manhole.guard import CommandMemoryLimit
+from manhole.guard import CommandTimeout
+
+
+@pytest.fixture
+def guard():
+    guard = CommandGuard(timeout=0.2, max_rss_growth=50 * 1024 * 1024, interval=0.01)
+    try:
+        yield guard
+    finally:
+        guard.close()
+
+
+def spin():
+    while True:
+        try:
+            time.sleep(0.001)
+        except Exception:
+            pass
+
+
+def test_timeout(guard):
+    start = time.monotonic()
+    with pytest.raises(CommandTimeout):
+        with guard:
+            spin()
+    assert 0.2 < time.monotonic() - start < 2
+    assert guard.reason == 'Interrupted: the command ran for more than 0.2 seconds (command_timeout).'
+
+
+def test_memory(guard):
+    guard.timeout = None
+    with pytest.raises(CommandMemoryLimit):
+        with guard:
+            data = [str(i) * 10 for i in range(10**9)]
+    assert guard.reason == 'Interrupted: the command grew the RSS by more than 52428800 bytes (command_max_rss_growth).'
+    assert 'data' not in locals()
+
+
+def test_reuse(guard):
+    for _ in range(2):
+        with pytest.raises(CommandLimitExceeded):
+            with guard:
+                spin()
+        with guard:
+            assert guard.reason is None
+    time.sleep(0.3)  # nothing pending after the command ended
+
+
+def test_closed(guard):
+    guard.close()
+    with guard:
+        time.sleep(0.5)
+    assert guard.reason is None
@@ -0,0 +1,163 @@
+import queue
+import threading
+import time
+
+import pytest
+
+from manhole import locks
+
+
+@pytest.fixture
+def _monitor():
+    locks.lock_monitor(sample=1)
+    try:
+        yield
+    finally:
+        locks.lock_monitor(enabled=False)
+        locks.uninstrument()
+
+
+def hold(lock, seconds, started):
+    with lock:
+        started.set()
+        time.sleep(seconds)
+
+
+def wait_for_waiters(count, timeout=5):
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        report = locks.lock_report()
+        if len(report['waiting']) >= count:
+            return report
+        time.sleep(0.01)
+    pytest.fail(f'No waiting threads: {locks.lock_report()}')
+
+
+@pytest.mark.usefixtures('_monitor')
+def test_contention():
+    lock = threading.Lock()
+    assert isinstance(lock, locks.InstrumentedLock)
+    started = threading.Event()
+    thread = threading.Thread(target=hold, args=(lock, 0.2, started))
+    thread.start()
+    started.wait()
+    with lock:
+        assert lock.owner == threading.get_ident()
+    thread.join()
+    assert lock.owner is None
+
+    report = locks.lock_report()
+    assert report['enabled']
+    assert report['instrumented']
+    [site] = [site for site in report['contended'] if __file__ in site['lock']]
+    assert site['lock'].startswith('Lock created at ')
+    assert site['lock'].endswith(' in test_contention')
+    assert site['acquisitions'] == 2
+    assert site['contentions'] == 1
+    assert 0.1 < site['total_wait'] < 1
+    assert site['wait']['count'] == 1
+    [stack] = site['stacks']
+    assert stack['count'] == 1
+    assert stack['stack'][-1].startswith(f'{__file__}:')
+    assert stack['stack'][-1].endswith(' in test_contention')
+
+
+@pytest.mark.usefixtures('_monitor')
+def test_holder():
+    lock = threading.RLock()
+    assert isinstance(lock, locks.InstrumentedRLock)
+    started = threading.Event()
+    holder = threading.Thread(target=hold, args=(lock, 0.5, started), name='Holder')
+    holder.start()
+    started.wait()
+    waiter = threading.Thread(target=hold, args=(lock, 0, threading.Event()), name='Waiter')
+    waiter.start()
+    report = wait_for_waiters(1)
+    holder.join()
+    waiter.join()
+
+    [waiting] = report['waiting']
+    assert waiting['thread'] == 'Waiter'
+    assert waiting['held_by'] == 'Holder'
+    assert waiting['lock'].startswith('RLock created at ')
+    assert waiting['lock'].endswith(' in test_holder')
+    assert report['deadlocks'] == []
+    assert locks.lock_report()['waiting'] == []
+
+
+@pytest.mark.usefixtures('_monitor')
+def test_deadlock():
+    first = threading.Lock()
+    second = threading.Lock()
+    barrier = threading.Barrier(2)
+
+    def cross(mine, other):
+        with mine:
+            barrier.wait()
+            if other.acquire(timeout=2):
+                other.release()
+
+    threads = [
+        threading.Thread(target=cross, args=(first, second), name='First'),
+        threading.Thread(target=cross, args=(second, first), name='Second'),
+    ]
+    for thread in threads:
+        thread.start()
+    report = wait_for_waiters(2)
+    for thread in threads:
+        thread.join()
+
+    [cycle] = report['deadlocks']
+    assert sorted(edge['thread'] for edge in cycle) == ['First', 'Second']
+    for edge in cycle:
+        assert edge['held_by'] == {'First': 'Second', 'Second': 'First'}[edge['thread']]
+    assert locks.lock_report()['deadlocks'] == []
+
+
+@pytest.mark.usefixtures('_monitor')
+def test_reentrant():
+    lock = threading.RLock()
+    with lock:
+        with lock:
+            assert lock.count == 2
+        assert lock.owner == threading.get_ident()
+    assert lock.owner is None
+    assert lock.count == 0
+
+
+@pytest.mark.usefixtures('_monitor')
+def test_condition_and_queue():
+    condition = threading.Condition()
+    items = []
+
+    def produce():
+        with condition:
+            items.append(1)
+            condition.notify()
+
+    with condition:
+        threading.Thread(target=produce).start()
+        assert condition.wait_for(lambda: items, timeout=5)
+        assert condition._lock.owner == threading.get_ident()
+    assert condition._lock.owner is None
+
+    jobs = queue.Queue()
+    assert isinstance(jobs.mutex, locks.InstrumentedLock)
+    threading.Thread(target=jobs.put, args=(123,)).start()
+    assert jobs.get(timeout=5) == 123
+
+
+def test_disabled():
+    locks.lock_monitor(sample=1)
+    try:
+        lock = threading.Lock()
+        locks.lock_monitor(enabled=False)
+        with lock:
+            assert lock.owner == threading.get_ident()
+        report = locks.lock_report()
+        assert not report['enabled']
+        assert report['duration'] is None
+    finally:
+        locks.uninstrument()
+    assert not isinstance(threading.Lock(), locks.InstrumentedLock)
+    assert not locks.lock_report()['instrumented']
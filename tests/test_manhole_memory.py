@@ -0,0 +1,100 @@
+import os
+import sys
+
+import pytest
+
+from manhole.memory import capture_debugmallocstats
+from manhole.memory import malloc_stats
+from manhole.memory import parse_debugmallocstats
+from manhole.memory import smaps_rollup
+
+DEBUGMALLOCSTATS = """\
+Small block threshold = 512, in 32 size classes.
+
+class   size   num pools   blocks in use  avail blocks
+-----   ----   ---------   -------------  ------------
+    0     16           1             106           915
+    1     32           3            1149           381
+
+# arenas allocated total           =                    4
+# arenas reclaimed                 =                    0
+# arenas highwater mark            =                    4
+# arenas highwater mark            =                    4
+# arenas allocated current         =                    4
+4 arenas * 1048576 bytes/arena     =            4,194,304
+
+# bytes in allocated blocks        =            3,492,304
+# bytes in available blocks        =              330,176
+12 unused pools * 16384 bytes      =              196,608
+# bytes lost to pool headers       =               11,280
+# bytes lost to quantization       =               16,480
+# bytes lost to arena alignment    =               49,152
+Total                              =            4,194,304
+
+arena map counts
+# arena map mid nodes              =                    1
+# bytes lost to arena map root     =              262,144
+Total                              =              262,144
+
+           11 free PyDictObjects * 48 bytes each =                  528
+   4 free 1-sized PyTupleObjects * 32 bytes each =                  128
+"""
+
+
+def test_parse():
+    stats = parse_debugmallocstats(DEBUGMALLOCSTATS)
+    assert stats['size_classes'] == [
+        {'class': 0, 'size': 16, 'pools': 1, 'blocks': 106, 'free_blocks': 915},
+        {'class': 1, 'size': 32, 'pools': 3, 'blocks': 1149, 'free_blocks': 381},
+    ]
+    assert stats['arenas'] == {
+        'arenas_allocated_total': 4,
+        'arenas_reclaimed': 0,
+        'arenas_highwater_mark': 4,
+        'arenas_allocated_current': 4,
+        'bytes_in_allocated_blocks': 3492304,
+        'bytes_in_available_blocks': 330176,
+        'unused_pools': 12,
+        'bytes_in_unused_pools': 196608,
+        'bytes_lost_to_pool_headers': 11280,
+        'bytes_lost_to_quantization': 16480,
+        'bytes_lost_to_arena_alignment': 49152,
+        'total': 4194304,
+    }
+    assert stats['arena_map'] == {'arena_map_mid_nodes': 1, 'bytes_lost_to_arena_map_root': 262144, 'total': 262144}
+    assert stats['free_lists'] == [
+        {'type': 'PyDictObjects', 'count': 11, 'size': 48, 'bytes': 528},
+        {'type': '1-sized PyTupleObjects', 'count': 4, 'size': 32, 'bytes': 128},
+    ]
+
+
+def test_capture():
+    output = capture_debugmallocstats()
+    assert 'free PyDictObjects' in output
+    os.fstat(2)  # still open
+
+
+def test_smaps_rollup(tmp_path):
+    path = tmp_path / 'smaps_rollup'
+    path.write_text(
+        '55eb926da000-7ffc2e364000 ---p 00000000 00:00 0                          [rollup]\n'
+        'Rss:                1420 kB\n'
+        'Private_Dirty:        100 kB\n'
+        'AnonHugePages:         0 kB\n'
+    )
+    assert smaps_rollup(str(path)) == {'rss': 1420 * 1024, 'private_dirty': 100 * 1024, 'anonhugepages': 0}
+    assert smaps_rollup(str(tmp_path / 'missing')) is None
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='Needs /proc/self/smaps_rollup')
+def test_malloc_stats():
+    stats = malloc_stats()
+    summary = stats['summary']
+    assert summary['rss'] > summary['pymalloc_arenas'] > summary['pymalloc_used'] > 0
+    assert 0 <= summary['pymalloc_fragmentation'] < 1
+    assert summary['other_anonymous'] == summary['anonymous'] - summary['pymalloc_arenas']
+    pymalloc = stats['pymalloc']
+    assert pymalloc['size_classes']
+    for size_class in pymalloc['size_classes']:
+        assert 0 <= size_class['utilization'] <= 1
+    assert pymalloc['used_bytes'] == pymalloc['arenas']['bytes_in_allocated_blocks']
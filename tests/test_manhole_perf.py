@@ -0,0 +1,60 @@
+import os
+import sys
+
+import pytest
+
+from manhole import perf
+
+needs_trampoline = pytest.mark.skipif(not perf.is_supported(), reason='Needs Python 3.12+ on Linux')
+
+
+@pytest.fixture
+def perf_map():
+    path = perf.perf_map_path()
+    yield path
+    if sys.is_stack_trampoline_active():
+        sys.deactivate_stack_trampoline()
+    if os.path.exists(path):
+        os.unlink(path)
+
+
+def test_perf_map_info(tmp_path):
+    path = tmp_path / 'perf.map'
+    assert perf.perf_map_info(str(path)) == {'path': str(path), 'size': None, 'entries': None}
+    path.write_text('7f37338b8000 b py::foo:<stdin>\n7f37338b800b b py::bar:<stdin>\n')
+    assert perf.perf_map_info(str(path)) == {'path': str(path), 'size': 62, 'entries': 2}
+
+
+@needs_trampoline
+def test_perf_window(perf_map):
+    statuses = []
+
+    def work(seconds):
+        def some_python_function():
+            return sum(range(10))
+
+        some_python_function()
+
+    result = perf.perf_window(0, started=statuses.append, wait=work)
+    [status] = statuses
+    assert status['active']
+    assert not result['active']
+    assert result['map']['path'] == perf_map
+    assert result['entries_added'] >= 1
+    with open(perf_map) as fh:
+        assert '.some_python_function:' in fh.read()
+
+
+@needs_trampoline
+def test_perf_window_already_active(perf_map):
+    perf.perf_trampoline()
+    assert perf.perf_status()['active']
+    assert perf.perf_window(0)['active']
+    assert not perf.perf_trampoline(enabled=False)['active']
+
+
+@pytest.mark.skipif(perf.is_supported(), reason='Needs Python < 3.12')
+def test_unsupported():
+    assert not perf.perf_status()['active']
+    with pytest.raises(RuntimeError, match='needs Python 3.12'):
+        perf.perf_window(0)
@@ -0,0 +1,60 @@
+import os
+import pstats
+import sys
+import threading
+import time
+
+from manhole.profiler import profile_all
+
+
+def fib(n):
+    return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+
+def busy(stop):
+    while not stop.is_set():
+        fib(12)
+        time.sleep(0.001)
+
+
+def test_profile_all(tmp_path):
+    stop = threading.Event()
+    results = []
+    profiling = threading.Thread(target=lambda: results.append(profile_all(duration=0.5, path=str(tmp_path / 'out.pstats'))))
+    profiling.start()
+    time.sleep(0.1)
+    # started while profiling so it's profiled on any Python version
+    worker = threading.Thread(target=busy, args=(stop,))
+    worker.start()
+    profiling.join()
+    stop.set()
+    worker.join()
+
+    (result,) = results
+    assert result['path'] == str(tmp_path / 'out.pstats')
+    assert result['threads'] >= 1
+    assert result['existing_threads'] == hasattr(threading, 'setprofile_all_threads')
+    assert result['calls'] > 100
+    functions = [entry['function'] for entry in result['by_cumulative']]
+    assert [function for function in functions if function.endswith('(busy)')]
+    (entry,) = (entry for entry in result['by_total'] if entry['function'].endswith('(fib)'))
+    assert entry['calls'] > entry['primitive_calls'] > 0
+    assert entry['cumtime'] >= entry['tottime'] > 0
+
+    stats = pstats.Stats(result['path'])
+    assert [key for key in stats.stats if key[2] == 'fib']
+
+
+def test_profile_all_cleanup():
+    profile_all(duration=0.1)
+    if hasattr(threading, 'getprofile'):
+        assert threading.getprofile() is None
+    assert sys.getprofile() is None
+
+
+def test_profile_all_default_path():
+    result = profile_all(duration=0.1)
+    try:
+        assert os.path.basename(result['path']).startswith(f'manhole-profile-{os.getpid()}-')
+    finally:
+        os.unlink(result['path'])
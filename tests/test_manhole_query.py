@@ -0,0 +1,39 @@
+import time
+
+import pytest
+
+from manhole.query import evaluate
+from manhole.query import json_size
+
+
+def test_evaluate():
+    result = evaluate('{"a": [1, 2.5, None, True]}', {})
+    assert result['json'] == {'a': [1, 2.5, None, True]}
+    assert result['repr'] == "{'a': [1, 2.5, None, True]}"
+    assert result['type'] == 'builtins.dict'
+    assert 'truncated' not in result
+
+    result = evaluate('x = 1', {})
+    assert result['json'] is None
+
+    assert evaluate('1 / 0', {})['error'] == 'ZeroDivisionError: division by zero'
+    assert 'json' not in evaluate('object()', {})
+
+
+def test_json_size():
+    assert json_size([1, 'ab', {'k': None}], 100) <= len('[1, "ab", {"k": null}]')
+    assert json_size(list(range(1000)), 100) is None
+    assert json_size('x' * 101, 100) is None
+    assert json_size(10**200, 100) is None
+    with pytest.raises(TypeError):
+        json_size([object()], 100)
+
+
+def test_evaluate_big_value():
+    namespace = {'big': {str(i): list(range(20)) for i in range(300000)}}
+    start = time.perf_counter()
+    result = evaluate('big', namespace, max_size=100)
+    assert time.perf_counter() - start < 0.1
+    assert result['truncated']
+    assert 'json' not in result
+    assert len(result['repr']) == 100
@@ -0,0 +1,53 @@
+import threading
+
+from manhole.refpath import ref_paths
+
+
+class Leaked:
+    pass
+
+
+class Holder:
+    def __init__(self):
+        self.items = {'users': [1, Leaked()]}
+
+
+holder = Holder()
+
+
+def test_ref_paths_global():
+    result = ref_paths(holder.items['users'][1])
+    assert result['stopped'] == 'done'
+    assert f"{__name__}.holder.items['users'][1]" in result['paths']
+
+
+def test_ref_paths_thread_locals():
+    target = Leaked()
+    ready = threading.Event()
+    stop = threading.Event()
+
+    def worker(value):
+        ready.set()
+        stop.wait()
+
+    thread = threading.Thread(target=worker, args=(target,), name='RefPathWorker')
+    thread.start()
+    try:
+        ready.wait()
+        result = ref_paths(target)
+    finally:
+        stop.set()
+        thread.join()
+    assert [path for path in result['paths'] if path.startswith('RefPathWorker:worker(') and path.endswith('.value')]
+
+
+def test_ref_paths_type():
+    result = ref_paths(Leaked)
+    assert f"{__name__}.holder.items['users'][1]" in result['paths']
+
+
+def test_ref_paths_budget():
+    result = ref_paths(holder.items['users'][1], max_visited=10)
+    assert result['stopped'] == 'max_visited'
+    assert result['visited'] == 10
+    assert result['paths'] == []
@@ -0,0 +1,119 @@
+import sys
+import threading
+
+import pytest
+
+import manhole
+from manhole.saferepr import SafeRepr
+from manhole.saferepr import format_locals
+
+
+class Expensive:
+    def __repr__(self):
+        raise AssertionError('__repr__ must not be called')
+
+
+class Trusted:
+    def __repr__(self):
+        return 'Trusted()'
+
+
+def test_builtins():
+    safe_repr = SafeRepr()
+    assert safe_repr(None) == 'None'
+    assert safe_repr(1.5) == '1.5'
+    assert safe_repr('abc') == "'abc'"
+    assert safe_repr(b'abc') == "b'abc'"
+    assert safe_repr([1, (2,), {3}, frozenset([4]), {5: [6]}]) == '[1, (2,), {3}, frozenset({4}), {5: [6]}]'
+    assert safe_repr(((), [], set(), frozenset(), {})) == '((), [], set(), frozenset(), {})'
+    assert safe_repr(range(3)) == 'range(0, 3)'
+
+
+def test_limits():
+    safe_repr = SafeRepr(max_size=30, max_items=3, max_level=2)
+    assert safe_repr('x' * 10**7) == "'" + 'x' * 26 + '...'
+    assert safe_repr(list(range(100))) == '[0, 1, 2, ... (100 items)]'
+    assert safe_repr({i: i for i in range(100)}) == '{0: 0, 1: 1, 2: 2, ... (100...'
+    assert safe_repr([[[[1]]]]) == '[[[...]]]'
+    assert safe_repr(2**5000) == '<int with 5001 bits>'
+
+
+def test_other_types():
+    expensive = Expensive()
+    assert SafeRepr()(expensive) == f'<{__name__}.Expensive object at {id(expensive):#x}>'
+    assert SafeRepr(types=(Trusted,))([Trusted()]) == '[Trusted()]'
+
+
+def test_changed_during_iteration():
+    value = {1: 2}
+    safe_repr = SafeRepr()
+    original = safe_repr.repr
+
+    def repr_and_mutate(obj, level):
+        if obj == 2:
+            value[len(value) + 1] = 0
+        return original(obj, level)
+
+    safe_repr.repr = repr_and_mutate
+    assert safe_repr(value) == '<repr failed: RuntimeError>'
+
+
+def test_format_locals_budget():
+    def frame_with_locals():
+        a = 'a' * 50  # noqa: F841
+        b = 'b' * 50  # noqa: F841
+        c = 'c' * 50  # noqa: F841
+        return sys._getframe()
+
+    frame = frame_with_locals()
+    lines, budget = format_locals(frame, SafeRepr(), 1000)
+    assert [line[:5] for line in lines] == ["a = '", "b = '", "c = '"]
+    assert budget == 1000 - 3 * 56
+    lines, budget = format_locals(frame, SafeRepr(), 60)
+    assert [line[:5] for line in lines] == ["a = '", "b = '", '... (']
+    assert lines[-1] == '... (locals budget exhausted)'
+
+
+@pytest.fixture
+def _installed(monkeypatch):
+    monkeypatch.setattr(manhole, '_MANHOLE', manhole.Manhole())
+
+
+def waiting_with_secret(event, secret):
+    payload = Expensive()  # noqa: F841
+    event.wait()
+
+
+@pytest.mark.usefixtures('_installed')
+def test_dump_stacktraces_locals(capsys):
+    event = threading.Event()
+    thread = threading.Thread(target=waiting_with_secret, args=(event, 'x' * 10**6))
+    thread.start()
+    try:
+        manhole.dump_stacktraces()
+        assert 'secret = ' not in capsys.readouterr().err
+        manhole.dump_stacktraces(show_locals=True, match='test_manhole_saferepr.waiting_*', max_repr=60)
+        output = capsys.readouterr().err
+    finally:
+        event.set()
+        thread.join()
+    assert '  event.wait()\n    event = <threading.Event object at 0x' in output
+    assert "    secret = '" + 'x' * 56 + '...\n' in output
+    assert '    payload = <test_manhole_saferepr.Expensive object at 0x' in output
+    assert '    self = ' not in output  # Event.wait doesn't match
+
+
+def deep(level):
+    filler = 'f' * 100  # noqa: F841
+    if level:
+        deep(level - 1)
+    else:
+        manhole.dump_stacktraces(show_locals=True, match=['*.deep'], max_total=500)
+
+
+@pytest.mark.usefixtures('_installed')
+def test_dump_stacktraces_budget(capsys):
+    deep(20)
+    output = capsys.readouterr().err
+    assert output.count('    filler = ') == 5
+    assert output.count('    ... (locals budget exhausted)') == 16
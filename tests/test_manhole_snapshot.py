@@ -0,0 +1,145 @@
+import os
+import threading
+import time
+
+import pytest
+
+from manhole.snapshot import SnapshotReader
+from manhole.snapshot import main
+from manhole.snapshot import snapshot
+
+
+def parked(event, label):
+    big = 'x' * 10000
+    event.wait()
+    return big, label
+
+
+@pytest.fixture
+def parked_thread():
+    event = threading.Event()
+    thread = threading.Thread(target=parked, args=(event, 'parked-label'), name='Parked')
+    thread.start()
+    yield thread
+    event.set()
+    thread.join()
+
+
+def test_snapshot(tmp_path, parked_thread):
+    path = str(tmp_path / 'process.snap')
+    result = snapshot(path, max_repr=50)
+    assert result['path'] == path
+    assert result['size'] == os.path.getsize(path)
+    assert result['elapsed'] > 0
+    assert os.listdir(tmp_path) == ['process.snap']
+
+    with SnapshotReader(path) as reader:
+        assert reader.section('meta')['pid'] == os.getpid()
+        assert (parked_thread.ident, 'Parked') in reader.threads()
+        thread = reader.thread('Parked')
+        assert thread == reader.thread(parked_thread.ident) == reader.thread(str(parked_thread.ident))
+        frame = thread['frames'][-3]  # parked -> Event.wait -> Condition.wait
+        assert frame['name'] == 'parked'
+        assert frame['line'] == 'event.wait()'
+        assert frame['locals']['label'] == "'parked-label'"
+        assert len(frame['locals']['big']) <= 50
+        with pytest.raises(KeyError):
+            reader.thread('Missing')
+        assert reader.section('gc')['threshold'] == list(__import__('gc').get_threshold())
+        assert any(name == 'manhole.snapshot' for name, _, _ in reader.section('modules'))
+        types = reader.section('types')
+        assert types['objects'] > 0
+        assert any(name == 'builtins.function' for name, _ in types['top'])
+
+
+class SlowRepr:
+    def __repr__(self):
+        time.sleep(1)
+        return 'slow' * 10**6
+
+
+def parked_with_slow_repr(event):
+    slow = SlowRepr()  # noqa: F841
+    event.wait()
+
+
+def test_snapshot_slow_repr(tmp_path):
+    event = threading.Event()
+    thread = threading.Thread(target=parked_with_slow_repr, args=(event,), name='SlowRepr')
+    thread.start()
+    try:
+        path = str(tmp_path / 'process.snap')
+        result = snapshot(path, types=False)
+    finally:
+        event.set()
+        thread.join()
+    assert result['elapsed'] < 0.5
+    with SnapshotReader(path) as reader:
+        frame = reader.thread('SlowRepr')['frames'][-3]
+    assert frame['name'] == 'parked_with_slow_repr'
+    assert frame['locals']['slow'].startswith('<test_manhole_snapshot.SlowRepr object at 0x')
+
+
+def test_snapshot_limits(tmp_path):
+    path = str(tmp_path / 'process.snap')
+
+    def many_locals():
+        a = b = c = d = 1  # noqa: F841
+        snapshot(path, max_locals=2, types=False)
+
+    many_locals()
+    with SnapshotReader(path) as reader:
+        assert 'types' not in reader
+        frame = reader.thread(threading.current_thread().name)['frames'][-2]
+        assert frame['name'] == 'many_locals'
+        assert len(frame['locals']) == 3
+        assert frame['locals']['...'] == '3 more'
+
+
+def test_snapshot_default_path():
+    result = snapshot(types=False)
+    try:
+        assert os.path.basename(result['path']).startswith(f'manhole-snapshot-{os.getpid()}-')
+    finally:
+        os.unlink(result['path'])
+
+
+def test_reader_errors(tmp_path):
+    path = tmp_path / 'bogus.snap'
+    path.write_bytes(b'not a snapshot at all, really not')
+    with pytest.raises(ValueError, match='is not a manhole snapshot'):
+        SnapshotReader(str(path))
+
+    snapshot(str(path), types=False)
+    path.write_bytes(path.read_bytes()[:-1])
+    with pytest.raises(ValueError, match='is truncated'):
+        SnapshotReader(str(path))
+
+
+def test_cli(tmp_path, parked_thread, capsys):
+    path = str(tmp_path / 'process.snap')
+    snapshot(path)
+
+    main([path, '--types', '3'])
+    output = capsys.readouterr().out
+    assert output.startswith(f'PID: {os.getpid()} | taken: ')
+    assert f'{parked_thread.ident:>16}  Parked\n' in output
+    assert 'GC: enabled: True | counts: ' in output
+    assert 'objects tracked by the GC):\n' in output
+
+    main([path, '--thread', 'Parked'])
+    output = capsys.readouterr().out
+    assert output.startswith(f'######### Thread Parked ({parked_thread.ident}) #########\n')
+    assert ', in parked\n  event.wait()\n' in output
+    assert "    label = 'parked-label'\n" in output
+
+    main([path, '--modules'])
+    assert '\nmanhole.snapshot  ' in capsys.readouterr().out
+
+    with pytest.raises(SystemExit):
+        main([path, '--thread', 'Missing'])
+    assert "no thread 'Missing' in the snapshot" in capsys.readouterr().err
+
+    with pytest.raises(SystemExit):
+        main([str(tmp_path / 'missing.snap')])
+    assert 'No such file or directory' in capsys.readouterr().err
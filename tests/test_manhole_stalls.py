@@ -0,0 +1,79 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from manhole.stalls import StallWatchdog
+from manhole.stalls import snapshot
+
+
+def blocking_sleep(seconds):
+    time.sleep(seconds)
+
+
+def wait_for_stall(watchdog, timeout=5):
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        stalls = watchdog.stalls()
+        if stalls and stalls[-1]['duration'] is not None:
+            return stalls
+        time.sleep(0.01)
+    pytest.fail(f'No stall recorded: {watchdog.stalls()}')
+
+
+def test_snapshot():
+    stacks = snapshot(30)
+    stack = stacks[threading.current_thread().name]
+    assert stack[-1].endswith(' in snapshot')
+    assert stack[-2].startswith(f'{__file__}:')
+    assert stack[-2].endswith(' in test_snapshot')
+    assert len(snapshot(2)[threading.current_thread().name]) == 2
+
+
+def test_heartbeat():
+    watchdog = StallWatchdog(threshold=0.1).start()
+    try:
+        watchdog.heartbeat()
+        blocking_sleep(0.4)
+        watchdog.heartbeat()
+        stalls = wait_for_stall(watchdog)
+    finally:
+        watchdog.stop()
+    assert watchdog.manual
+    assert len(stalls) == 1
+    assert 0.3 < stalls[0]['duration'] < 1
+    assert stalls[0]['started'] < time.time()
+    stack = stalls[0]['stacks'][threading.current_thread().name]
+    assert stack[-1].endswith(' in blocking_sleep')
+    assert 'ManholeStallWatchdog' not in stalls[0]['stacks']
+
+
+def test_event_loop():
+    watchdog = StallWatchdog(threshold=0.1).start()
+
+    async def main():
+        while watchdog.loop is None:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.1)
+        blocking_sleep(0.4)
+        await asyncio.sleep(0.1)
+
+    try:
+        asyncio.run(main())
+        stalls = wait_for_stall(watchdog)
+    finally:
+        watchdog.stop()
+    assert not watchdog.manual
+    assert len(stalls) == 1
+    assert 0.3 < stalls[0]['duration'] < 1
+    stack = stalls[0]['stacks'][threading.current_thread().name]
+    assert stack[-2].endswith(' in main')
+    assert stack[-1].endswith(' in blocking_sleep')
+
+
+def test_stalls_not_enabled():
+    from manhole.stalls import stalls
+
+    with pytest.raises(RuntimeError, match='stall watchdog is not enabled'):
+        stalls()
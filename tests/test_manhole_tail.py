@@ -0,0 +1,126 @@
+import io
+import logging
+import socket
+import sys
+import threading
+
+import pytest
+
+from manhole.channel import format_request
+from manhole.channel import recv_frame
+from manhole.tail import Tail
+from manhole.tail import handle_request
+
+
+@pytest.fixture
+def logger():
+    logger = logging.getLogger('test_manhole_tail')
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    return logger
+
+
+def test_records(logger):
+    with Tail(level=logging.INFO, logger='test_manhole_tail', streams=()) as tail:
+        logger.debug('hidden')
+        logger.info('visible %s', 1)
+        try:
+            raise ZeroDivisionError('division by zero')
+        except ZeroDivisionError:
+            logger.exception('failed')
+        logging.getLogger('test_manhole_tail.child').warning('from child')
+    logger.info('after stop')
+    assert tail.handler not in logger.handlers
+    assert isinstance(tail.queue[1][-1], str)  # the traceback (and its frames) isn't kept
+    records = tail.drain()
+    assert [(record['level'], record['logger'], record['message']) for record in records] == [
+        ('INFO', 'test_manhole_tail', 'visible 1'),
+        ('ERROR', 'test_manhole_tail', 'failed'),
+        ('WARNING', 'test_manhole_tail.child', 'from child'),
+    ]
+    assert records[1]['exception'].endswith('ZeroDivisionError: division by zero')
+    assert 'exception' not in records[0]
+    assert tail.drain() == []
+
+
+def test_drop_oldest(logger):
+    with Tail(size=3, logger='test_manhole_tail', streams=()) as tail:
+        for i in range(10):
+            logger.info('record %s', i)
+    assert [record['message'] for record in tail.drain()] == ['record 7', 'record 8', 'record 9']
+    assert tail.dropped == 7
+
+
+def test_sample(logger):
+    with Tail(sample=0.0, logger='test_manhole_tail', streams=()) as tail:
+        logger.warning('sampled out')
+    assert tail.drain() == []
+    assert tail.dropped == 0
+
+
+def test_no_handler_lock(logger):
+    with Tail(logger='test_manhole_tail', streams=()) as tail:
+        tail.handler.lock = None  # would blow up if logging.Handler.handle was used
+        logger.info('no lock')
+    assert [record['message'] for record in tail.drain()] == ['no lock']
+
+
+def test_streams(monkeypatch):
+    stdout = io.StringIO()
+    monkeypatch.setattr(sys, 'stdout', stdout)
+    with Tail(streams=('stdout',)) as tail:
+        print('hello', 'world')
+        sys.stdout.flush()
+        assert sys.stdout.getvalue() == 'hello world\n'
+        wrapper = sys.stdout
+        monkeypatch.setattr(sys, 'stdout', io.StringIO())  # eg: the REPL swapped it
+        monkeypatch.setattr(sys, 'stdout', wrapper)
+    assert sys.stdout is stdout
+    records = tail.drain()
+    assert {record['source'] for record in records} == {'stdout'}
+    assert ''.join(record['message'] for record in records) == 'hello world\n'
+    print('after')
+    assert tail.drain() == []
+    assert stdout.getvalue() == 'hello world\nafter\n'
+
+
+def test_stale_tee(monkeypatch):
+    monkeypatch.setattr(sys, 'stderr', io.StringIO())
+    tail = Tail(streams=('stderr',)).start()
+    tee = sys.stderr
+    replacement = io.StringIO()
+    monkeypatch.setattr(sys, 'stderr', replacement)
+    tail.stop()
+    assert sys.stderr is replacement
+    tee.write('passthrough')
+    assert tail.drain() == []
+    assert tee.stream.getvalue() == 'passthrough'
+
+
+def test_handle_request(logger):
+    server, client = socket.socketpair()
+    kwargs = {'level': 'warning', 'logger': 'test_manhole_tail', 'streams': False, 'interval': 0.01}
+    thread = threading.Thread(target=handle_request, args=(server,), kwargs=kwargs)
+    thread.start()
+    tail_handlers = []
+    try:
+        _, message = recv_frame(client)
+        assert message == {'level': 'WARNING', 'sample': 1.0, 'size': 10000, 'logger': 'test_manhole_tail'}
+        logger.info('too low')
+        logger.warning('sent')
+        _, message = recv_frame(client)
+        assert [record['message'] for record in message['records']] == ['sent']
+        assert message['dropped'] == 0
+        tail_handlers.extend(handler for handler in logger.handlers if type(handler).__name__ == 'TailHandler')
+        assert len(tail_handlers) == 1
+    finally:
+        client.close()
+        thread.join()
+        server.close()
+    assert tail_handlers[0] not in logger.handlers
+
+
+def test_bad_level():
+    with pytest.raises(ValueError, match="Unknown logging level 'LOUD'."):
+        handle_request(None, level='LOUD')
+    assert format_request('tail', level='INFO').startswith(b'\x00manhole:tail ')
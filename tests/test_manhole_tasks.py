@@ -0,0 +1,64 @@
+import asyncio
+import threading
+
+from manhole.tasks import asyncio_tasks
+
+
+async def wait_for(event):
+    await event.wait()
+
+
+async def waiter(event):
+    await wait_for(event)
+
+
+async def sleeper():
+    await asyncio.sleep(60)
+
+
+def run_loop(loop, ready):
+    asyncio.set_event_loop(loop)
+    loop.call_soon(ready.set)
+    loop.run_forever()
+
+
+def test_asyncio_tasks():
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    thread = threading.Thread(target=run_loop, args=(loop, ready), name='LoopThread')
+    thread.start()
+    try:
+        ready.wait()
+
+        async def spawn():
+            event = asyncio.Event()
+            tasks = [loop.create_task(waiter(event), name=f'waiter-{i}') for i in range(5)]
+            tasks.append(loop.create_task(sleeper(), name='sleeper'))
+            return tasks
+
+        tasks = asyncio.run_coroutine_threadsafe(spawn(), loop).result()  # the loop only keeps weak references
+
+        result = asyncio_tasks()
+        (loop_info,) = (info for info in result['loops'] if info['thread'] == 'LoopThread')
+        assert loop_info['tasks'] == len(tasks) == 6
+        first, second = result['groups'][:2]
+        assert first['count'] == 5
+        assert first['states'] == {'pending': 5}
+        assert first['stack'][0].endswith(' in waiter')
+        assert first['stack'][1].endswith(' in wait_for')
+        assert first['stack'][2].endswith(' in wait')
+        assert sorted(first['tasks']) == [f'waiter-{i}' for i in range(5)]
+        assert [description for description in first['awaiting'] if description.startswith('<Future pending')]
+        assert second['count'] == 1
+        assert second['tasks'] == ['sleeper']
+        assert second['stack'][-1].endswith(' in sleep')
+
+        again = asyncio_tasks()
+        assert again['groups'][0]['oldest'] > 0
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        for task in asyncio.all_tasks(loop):
+            task.cancel()
+        loop.run_until_complete(asyncio.sleep(0))
+        loop.close()
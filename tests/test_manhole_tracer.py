@@ -0,0 +1,155 @@
+import asyncio
+import sys
+import threading
+import time
+
+import pytest
+
+from manhole import tracer
+from manhole.tracer import trace_latency
+
+
+def work(delay, label='x'):
+    time.sleep(delay)
+    return label
+
+
+def fail(delay):
+    time.sleep(delay)
+    raise ValueError(delay)
+
+
+async def work_async(delay):
+    await asyncio.sleep(delay)
+    return delay
+
+
+def work_generator(count):
+    yield from range(count)
+
+
+def run_traced(calls, *targets, **kwargs):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(trace_latency(*targets, duration=0.5, **kwargs)))
+    thread.start()
+    time.sleep(0.1)
+    calls()
+    thread.join()
+    return results[0]
+
+
+@pytest.fixture(params=['default', 'trampoline'])
+def backend(request, monkeypatch):
+    if request.param == 'trampoline':
+        monkeypatch.setattr(tracer, 'MonitoringBackend', tracer.TrampolineBackend)
+    return request.param
+
+
+def test_trace_latency(backend):
+    def calls():
+        for delay in (0.001, 0.002, 0.05, 0.001):
+            work(delay)
+        work(0.02, label='slow')
+        for delay in (0.001, 0.03):
+            with pytest.raises(ValueError, match=str(delay)):
+                fail(delay)
+
+    result = run_traced(calls, work, f'{__name__}:fail', slowest=2)
+    assert result['backend'] == ('trampoline' if backend == 'trampoline' or not hasattr(sys, 'monitoring') else 'sys.monitoring')
+    stats = result['functions'][f'{__name__}.work']
+    assert stats['count'] == 5
+    assert stats['errors'] == 0
+    assert stats['max'] >= 0.05
+    assert [call['elapsed'] >= 0.02 for call in stats['slowest']] == [True, True]
+    assert '0.05' in stats['slowest'][0]['arguments']
+    assert "'slow'" in stats['slowest'][1]['arguments']
+    stats = result['functions'][f'{__name__}.fail']
+    assert stats['count'] == stats['errors'] == 2
+    assert stats['slowest'][0]['error']
+    assert 0.03 <= stats['slowest'][0]['elapsed'] < 0.2
+    assert '0.03' in stats['slowest'][0]['arguments']
+    # restored
+    assert work.__code__.co_name == 'work'
+    assert work(0, 'y') == 'y'
+
+
+def test_trace_latency_async_and_generators(backend):
+    def calls():
+        assert asyncio.run(work_async(0.01)) == 0.01
+        assert list(work_generator(3)) == [0, 1, 2]
+
+    result = run_traced(calls, work_async, work_generator)
+    assert result['functions'][f'{__name__}.work_async']['count'] == 1
+    assert result['functions'][f'{__name__}.work_async']['min'] >= 0.01
+    assert result['functions'][f'{__name__}.work_generator']['count'] == 1
+
+
+def test_trace_latency_function_replaced(backend, monkeypatch):
+    original = work
+
+    def replacement(delay, label='x'):
+        return 'replacement'
+
+    def calls():
+        assert work(0.001) == 'x'
+        monkeypatch.setattr(sys.modules[__name__], 'work', replacement)  # like a reload would do
+        assert work(0.001) == 'replacement'
+        assert original(0.001) == 'x'
+
+    result = run_traced(calls, work)
+    assert result['functions'][f'{__name__}.work']['count'] == 2
+    assert original.__code__.co_name == 'work'
+    assert original(0, 'y') == 'y'
+    assert replacement(0) == 'replacement'
+
+
+def test_trace_latency_code_replaced(backend):
+    def function():
+        return 'before'
+
+    def other():
+        return 'after'
+
+    def calls():
+        assert function() == 'before'
+        function.__code__ = other.__code__
+
+    result = run_traced(calls, function)
+    assert result['functions'][f'{function.__module__}.{function.__qualname__}']['count'] == 1
+    assert function.__code__ is other.__code__
+    assert function() == 'after'
+
+
+def test_trace_latency_generator_errors(backend):
+    def broken_generator():
+        yield 1
+        time.sleep(0.02)
+        raise ValueError('broken')
+
+    def calls():
+        generator = broken_generator()
+        assert next(generator) == 1
+        time.sleep(0.05)  # suspended, not failed
+        with pytest.raises(ValueError, match='broken'):
+            next(generator)
+
+    result = run_traced(calls, broken_generator)
+    stats = result['functions'][f'{broken_generator.__module__}.{broken_generator.__qualname__}']
+    assert stats['count'] == stats['errors'] == 1
+    assert stats['slowest'][0]['elapsed'] >= 0.07
+
+
+def test_trace_latency_busy():
+    thread = threading.Thread(target=trace_latency, args=(work,), kwargs={'duration': 0.3})
+    thread.start()
+    time.sleep(0.1)
+    try:
+        with pytest.raises(RuntimeError, match='Already tracing'):
+            trace_latency(work, duration=0.1)
+    finally:
+        thread.join()
+
+
+def test_trace_latency_not_python():
+    with pytest.raises(TypeError):
+        trace_latency(len, duration=0.1)
@@ -0,0 +1,126 @@
+import hashlib
+import linecache
+import sys
+
+import pytest
+
+import manhole
+from manhole import upload
+from manhole.guard import CommandGuard
+from manhole.upload import get_code
+from manhole.upload import run_code
+
+
+class Output:
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, text):
+        self.chunks.append(text)
+
+    def flush(self):
+        pass
+
+    @property
+    def text(self):
+        return ''.join(self.chunks)
+
+
+@pytest.fixture(autouse=True)
+def _installed(monkeypatch):
+    monkeypatch.setattr(manhole, '_MANHOLE', manhole.Manhole())
+    manhole._MANHOLE.locals = {'answer': 42}
+    monkeypatch.setattr(upload, '_CACHE', upload.OrderedDict())
+
+
+def code_for(source, filename='script.py'):
+    source = source.encode()
+    return get_code(hashlib.sha256(source).hexdigest(), filename, lambda: source)
+
+
+def test_cache():
+    source = b'x = 1\n'
+    digest = hashlib.sha256(source).hexdigest()
+    fetched = []
+
+    def fetch():
+        fetched.append(True)
+        return source
+
+    code, cached = get_code(digest, 'script.py', fetch)
+    assert not cached
+    assert code.co_filename == f'script.py@{digest[:12]}'
+    assert linecache.getline(code.co_filename, 1) == 'x = 1\n'
+    assert get_code(digest, 'script.py', fetch) == (code, True)
+    assert fetched == [True]
+
+
+def test_cache_eviction(monkeypatch):
+    monkeypatch.setattr(upload, 'CACHE_SIZE', 2)
+    first, _ = code_for('a = 1\n')
+    second, _ = code_for('b = 2\n')
+    code_for('a = 1\n')  # moves it to the end
+    third, _ = code_for('c = 3\n')
+    assert [code.co_filename for code in upload._CACHE.values()] == [first.co_filename, third.co_filename]
+    assert second.co_filename not in linecache.cache
+
+
+def test_digest_mismatch():
+    with pytest.raises(ValueError, match=r"The source of 'script.py' has the SHA-256 \w+, expected bogus."):
+        get_code('bogus', 'script.py', lambda: b'pass\n')
+    assert not upload._CACHE
+
+
+def test_run_script():
+    code, _ = code_for('print(__name__, answer)\nprint("to", "stderr", file=sys.stderr)\nresult = dump_stacktraces\n')
+    output = Output()
+    assert run_code(code, output) is None
+    assert output.text == '__main__ 42\n'
+    assert 'result' not in manhole._MANHOLE.locals
+
+
+def test_run_script_error():
+    code, _ = code_for('def fail():\n    raise RuntimeError("boom")\n\nfail()\n', 'failing.py')
+    output = Output()
+    assert run_code(code, output) == 'RuntimeError: boom'
+    assert output.text.startswith('Traceback (most recent call last):\n  File "failing.py@')
+    assert '    raise RuntimeError("boom")\n' in output.text
+    assert 'upload.py' not in output.text
+
+
+def test_run_script_exit():
+    code, _ = code_for('import sys\nprint("before")\nsys.exit()\nprint("after")\n')
+    output = Output()
+    assert run_code(code, output) is None
+    assert output.text == 'before\n'
+
+    code, _ = code_for('raise SystemExit("bad arguments")\n')
+    assert run_code(code, Output()) == 'SystemExit: bad arguments'
+
+
+def test_run_script_guard():
+    code, _ = code_for('while True:\n    pass\n')
+    guard = CommandGuard(timeout=0.1)
+    try:
+        error = run_code(code, Output(), guard=guard)
+    finally:
+        guard.close()
+    assert error == 'Interrupted: the command ran for more than 0.1 seconds (command_timeout).'
+
+
+def test_inject_module():
+    code, _ = code_for('VALUE = 1\nprint("loaded")\ndef show():\n    return print\n', 'injected_module.py')
+    output = Output()
+    try:
+        assert run_code(code, output, module='injected_module') is None
+        import injected_module
+
+        assert injected_module.VALUE == 1
+        assert injected_module.show() is print
+        assert output.text == 'loaded\n'
+
+        broken, _ = code_for('VALUE = 2\n1 / 0\n', 'injected_module.py')
+        assert run_code(broken, output, module='injected_module') == 'ZeroDivisionError: division by zero'
+        assert sys.modules['injected_module'] is injected_module
+    finally:
+        sys.modules.pop('injected_module', None)